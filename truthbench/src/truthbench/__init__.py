@@ -1,4 +1,4 @@
-from .truth_pipeline import truth_pipeline
-from .pipeline import Pipeline, Step, Reader, LLM
+from .truth_pipeline import truth_pipeline, truth_sweep
+from .pipeline import Pipeline, Sweep, Step, Reader, LLM, AsyncLLM
 
-__all__ = ["truth_pipeline", "Pipeline", "Step", "Reader", "LLM"]
+__all__ = ["truth_pipeline", "truth_sweep", "Pipeline", "Sweep", "Step", "Reader", "LLM", "AsyncLLM"]
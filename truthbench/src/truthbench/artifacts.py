@@ -0,0 +1,72 @@
+import hashlib
+import json
+import pathlib
+import sqlite3
+import threading
+import time
+from typing import Dict, Any, Optional, Iterable
+
+
+class ArtifactStore:
+    """
+    A persistent store of the outputs of pipeline steps backed by SQLite, to rebuild datasets incrementally.
+
+    The outputs of a step for a sample are keyed on the fingerprint of the step (its class and parameters, see
+    `Step.fingerprint`) plus the values of the fields it requires in the sample. When a pipeline runs again,
+    every step whose fingerprint and inputs did not change reuses its stored outputs instead of running, like
+    `make` does for files. Changing the prompt of a step thus only recomputes that step and, if its outputs
+    changed, the steps after it (see `Pipeline`'s `artifacts`).
+
+    The store can be shared by several pipelines and threads.
+
+    Parameters:
+        path (pathlib.Path): Location of the SQLite database. It is created if it does not exist.
+    """
+
+    def __init__(self, path: pathlib.Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS artifacts ("
+            "key TEXT PRIMARY KEY, outputs TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+
+    @staticmethod
+    def key(fingerprint: str, sample: Dict[str, Any], fields: Iterable[str]) -> str:
+        """
+        Key of the outputs of the step with the given fingerprint for a sample, given the fields it reads.
+        """
+        inputs = {field: sample.get(field) for field in fields}
+        payload = json.dumps({"step": fingerprint, "inputs": inputs}, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Look up the outputs of a step.
+
+        Returns:
+            Optional[Dict[str, Any]]: The stored fields, or None if there are none.
+        """
+        with self._lock:
+            row = self._connection.execute("SELECT outputs FROM artifacts WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def put(self, key: str, outputs: Dict[str, Any]) -> None:
+        """
+        Store the outputs of a step, replacing any previous ones.
+        """
+        payload = json.dumps(outputs, ensure_ascii=False)
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO artifacts (key, outputs, created_at) VALUES (?, ?, ?)",
+                (key, payload, time.time())
+            )
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM artifacts").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
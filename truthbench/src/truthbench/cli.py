@@ -1,9 +1,146 @@
 import argparse
+import asyncio
+import json
 import pathlib
+from typing import Iterator, Tuple, Dict, Any, Optional, Union, IO, List
 
 import truthbench
-from truthbench.models import Report, Tracker, Sample
+from truthbench.artifacts import ArtifactStore
+from truthbench.journal import Journal
+from truthbench.llms.adaptive import AdaptiveConcurrency, AdaptiveConcurrencyLLM, AsyncAdaptiveConcurrencyLLM
+from truthbench.llms.cache import ResponseCache, CachedLLM, AsyncCachedLLM
+from truthbench.llms.ratelimit import RateLimiter, AsyncRateLimitedLLM
+from truthbench.llms.resilient import ResilientLLM, AsyncResilientLLM
+from truthbench.models import Report, Tracker, Sample, Item, Summary
+from truthbench.pipeline import Pipeline, Reader, LLM, AsyncLLM
 from truthbench.readers.json_reader import JsonReader
+from truthbench.readers.jsonl_reader import JsonLinesReader
+from truthbench.truth_pipeline import openai_llm
+
+
+def run_journaled(
+        pipeline: Pipeline, reader: Reader, journal: Journal, resume: bool = False
+) -> Iterator[Tuple[Dict[str, Any], Dict[str, int]]]:
+    """
+    Run the pipeline recording every finished sample in the journal.
+
+    When resuming, samples already in the journal are yielded first without being processed again, followed
+    by the remaining samples of the reader. Otherwise, the journal is cleared before starting.
+    """
+    if resume:
+        done, tracker = journal.recover()
+    else:
+        journal.clear()
+        done, tracker = 0, {}
+
+    yield from journal.entries()
+
+    with journal:
+        for sample, tracker in pipeline.stream(reader, skip=done, tracker=tracker):
+            journal.append(sample, tracker)
+            yield sample, tracker
+
+
+def summarize(
+        pipeline: Pipeline,
+        tracker: Dict[str, int],
+        llm: Optional[Union[LLM, AsyncLLM]] = None,
+        concurrency: Optional[AdaptiveConcurrency] = None,
+) -> Dict[str, Any]:
+    """
+    Collect the run-level information reported next to the processed samples. Counters collected by the LLM
+    (see `LLM.stats`) are reported along with those of the tracker, as well as the decisions of the adaptive
+    concurrency controller, if any.
+    """
+    counters = dict(tracker)
+    for key, value in (llm.stats() if llm is not None else {}).items():
+        counters[key] = counters.get(key, 0) + value
+
+    return {
+        "report": Tracker(**counters),
+        "stages": pipeline.stage_stats or None,
+        "steps": pipeline.step_metrics or None,
+        "concurrency": concurrency.report() if concurrency is not None else None,
+    }
+
+
+def write_dead_letter(file: IO[str], sample: Dict[str, Any]) -> None:
+    """
+    Append the sample to the dead-letter file if a step failed on it (see `Pipeline`'s `isolate_failures`), along
+    with the state it reached, so it can be inspected or processed again.
+    """
+    if "error" in sample:
+        file.write(json.dumps(sample, ensure_ascii=False) + "\n")
+        file.flush()
+
+
+def write_outputs(
+        output_dir: pathlib.Path, summary: Dict[str, Any], samples: List[Dict[str, Any]]
+) -> None:
+    """
+    Write the processing traces of a run to `report.json`, its valid samples to `dataset.json` and its failed
+    samples to `dead_letter.jsonl`.
+    """
+    report = Report(**summary, questions=[Sample(**s) for s in samples])
+    dataset = report.to_dataset()
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+    with open(output_dir / "report.json", "w", encoding="utf-8") as f:
+        f.write(report.model_dump_json(indent=4))
+
+    with open(output_dir / "dataset.json", "w", encoding="utf-8") as f:
+        f.write(dataset.model_dump_json(indent=4))
+
+    with open(output_dir / "dead_letter.jsonl", "w", encoding="utf-8") as f:
+        for sample in samples:
+            write_dead_letter(f, sample)
+
+
+def parse_configuration(value: str) -> Tuple[float, int]:
+    """
+    Parse a "KEEP:LEVELS" configuration of `--sweep`.
+    """
+    try:
+        keep, num_levels = value.split(":")
+        return float(keep), int(num_levels)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Expected KEEP:LEVELS (e.g., 0.8:5), but got {value!r}")
+
+
+def stream_to_disk(
+        pipeline: Pipeline,
+        reader: Reader,
+        output_dir: pathlib.Path,
+        resume: bool = False,
+        llm: Optional[Union[LLM, AsyncLLM]] = None,
+        concurrency: Optional[AdaptiveConcurrency] = None,
+) -> None:
+    """
+    Run the pipeline writing each sample to disk as soon as it is finished.
+
+    Processing traces are appended to `report.jsonl`, valid samples to `dataset.jsonl` and failed samples to
+    `dead_letter.jsonl` (one JSON object per line), while the counters are written to `summary.json` once the run
+    is over. These files are rebuilt from the journal when resuming an interrupted run.
+    """
+    journal = Journal(output_dir / "journal.jsonl")
+    tracker = {}
+    next_id = 0
+    with open(output_dir / "report.jsonl", "w", encoding="utf-8") as report_file, \
+            open(output_dir / "dataset.jsonl", "w", encoding="utf-8") as dataset_file, \
+            open(output_dir / "dead_letter.jsonl", "w", encoding="utf-8") as dead_letter_file:
+        for s, tracker in run_journaled(pipeline, reader, journal, resume):
+            write_dead_letter(dead_letter_file, s)
+            sample = Sample(**s)
+            report_file.write(sample.model_dump_json() + "\n")
+            report_file.flush()
+
+            if sample.is_valid():
+                dataset_file.write(Item.from_sample(id_=next_id, sample=sample).model_dump_json() + "\n")
+                dataset_file.flush()
+                next_id += 1
+
+    with open(output_dir / "summary.json", "w", encoding="utf-8") as f:
+        f.write(Summary(**summarize(pipeline, tracker, llm, concurrency)).model_dump_json(indent=4))
 
 
 def main() -> None:
@@ -14,7 +151,7 @@ def main() -> None:
     )
     parser.add_argument(
         "--input-file", "-i", required=True, type=pathlib.Path,
-        help="Input json dataset containing questions and ground truths"
+        help="Input json (or jsonl, one sample per line) dataset containing questions and ground truths"
     )
     parser.add_argument(
         "--keep", "-k", default=.8, type=float,
@@ -24,22 +161,220 @@ def main() -> None:
         "--num-levels", "-l", default=5, type=int,
         help="Number of perturbation levels to produce A0-AX"
     )
+    parser.add_argument(
+        "--sweep", nargs="+", type=parse_configuration, metavar="KEEP:LEVELS",
+        help="Build one dataset per configuration of --keep and --num-levels (e.g., --sweep 0.8:5 0.6:3), sharing "
+             "paraphrasing, parsing and ranking between them. Each one is written to its own subdirectory"
+    )
+    parser.add_argument(
+        "--workers", "-w", default=1, type=int,
+        help="Number of samples processed concurrently"
+    )
+    parser.add_argument(
+        "--batch-size", "-b", default=1, type=int,
+        help="Number of samples going through each step together (e.g., parsed in a single spaCy call)"
+    )
+    parser.add_argument(
+        "--staged", action="store_true",
+        help="Run each step in its own thread, connected by bounded queues, so that parsing overlaps LLM calls"
+    )
+    parser.add_argument(
+        "--parallel-steps", action="store_true",
+        help="Run steps that do not depend on each other concurrently on the same samples (e.g., blacklisting "
+             "while ranking)"
+    )
+    parser.add_argument(
+        "--processes", "-p", default=0, type=int,
+        help="Number of worker processes parsing factual data with spaCy (0 parses in the main process)"
+    )
+    parser.add_argument(
+        "--max-in-flight", default=None, type=int,
+        help="Run the pipeline on an asyncio event loop with at most this number of samples in flight"
+    )
+    parser.add_argument(
+        "--batch-api", action="store_true",
+        help="Send LLM requests through the OpenAI Batch API, one batch per step (runs on an asyncio event loop)"
+    )
+    parser.add_argument(
+        "--llm-timeout", default=120., type=float,
+        help="Deadline in seconds of each LLM request, after which it is retried"
+    )
+    parser.add_argument(
+        "--llm-max-retries", default=5, type=int,
+        help="Maximum number of retries of an LLM request failing with a rate limit, server error or timeout"
+    )
+    parser.add_argument(
+        "--adaptive-concurrency", default=None, type=int, metavar="MAX",
+        help="Adapt the number of concurrent LLM requests (up to MAX) to the latency and rate limits observed. "
+             "Run with at least MAX workers (or samples in flight)"
+    )
+    parser.add_argument(
+        "--rpm", default=None, type=float,
+        help="Requests per minute allowed by the provider for the model. LLM requests are paced to stay under it"
+    )
+    parser.add_argument(
+        "--tpm", default=None, type=float,
+        help="Tokens per minute allowed by the provider for the model. LLM requests are paced to stay under it"
+    )
+    parser.add_argument(
+        "--early-stop", action="store_true",
+        help="Stream the LLM responses of the ranking and noise steps and stop them as soon as their output is "
+             "complete, saving latency and completion tokens"
+    )
+    parser.add_argument(
+        "--rank-candidates", default=1, type=int,
+        help="Number of alternative rankings requested at once for each sample, keeping the first valid one "
+             "instead of retrying invalid rankings one after another"
+    )
+    parser.add_argument(
+        "--repair-rankings", action="store_true",
+        help="Repair near-miss rankings (duplicated or missing indices, trailing text, code fences) instead of "
+             "querying the LLM again"
+    )
+    parser.add_argument(
+        "--rank-samples-per-request", default=1, type=int,
+        help="Number of samples ranked in a single LLM request, sharing the instructions of the prompt. Samples "
+             "are grouped within each micro-batch, so use it with a --batch-size at least as large"
+    )
+    parser.add_argument(
+        "--noise-mode", default="chained", choices=["chained", "independent", "single_call"],
+        help="Generate each perturbation level from the previous one (chained), all of them concurrently from "
+             "the original answer (independent), or all of them in a single request (single_call)"
+    )
+    parser.add_argument(
+        "--cache-dir", default=None, type=pathlib.Path,
+        help="Directory where LLM responses are cached, so that identical requests are not sent again in later runs"
+    )
+    parser.add_argument(
+        "--artifacts-dir", default=None, type=pathlib.Path,
+        help="Directory where the outputs of each step are stored, so that later runs only recompute the steps "
+             "whose parameters (e.g., prompt) or inputs changed"
+    )
+    parser.add_argument(
+        "--cache-ttl", default=None, type=float,
+        help="Maximum age in seconds of a cached LLM response (by default, responses do not expire)"
+    )
+    parser.add_argument(
+        "--cache-max-entries", default=None, type=int,
+        help="Maximum number of cached LLM responses, evicting the least recently used ones (by default, unbounded)"
+    )
+    parser.add_argument(
+        "--price-table", default=None, type=pathlib.Path,
+        help="JSON file with the prices per million \"prompt\", \"completion\" and \"cached\" tokens of each model "
+             "(e.g., {\"gpt-4o\": {\"prompt\": 2.5, \"completion\": 10, \"cached\": 1.25}}), to report the cost "
+             "of each step and sample"
+    )
+    parser.add_argument(
+        "--stream", action="store_true",
+        help="Write each sample to report.jsonl/dataset.jsonl as soon as it is finished, keeping memory usage flat"
+    )
+    parser.add_argument(
+        "--resume", action="store_true",
+        help="Resume an interrupted run from the journal in the output directory, skipping finished samples"
+    )
 
     args = parser.parse_args()
 
-    pipeline = truthbench.truth_pipeline(keep=args.keep, num_levels=args.num_levels)
-    samples, tracker = pipeline.run(JsonReader(args.input_file))
+    asynchronous = args.max_in_flight is not None or args.batch_api
+    if asynchronous and (args.stream or args.resume):
+        parser.error("--stream and --resume cannot be combined with --max-in-flight or --batch-api")
+    if args.parallel_steps and args.staged:
+        parser.error("--parallel-steps cannot be combined with --staged")
+    if args.sweep and (args.stream or args.resume):
+        parser.error("--sweep cannot be combined with --stream or --resume")
+    if args.rank_candidates < 1:
+        parser.error(f"--rank-candidates must be at least 1, but got {args.rank_candidates}")
+    if args.early_stop and args.rank_candidates > 1:
+        parser.error("--early-stop cannot be combined with --rank-candidates above 1")
+    if asynchronous and args.rank_samples_per_request > 1:
+        # Asynchronous runs process samples one by one (see `Pipeline.run_async`), so they never share a request
+        parser.error("--rank-samples-per-request above 1 cannot be combined with --max-in-flight or --batch-api")
+    if args.batch_api and args.max_in_flight is None:
+        # All samples must be in flight at once, so that each step sends a single batch
+        args.max_in_flight = 50_000
 
-    report = Report(report=Tracker(**tracker), questions=[Sample(**s) for s in samples])
-    dataset = report.to_dataset()
+    llm = openai_llm(asynchronous, batch=args.batch_api)
+    if args.price_table is not None:
+        with open(args.price_table, encoding="utf-8") as f:
+            price_table = json.load(f)
+        if llm.model not in price_table:
+            parser.error(f"{args.price_table} has no prices for {llm.model}, the model in use")
+        # The model is only known once the LLM is created, so it is created again with its prices
+        llm = openai_llm(asynchronous, batch=args.batch_api, prices=price_table[llm.model])
+    concurrency = None
+    if args.adaptive_concurrency is not None:
+        # Placed under the retries, so that it sees every rate limit
+        concurrency = AdaptiveConcurrency(
+            initial=min(4, args.adaptive_concurrency), max_limit=args.adaptive_concurrency
+        )
+        if asynchronous:
+            llm = AsyncAdaptiveConcurrencyLLM(llm, concurrency)
+        else:
+            llm = AdaptiveConcurrencyLLM(llm, concurrency)
+
+    limiter = None
+    if args.rpm is not None or args.tpm is not None:
+        limiter = RateLimiter(requests_per_minute=args.rpm, tokens_per_minute=args.tpm)
+
+    if not args.batch_api:
+        # Batch jobs take hours by design and their requests fail individually, so they are not retried.
+        # Every attempt is paced before its deadline starts, so waiting for the budget is not a timeout
+        resilience = dict(timeout=args.llm_timeout, max_retries=args.llm_max_retries, limiter=limiter)
+        llm = AsyncResilientLLM(llm, **resilience) if asynchronous else ResilientLLM(llm, **resilience)
+    elif limiter is not None:
+        llm = AsyncRateLimitedLLM(llm, limiter)
+
+    if args.cache_dir is not None:
+        cache = ResponseCache(
+            args.cache_dir / "llm_cache.sqlite3", ttl=args.cache_ttl, max_entries=args.cache_max_entries
+        )
+        llm = AsyncCachedLLM(llm, cache) if asynchronous else CachedLLM(llm, cache)
+
+    options = dict(
+        llm=llm, max_workers=args.workers, batch_size=args.batch_size, staged=args.staged, asynchronous=asynchronous,
+        processes=args.processes, early_stop=args.early_stop, rank_candidates=args.rank_candidates,
+        repair_rankings=args.repair_rankings, rank_samples_per_request=args.rank_samples_per_request,
+        noise_mode=args.noise_mode, parallel_steps=args.parallel_steps,
+        artifacts=ArtifactStore(args.artifacts_dir / "artifacts.sqlite3") if args.artifacts_dir is not None else None
+    )
+    if args.input_file.suffix == ".jsonl":
+        reader = JsonLinesReader(args.input_file)
+    else:
+        reader = JsonReader(args.input_file)
 
     args.output_dir.mkdir(parents=True, exist_ok=True)
 
-    with open(args.output_dir / "report.json", "w", encoding="utf-8") as f:
-        f.write(report.model_dump_json(indent=4))
+    if args.sweep:
+        sweep = truthbench.truth_sweep(args.sweep, **options)
+        if asynchronous:
+            results = asyncio.run(sweep.run_async(reader, max_in_flight=args.max_in_flight))
+        else:
+            results = sweep.run(reader)
 
-    with open(args.output_dir / "dataset.json", "w", encoding="utf-8") as f:
-        f.write(dataset.model_dump_json(indent=4))
+        # Counters of the LLM are shared by all configurations, so each report holds those of the whole sweep
+        for name, (samples, tracker) in results.items():
+            summary = summarize(sweep.branches[name], tracker, llm, concurrency)
+            summary["stages"] = {**sweep.prefix.stage_stats, **sweep.branches[name].stage_stats} or None
+            summary["steps"] = sweep.step_metrics(name) or None
+            write_outputs(args.output_dir / name, summary, samples)
+        return
+
+    pipeline = truthbench.truth_pipeline(keep=args.keep, num_levels=args.num_levels, **options)
+
+    if args.stream:
+        stream_to_disk(pipeline, reader, args.output_dir, resume=args.resume, llm=llm, concurrency=concurrency)
+        return
+
+    if asynchronous:
+        samples, tracker = asyncio.run(pipeline.run_async(reader, max_in_flight=args.max_in_flight))
+    else:
+        # Every finished sample is checkpointed, so that an interrupted run can be resumed with --resume
+        journal = Journal(args.output_dir / "journal.jsonl")
+        samples, tracker = [], {}
+        for sample, tracker in run_journaled(pipeline, reader, journal, resume=args.resume):
+            samples.append(sample)
+
+    write_outputs(args.output_dir, summarize(pipeline, tracker, llm, concurrency), samples)
 
 
 if __name__ == "__main__":
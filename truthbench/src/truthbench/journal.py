@@ -0,0 +1,110 @@
+import json
+import os
+import pathlib
+from typing import Dict, Any, Iterator, Tuple, Optional, IO
+
+
+class Journal:
+    """
+    An append-only log of processed samples used to checkpoint long pipeline runs.
+
+    Each line of the journal is a JSON object holding a processed sample and the tracker counters accumulated up
+    to (and including) that sample. Lines are flushed and synced to disk as soon as they are written, so a crash or
+    an interruption loses at most the samples that were still being processed.
+
+    Since `Pipeline.stream` yields samples in reader order, the journal always holds a prefix of the input. A run
+    is resumed by skipping as many samples as there are entries and by starting from the counters of the last one:
+
+        journal = Journal(output_dir / "journal.jsonl")
+        done, tracker = journal.recover()
+        with journal:
+            for sample, tracker in pipeline.stream(reader, skip=done, tracker=tracker):
+                journal.append(sample, tracker)
+
+    Parameters:
+        path (pathlib.Path): Location of the journal file.
+    """
+
+    def __init__(self, path: pathlib.Path):
+        self._path = path
+        self._file: Optional[IO[str]] = None
+
+    def entries(self) -> Iterator[Tuple[Dict[str, Any], Dict[str, int]]]:
+        """
+        Iterate over the journal entries, ignoring a trailing line that was only partially written.
+
+        Yields:
+            Tuple[Dict[str, Any], Dict[str, int]]: A processed sample and the counters accumulated up to it.
+        """
+        for entry, _ in self._read():
+            yield entry["sample"], entry["tracker"]
+
+    def recover(self) -> Tuple[int, Dict[str, int]]:
+        """
+        Prepare the journal to resume an interrupted run.
+
+        A trailing line that was only partially written (e.g., the process was killed while writing it) is
+        removed, so new entries are appended right after the last complete one.
+
+        Returns:
+            Tuple[int, Dict[str, int]]:
+                - Number of samples already processed.
+                - Counters accumulated up to the last processed sample (empty if there is none).
+        """
+        count, tracker, end = 0, {}, 0
+        for entry, end in self._read():
+            count += 1
+            tracker = entry["tracker"]
+
+        if self._path.exists() and self._path.stat().st_size != end:
+            with open(self._path, "r+b") as f:
+                f.truncate(end)
+
+        return count, tracker
+
+    def clear(self) -> None:
+        """
+        Remove all entries, to start a new run from scratch.
+        """
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        self._path.write_text("", encoding="utf-8")
+
+    def append(self, sample: Dict[str, Any], tracker: Dict[str, int]) -> None:
+        """
+        Durably append a processed sample. The journal must have been opened with a `with` statement.
+
+        Args:
+            sample (Dict[str, Any]): The processed sample.
+            tracker (Dict[str, int]): Counters accumulated up to (and including) this sample.
+        """
+        if self._file is None:
+            raise RuntimeError("The journal must be opened (with journal: ...) before appending entries")
+
+        self._file.write(json.dumps({"sample": sample, "tracker": dict(tracker)}, ensure_ascii=False) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def __enter__(self) -> 'Journal':
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self._path, "a", encoding="utf-8")
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._file.close()
+        self._file = None
+
+    def _read(self) -> Iterator[Tuple[Dict[str, Any], int]]:
+        if not self._path.exists():
+            return
+
+        end = 0
+        with open(self._path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    return
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    return
+                end += len(line)
+                yield entry, end
@@ -0,0 +1,283 @@
+import asyncio
+import contextlib
+import threading
+import time
+from typing import Dict, List, Optional, Any, Iterator, AsyncIterator, Callable, Awaitable
+
+from truthbench.llms.resilient import classify_error
+from truthbench.pipeline import LLM, AsyncLLM
+
+
+class AdaptiveConcurrency:
+    """
+    Finds how many concurrent LLM requests a provider sustains, with additive increase, multiplicative decrease.
+
+    Each successful request with a latency close to the baseline grows the limit by `1 / limit`, i.e., by one
+    request per round of `limit` requests. A rate limit (HTTP 429), a timeout, or a latency above
+    `latency_tolerance` times the baseline cuts the limit by `decrease_factor`. Cuts happen at most once per
+    baseline latency, since requests in flight at the same time report the same congestion.
+
+    The baseline is a slowly moving average of the latencies of requests that were not cut short, so it follows
+    slow drifts (e.g., longer prompts) but not spikes.
+
+    Every change of the (integer) limit is logged, so the concurrency the provider actually sustained can be
+    reviewed after the run (see `report`).
+
+    Parameters:
+        initial (int): Starting limit.
+        min_limit (int): The limit never goes below this value.
+        max_limit (int): The limit never goes above this value.
+        latency_tolerance (float): Ratio to the baseline latency above which a request counts as a spike.
+        decrease_factor (float): Factor applied to the limit on congestion.
+        smoothing (float): Weight of each new latency in the baseline average.
+    """
+
+    def __init__(
+            self,
+            initial: int = 4,
+            min_limit: int = 1,
+            max_limit: int = 64,
+            latency_tolerance: float = 2.,
+            decrease_factor: float = .5,
+            smoothing: float = .05,
+    ):
+        if not 1 <= min_limit <= initial <= max_limit:
+            raise ValueError(
+                f"Limits must satisfy 1 <= min_limit <= initial <= max_limit, but got {min_limit}, {initial}, "
+                f"{max_limit}"
+            )
+        if not 0 < decrease_factor < 1:
+            raise ValueError(f"decrease_factor must be in (0, 1), but got {decrease_factor}")
+
+        self._limit = float(initial)
+        self._min_limit = min_limit
+        self._max_limit = max_limit
+        self._latency_tolerance = latency_tolerance
+        self._decrease_factor = decrease_factor
+        self._smoothing = smoothing
+        self._baseline: Optional[float] = None
+        self._last_decrease = float("-inf")
+        self._start = time.monotonic()
+        self._peak = initial
+        self._decisions: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    @property
+    def limit(self) -> int:
+        with self._lock:
+            return int(self._limit)
+
+    def on_success(self, latency: float) -> None:
+        """
+        Update the limit after a successful request that took `latency` seconds.
+        """
+        with self._lock:
+            if self._baseline is not None and latency > self._latency_tolerance * self._baseline:
+                self._decrease("latency", latency)
+                return
+
+            self._baseline = latency if self._baseline is None else \
+                (1 - self._smoothing) * self._baseline + self._smoothing * latency
+            self._change(min(self._max_limit, self._limit + 1 / self._limit), "increase", latency)
+
+    def on_congestion(self, reason: str, latency: Optional[float] = None) -> None:
+        """
+        Update the limit after a request failed because the provider is overloaded (e.g., "rate_limit").
+        """
+        with self._lock:
+            self._decrease(reason, latency)
+
+    def _decrease(self, reason: str, latency: Optional[float]) -> None:
+        now = time.monotonic()
+        if now - self._last_decrease < (self._baseline or 0.):
+            return
+        self._last_decrease = now
+        self._change(max(self._min_limit, self._limit * self._decrease_factor), reason, latency)
+
+    def _change(self, limit: float, reason: str, latency: Optional[float]) -> None:
+        previous, self._limit = int(self._limit), limit
+        if int(limit) != previous:
+            self._peak = max(self._peak, int(limit))
+            self._decisions.append({
+                "time": time.monotonic() - self._start,
+                "limit": int(limit),
+                "reason": reason,
+                "latency": latency,
+            })
+
+    def report(self) -> Dict[str, Any]:
+        """
+        Summary of the run: final and peak limits, and every change of the limit with the time it happened (in
+        seconds since the controller was created), its reason ("increase", "latency", "rate_limit" or "timeout")
+        and the latency of the request that triggered it.
+        """
+        with self._lock:
+            return {"limit": int(self._limit), "peak_limit": self._peak, "decisions": list(self._decisions)}
+
+
+def _congestion(error: BaseException) -> Optional[str]:
+    kind = classify_error(error)
+    return kind if kind in ("rate_limit", "timeout") else None
+
+
+class AdaptiveConcurrencyLLM(LLM):
+    """
+    An `LLM` wrapper letting at most `controller.limit` requests in flight, other callers wait for a slot.
+
+    The pipeline should run more workers than the maximum limit, so that the controller, rather than the number of
+    workers, decides how many requests are sent at once. Rate limits and timeouts raised by the wrapped LLM are
+    reported to the controller and raised again, so wrap it with `ResilientLLM` to retry them.
+
+    A streamed request holds its slot until the stream is closed, but its latency is the time to its first chunk,
+    since the time to the last one depends on when the caller stops reading.
+
+    Parameters:
+        llm (LLM): The language model to query.
+        controller (AdaptiveConcurrency): The controller deciding the limit, which may be shared with other
+            wrappers of the same provider.
+    """
+
+    def __init__(self, llm: LLM, controller: AdaptiveConcurrency):
+        self._llm = llm
+        self._controller = controller
+        self._in_flight = 0
+        self._condition = threading.Condition()
+        self.model = getattr(llm, "model", type(llm).__name__)
+
+    def query(self, messages: List[Dict[str, str]]) -> str:
+        return self._limited(lambda: self._llm.query(messages))
+
+    def query_n(self, messages: List[Dict[str, str]], n: int) -> List[str]:
+        return self._limited(lambda: self._llm.query_n(messages, n))
+
+    def _limited(self, call: Callable[[], Any]) -> Any:
+        with self._condition:
+            while self._in_flight >= self._controller.limit:
+                self._condition.wait()
+            self._in_flight += 1
+
+        start = time.monotonic()
+        try:
+            response = call()
+        except Exception as e:
+            congestion = _congestion(e)
+            if congestion:
+                self._controller.on_congestion(congestion, time.monotonic() - start)
+            raise
+        else:
+            self._controller.on_success(time.monotonic() - start)
+            return response
+        finally:
+            with self._condition:
+                self._in_flight -= 1
+                self._condition.notify_all()
+
+    def stream(self, messages: List[Dict[str, str]], stop: Optional[List[str]] = None) -> Iterator[str]:
+        with self._condition:
+            while self._in_flight >= self._controller.limit:
+                self._condition.wait()
+            self._in_flight += 1
+
+        start = time.monotonic()
+        first = True
+        try:
+            with contextlib.closing(self._llm.stream(messages, stop=stop)) as chunks:
+                for chunk in chunks:
+                    if first:
+                        self._controller.on_success(time.monotonic() - start)
+                        first = False
+                    yield chunk
+        except Exception as e:
+            congestion = _congestion(e)
+            if congestion:
+                self._controller.on_congestion(congestion, time.monotonic() - start)
+            raise
+        finally:
+            with self._condition:
+                self._in_flight -= 1
+                self._condition.notify_all()
+
+    def stats(self) -> Dict[str, int]:
+        return self._llm.stats()
+
+
+class AsyncAdaptiveConcurrencyLLM(AsyncLLM):
+    """
+    The `AsyncLLM` counterpart of `AdaptiveConcurrencyLLM`. Requests cancelled before their response (e.g., at the
+    deadline of `AsyncResilientLLM`) count as timeouts.
+    """
+
+    def __init__(self, llm: AsyncLLM, controller: AdaptiveConcurrency):
+        self._llm = llm
+        self._controller = controller
+        self._in_flight = 0
+        self._condition: Optional[asyncio.Condition] = None
+        self.model = getattr(llm, "model", type(llm).__name__)
+
+    async def query(self, messages: List[Dict[str, str]]) -> str:
+        return await self._limited(lambda: self._llm.query(messages))
+
+    async def query_n(self, messages: List[Dict[str, str]], n: int) -> List[str]:
+        return await self._limited(lambda: self._llm.query_n(messages, n))
+
+    async def _limited(self, call: Callable[[], Awaitable[Any]]) -> Any:
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._in_flight < self._controller.limit)
+            self._in_flight += 1
+
+        start = time.monotonic()
+        try:
+            response = await call()
+        except asyncio.CancelledError:
+            # A request abandoned at its deadline (see `AsyncResilientLLM`) is cancelled rather than failed
+            self._controller.on_congestion("timeout", time.monotonic() - start)
+            raise
+        except Exception as e:
+            congestion = _congestion(e)
+            if congestion:
+                self._controller.on_congestion(congestion, time.monotonic() - start)
+            raise
+        else:
+            self._controller.on_success(time.monotonic() - start)
+            return response
+        finally:
+            async with self._condition:
+                self._in_flight -= 1
+                self._condition.notify_all()
+
+    async def stream(self, messages: List[Dict[str, str]], stop: Optional[List[str]] = None) -> AsyncIterator[str]:
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._in_flight < self._controller.limit)
+            self._in_flight += 1
+
+        start = time.monotonic()
+        first = True
+        try:
+            async with contextlib.aclosing(self._llm.stream(messages, stop=stop)) as chunks:
+                async for chunk in chunks:
+                    if first:
+                        self._controller.on_success(time.monotonic() - start)
+                        first = False
+                    yield chunk
+        except asyncio.CancelledError:
+            if first:
+                self._controller.on_congestion("timeout", time.monotonic() - start)
+            raise
+        except Exception as e:
+            congestion = _congestion(e)
+            if congestion:
+                self._controller.on_congestion(congestion, time.monotonic() - start)
+            raise
+        finally:
+            async with self._condition:
+                self._in_flight -= 1
+                self._condition.notify_all()
+
+    def stats(self) -> Dict[str, int]:
+        return self._llm.stats()
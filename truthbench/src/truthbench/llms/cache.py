@@ -0,0 +1,250 @@
+import contextlib
+import hashlib
+import json
+import pathlib
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Iterator, AsyncIterator
+
+from truthbench.pipeline import LLM, AsyncLLM, is_retry, truncate
+
+
+class ResponseCache:
+    """
+    A persistent store of LLM responses backed by SQLite.
+
+    Responses are keyed on the model name plus the exact list of messages sent to it, so any change in a prompt
+    (or in the text it embeds) is a miss. Entries older than `ttl` seconds are ignored and removed, and once
+    there are more than `max_entries` of them, the least recently used ones are evicted.
+
+    The store can be shared by several wrappers and threads. Hits and misses are counted across all of them.
+
+    Parameters:
+        path (pathlib.Path): Location of the SQLite database. It is created if it does not exist.
+        ttl (Optional[float]): Maximum age of an entry in seconds. If None, entries do not expire.
+        max_entries (Optional[int]): Maximum number of entries kept. If None, the store is unbounded.
+    """
+
+    def __init__(self, path: pathlib.Path, ttl: Optional[float] = None, max_entries: Optional[int] = None):
+        if ttl is not None and ttl <= 0:
+            raise ValueError(f"ttl must be positive, but got {ttl}")
+        if max_entries is not None and max_entries < 1:
+            raise ValueError(f"max_entries must be at least 1, but got {max_entries}")
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, response TEXT NOT NULL, created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)")
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(
+            model: str,
+            messages: List[Dict[str, str]],
+            stop: Optional[List[str]] = None,
+            n: int = 1,
+            stream: bool = False,
+    ) -> str:
+        request = {"model": model, "messages": messages}
+        if stop:
+            request["stop"] = stop
+        if n != 1:
+            request["n"] = n
+        if stream:
+            request["stream"] = True
+        payload = json.dumps(request, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Look up a response, counting a hit or a miss.
+
+        Returns:
+            Optional[str]: The cached response, or None if there is none or it expired.
+        """
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT response, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+
+            if row is not None and self._ttl is not None and now - row[1] > self._ttl:
+                self._connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                row = None
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            self._connection.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, response: str) -> None:
+        """
+        Store a response, replacing any previous one, and evict entries beyond `max_entries`.
+        """
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses (key, response, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, response, now, now)
+            )
+            if self._max_entries is not None:
+                self._connection.execute(
+                    "DELETE FROM responses WHERE key IN ("
+                    "SELECT key FROM responses ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                    (self._max_entries,)
+                )
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def stats(self) -> Dict[str, int]:
+        return {"llm_cache_hits": self.hits, "llm_cache_misses": self.misses}
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+
+class CachedLLM(LLM):
+    """
+    An `LLM` wrapper serving repeated requests from a persistent `ResponseCache`.
+
+    Re-running a pipeline on the same inputs then costs nothing for steps whose prompts did not change, e.g.,
+    while iterating over the prompt of a downstream step. Requests flagged as retries (see `query` in
+    `truthbench.pipeline`) skip the lookup, since the cached response is the one that was rejected, and the new
+    response replaces it.
+
+    Cache hits and misses are reported by `stats` as `llm_cache_hits` and `llm_cache_misses`. Cached responses
+    are returned as plain strings, since they cost nothing.
+
+    Alternative responses (see `query_n`) are stored together, under a key including their number. Streamed
+    responses are only stored once they were read to the end, since a caller closing the stream early (e.g.,
+    `query_stream` in `truthbench.pipeline` with `until`) did not receive the whole response. They are kept
+    apart from the responses of `query`.
+
+    Parameters:
+        llm (LLM): The language model to query on a miss.
+        cache (ResponseCache): Where responses are stored.
+        model (Optional[str]): Model name used in the cache key. Defaults to the `model` attribute of the
+            wrapped LLM, or its class name if it has none.
+    """
+
+    def __init__(self, llm: LLM, cache: ResponseCache, model: Optional[str] = None):
+        self._llm = llm
+        self._cache = cache
+        self.model = model or getattr(llm, "model", type(llm).__name__)
+
+    def query(self, messages: List[Dict[str, str]]) -> str:
+        key = self._cache.key(self.model, messages)
+        if not is_retry():
+            cached = self._cache.get(key)
+            if cached is not None:
+                return cached
+
+        response = self._llm.query(messages)
+        self._cache.put(key, str(response))
+        return response
+
+    def query_n(self, messages: List[Dict[str, str]], n: int) -> List[str]:
+        if n == 1:
+            return [self.query(messages)]
+
+        key = self._cache.key(self.model, messages, n=n)
+        if not is_retry():
+            cached = self._cache.get(key)
+            if cached is not None:
+                return json.loads(cached)
+
+        responses = self._llm.query_n(messages, n)
+        self._cache.put(key, json.dumps([str(r) for r in responses]))
+        return responses
+
+    def stream(self, messages: List[Dict[str, str]], stop: Optional[List[str]] = None) -> Iterator[str]:
+        key = self._cache.key(self.model, messages, stop, stream=True)
+        if not is_retry():
+            cached = self._cache.get(key)
+            if cached is not None:
+                yield truncate(cached, stop)
+                return
+
+        received = ""
+        with contextlib.closing(self._llm.stream(messages, stop=stop)) as chunks:
+            for chunk in chunks:
+                received += chunk
+                yield chunk
+        self._cache.put(key, received)
+
+    def stats(self) -> Dict[str, int]:
+        return {**self._llm.stats(), **self._cache.stats()}
+
+
+class AsyncCachedLLM(AsyncLLM):
+    """
+    The `AsyncLLM` counterpart of `CachedLLM`.
+
+    Parameters:
+        llm (AsyncLLM): The language model to query on a miss.
+        cache (ResponseCache): Where responses are stored.
+        model (Optional[str]): Model name used in the cache key. Defaults to the `model` attribute of the
+            wrapped LLM, or its class name if it has none.
+    """
+
+    def __init__(self, llm: AsyncLLM, cache: ResponseCache, model: Optional[str] = None):
+        self._llm = llm
+        self._cache = cache
+        self.model = model or getattr(llm, "model", type(llm).__name__)
+
+    async def query(self, messages: List[Dict[str, str]]) -> str:
+        key = self._cache.key(self.model, messages)
+        if not is_retry():
+            cached = self._cache.get(key)
+            if cached is not None:
+                return cached
+
+        response = await self._llm.query(messages)
+        self._cache.put(key, str(response))
+        return response
+
+    async def query_n(self, messages: List[Dict[str, str]], n: int) -> List[str]:
+        if n == 1:
+            return [await self.query(messages)]
+
+        key = self._cache.key(self.model, messages, n=n)
+        if not is_retry():
+            cached = self._cache.get(key)
+            if cached is not None:
+                return json.loads(cached)
+
+        responses = await self._llm.query_n(messages, n)
+        self._cache.put(key, json.dumps([str(r) for r in responses]))
+        return responses
+
+    async def stream(self, messages: List[Dict[str, str]], stop: Optional[List[str]] = None) -> AsyncIterator[str]:
+        key = self._cache.key(self.model, messages, stop, stream=True)
+        if not is_retry():
+            cached = self._cache.get(key)
+            if cached is not None:
+                yield truncate(cached, stop)
+                return
+
+        received = ""
+        async with contextlib.aclosing(self._llm.stream(messages, stop=stop)) as chunks:
+            async for chunk in chunks:
+                received += chunk
+                yield chunk
+        self._cache.put(key, received)
+
+    def stats(self) -> Dict[str, int]:
+        return {**self._llm.stats(), **self._cache.stats()}
@@ -1,16 +1,298 @@
-from typing import Dict, List
+import asyncio
+import itertools
+import json
+from typing import Dict, List, Tuple, Set, Optional, Any, Iterator, AsyncIterator
 
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
 
-from truthbench.pipeline import LLM
+from truthbench.llms.ratelimit import estimate_tokens
+from truthbench.pipeline import LLM, AsyncLLM, Completion, price
+
+
+def to_completion(text: str, usage: Optional[Dict[str, Any]], prices: Optional[Dict[str, float]]) -> Completion:
+    """
+    Build a `Completion` from the text and the `usage` object (as a dict) of an OpenAI chat completion.
+    """
+    usage = usage or {}
+    prompt_tokens = usage.get("prompt_tokens") or 0
+    completion_tokens = usage.get("completion_tokens") or 0
+    cached_tokens = (usage.get("prompt_tokens_details") or {}).get("cached_tokens") or 0
+    return Completion(
+        text.strip(),
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+        cached_tokens=cached_tokens,
+        cost=price(prices, prompt_tokens, completion_tokens, cached_tokens),
+    )
+
+
+class _StreamUsage:
+    # Turns the events of a streamed chat completion into chunks carrying their part of the usage. The provider
+    # only reports the usage once the stream is over, so the prompt is estimated upfront, and each chunk counts as
+    # one token, which is what chunks hold: a stream closed early is still accounted. The final report corrects both.
+
+    def __init__(self, messages: List[Dict[str, str]], prices: Optional[Dict[str, float]]):
+        self._prices = prices
+        self._prompt_tokens = sum(estimate_tokens(m["content"]) for m in messages)
+        self._completion_tokens = 0
+        self._cost = 0.
+
+    def start(self) -> Completion:
+        return self._chunk("", self._prompt_tokens, 0, 0)
+
+    def chunks(self, event: Any) -> Iterator[Completion]:
+        content = event.choices[0].delta.content if event.choices else None
+        if content:
+            self._completion_tokens += 1
+            yield self._chunk(content, 0, 1, 0)
+        if event.usage is not None:
+            actual = to_completion("", event.usage.model_dump(), self._prices)
+            yield Completion(
+                "",
+                prompt_tokens=actual.prompt_tokens - self._prompt_tokens,
+                completion_tokens=actual.completion_tokens - self._completion_tokens,
+                cached_tokens=actual.cached_tokens,
+                cost=actual.cost - self._cost,
+            )
+
+    def _chunk(self, text: str, prompt_tokens: int, completion_tokens: int, cached_tokens: int) -> Completion:
+        cost = price(self._prices, prompt_tokens, completion_tokens, cached_tokens)
+        self._cost += cost
+        return Completion(text, prompt_tokens, completion_tokens, cached_tokens, cost)
+
+
+def to_completions(
+        contents: List[str], usage: Optional[Dict[str, Any]], prices: Optional[Dict[str, float]]
+) -> List[Completion]:
+    """
+    Build the `Completion`s of the alternative responses of a request. The usage is that of the whole request, so it
+    is carried by the first one.
+    """
+    return [to_completion(content, usage if i == 0 else None, prices) for i, content in enumerate(contents)]
+
+
+def _stream_options(stop: Optional[List[str]]) -> Dict[str, Any]:
+    options = {"stream": True, "stream_options": {"include_usage": True}}
+    if stop:
+        options["stop"] = stop
+    return options
 
 
 class GPT(LLM):
+    """
+    GPT through the OpenAI chat completions endpoint.
+
+    Responses are returned as `Completion`s carrying the token usage of the request and, if `prices` are given, its
+    cost (see `truthbench.pipeline.price`). Streamed responses (see `stream`) are aborted as soon as the stream is
+    closed, and the usage of an aborted one is estimated. Alternative responses (see `query_n`) are generated in a
+    single request, so the prompt is only processed (and paid) once.
 
-    def __init__(self, client: OpenAI, model: str = "gpt-4o"):
+    Parameters:
+        client (OpenAI): The OpenAI client.
+        model (str): The model answering the requests.
+        prices (Optional[Dict[str, float]]): Prices of the model per million "prompt", "completion" and "cached"
+            tokens.
+    """
+
+    def __init__(self, client: OpenAI, model: str = "gpt-4o", prices: Optional[Dict[str, float]] = None):
         self._client = client
         self._model = model
+        self._prices = prices
+
+    @property
+    def model(self) -> str:
+        return self._model
 
     def query(self, messages: List[Dict[str, str]]) -> str:
         completion = self._client.chat.completions.create(model=self._model, messages=messages)
-        return completion.choices[0].message.content.strip()
+        usage = completion.usage.model_dump() if completion.usage else None
+        return to_completion(completion.choices[0].message.content, usage, self._prices)
+
+    def query_n(self, messages: List[Dict[str, str]], n: int) -> List[str]:
+        completion = self._client.chat.completions.create(model=self._model, messages=messages, n=n)
+        usage = completion.usage.model_dump() if completion.usage else None
+        return to_completions([choice.message.content for choice in completion.choices], usage, self._prices)
+
+    def stream(self, messages: List[Dict[str, str]], stop: Optional[List[str]] = None) -> Iterator[str]:
+        usage = _StreamUsage(messages, self._prices)
+        with self._client.chat.completions.create(
+                model=self._model, messages=messages, **_stream_options(stop)
+        ) as events:
+            yield usage.start()
+            for event in events:
+                yield from usage.chunks(event)
+
+
+class AsyncGPT(AsyncLLM):
+    """
+    The `AsyncLLM` counterpart of `GPT`.
+    """
+
+    def __init__(self, client: AsyncOpenAI, model: str = "gpt-4o", prices: Optional[Dict[str, float]] = None):
+        self._client = client
+        self._model = model
+        self._prices = prices
+
+    @property
+    def model(self) -> str:
+        return self._model
+
+    async def query(self, messages: List[Dict[str, str]]) -> str:
+        completion = await self._client.chat.completions.create(model=self._model, messages=messages)
+        usage = completion.usage.model_dump() if completion.usage else None
+        return to_completion(completion.choices[0].message.content, usage, self._prices)
+
+    async def query_n(self, messages: List[Dict[str, str]], n: int) -> List[str]:
+        completion = await self._client.chat.completions.create(model=self._model, messages=messages, n=n)
+        usage = completion.usage.model_dump() if completion.usage else None
+        return to_completions([choice.message.content for choice in completion.choices], usage, self._prices)
+
+    async def stream(self, messages: List[Dict[str, str]], stop: Optional[List[str]] = None) -> AsyncIterator[str]:
+        usage = _StreamUsage(messages, self._prices)
+        async with await self._client.chat.completions.create(
+                model=self._model, messages=messages, **_stream_options(stop)
+        ) as events:
+            yield usage.start()
+            async for event in events:
+                for chunk in usage.chunks(event):
+                    yield chunk
+
+
+class BatchGPT(AsyncLLM):
+    """
+    GPT through the OpenAI Batch API, for offline dataset generation at a lower cost and higher rate limits.
+
+    Requests are not sent one by one. Those issued within `window` seconds of each other are gathered and
+    submitted together as a JSONL batch job, which is polled every `poll_interval` seconds until its results
+    are available. Each request then resolves with its own response.
+
+    It is meant to be used with `Pipeline.run_async` and a `max_in_flight` covering the whole dataset. All
+    samples then reach each LLM step at about the same time, so every step (and every round of steps issuing
+    sequential requests, such as the levels of `CreateNoiseExamplesStep`) is sent as one batch, and the
+    pipeline resumes as soon as its results arrive.
+
+    Parameters:
+        client (AsyncOpenAI): The OpenAI client.
+        model (str): The model answering the requests.
+        window (float): Seconds to wait for more requests after the first one of a batch.
+        max_batch_size (int): Maximum number of requests in a batch. A batch is submitted right away once full.
+        poll_interval (float): Seconds between checks of the status of a submitted batch.
+        prices (Optional[Dict[str, float]]): Prices of the model per million "prompt", "completion" and "cached"
+            tokens through the Batch API.
+    """
+
+    FINAL_STATUSES = frozenset({"completed", "failed", "expired", "cancelled"})
+
+    def __init__(
+            self,
+            client: AsyncOpenAI,
+            model: str = "gpt-4o",
+            window: float = 5.,
+            max_batch_size: int = 50_000,
+            poll_interval: float = 30.,
+            prices: Optional[Dict[str, float]] = None,
+    ):
+        if max_batch_size < 1:
+            raise ValueError(f"max_batch_size must be at least 1, but got {max_batch_size}")
+
+        self._client = client
+        self._model = model
+        self._window = window
+        self._max_batch_size = max_batch_size
+        self._poll_interval = poll_interval
+        self._prices = prices
+        self._ids = itertools.count()
+        self._pending: List[Tuple[str, List[Dict[str, str]], asyncio.Future]] = []
+        self._tasks: Set[asyncio.Task] = set()
+        self.batches = 0
+
+    @property
+    def model(self) -> str:
+        return self._model
+
+    async def query(self, messages: List[Dict[str, str]]) -> str:
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((f"request-{next(self._ids)}", messages, future))
+
+        if len(self._pending) >= self._max_batch_size:
+            self._submit_pending()
+        elif len(self._pending) == 1:
+            self._spawn(self._submit_later())
+
+        return await future
+
+    def _spawn(self, coroutine) -> None:
+        # Keep a reference to background tasks, otherwise they may be garbage collected before finishing
+        task = asyncio.ensure_future(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _submit_later(self) -> None:
+        await asyncio.sleep(self._window)
+        self._submit_pending()
+
+    def _submit_pending(self) -> None:
+        requests, self._pending = self._pending, []
+        if requests:
+            self._spawn(self._run_batch(requests))
+
+    async def _run_batch(self, requests: List[Tuple[str, List[Dict[str, str]], asyncio.Future]]) -> None:
+        futures = {custom_id: future for custom_id, _, future in requests}
+        try:
+            lines = [
+                json.dumps({
+                    "custom_id": custom_id,
+                    "method": "POST",
+                    "url": "/v1/chat/completions",
+                    "body": {"model": self._model, "messages": messages},
+                }, ensure_ascii=False)
+                for custom_id, messages, _ in requests
+            ]
+            input_file = await self._client.files.create(
+                file=("batch.jsonl", ("\n".join(lines) + "\n").encode("utf-8")), purpose="batch"
+            )
+            batch = await self._client.batches.create(
+                input_file_id=input_file.id, endpoint="/v1/chat/completions", completion_window="24h"
+            )
+            self.batches += 1
+
+            while batch.status not in BatchGPT.FINAL_STATUSES:
+                await asyncio.sleep(self._poll_interval)
+                batch = await self._client.batches.retrieve(batch.id)
+
+            for file_id in (batch.output_file_id, batch.error_file_id):
+                if file_id:
+                    content = await self._client.files.content(file_id)
+                    self._resolve(content.text, futures)
+
+            for future in futures.values():
+                if not future.done():
+                    future.set_exception(
+                        RuntimeError(f"Batch {batch.id} ended with status '{batch.status}' without this response")
+                    )
+        except Exception as e:
+            for future in futures.values():
+                if not future.done():
+                    future.set_exception(e)
+
+    def _resolve(self, text: str, futures: Dict[str, asyncio.Future]) -> None:
+        for line in text.splitlines():
+            if not line.strip():
+                continue
+            result = json.loads(line)
+            future = futures.get(result["custom_id"])
+            if future is None or future.done():
+                continue
+
+            response = result.get("response") or {}
+            if result.get("error") or response.get("status_code") != 200:
+                error = result.get("error") or response.get("body", {}).get("error")
+                future.set_exception(RuntimeError(f"Batch request {result['custom_id']} failed: {error}"))
+                continue
+
+            body = response["body"]
+            content = body["choices"][0]["message"]["content"]
+            future.set_result(to_completion(content, body.get("usage"), self._prices))
+
+    def stats(self) -> Dict[str, int]:
+        return {"llm_batches": self.batches}
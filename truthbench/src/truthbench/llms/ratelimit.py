@@ -0,0 +1,245 @@
+import asyncio
+import contextlib
+import threading
+import time
+from typing import Dict, List, Optional, Iterator, AsyncIterator
+
+from truthbench.pipeline import LLM, AsyncLLM, Completion, join_chunks
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Rough number of tokens of a text, assuming about 4 characters per token as with English text and GPT models.
+    """
+    return len(text) // 4 + 1
+
+
+class TokenBucket:
+    """
+    A token bucket refilled continuously at `per_minute` tokens per minute, holding at most `capacity` tokens.
+
+    Reservations are served in arrival order: each one takes its tokens right away, even if it drives the bucket
+    into debt, and is told how long to wait for the refill to cover it. Concurrent callers are thus paced one after
+    another instead of racing for the same tokens.
+
+    Parameters:
+        per_minute (float): Refill rate in tokens per minute.
+        capacity (Optional[float]): Maximum burst size. Defaults to one second worth of tokens, so that dispatch
+            is spread over the minute.
+    """
+
+    def __init__(self, per_minute: float, capacity: Optional[float] = None):
+        if per_minute <= 0:
+            raise ValueError(f"per_minute must be positive, but got {per_minute}")
+
+        self._rate = per_minute / 60
+        self._capacity = capacity if capacity is not None else max(1., self._rate)
+        self._tokens = self._capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount: float) -> float:
+        """
+        Take `amount` tokens from the bucket.
+
+        Returns:
+            float: Seconds to wait before the reserved tokens are actually available.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+            self._updated = now
+            self._tokens -= amount
+            return max(0., -self._tokens / self._rate)
+
+    def refund(self, amount: float) -> None:
+        """
+        Give back tokens that were reserved but not consumed (or take more if `amount` is negative).
+        """
+        with self._lock:
+            self._tokens = min(self._capacity, self._tokens + amount)
+
+
+class RateLimiter:
+    """
+    Paces LLM requests to stay under the requests-per-minute and tokens-per-minute limits of a model.
+
+    Every LLM wrapper sharing the limiter (see `RateLimitedLLM`) draws from the same budgets, so all the steps and
+    workers of a pipeline are paced together. Since the tokens of a request are only known once it is answered,
+    dispatch reserves an estimate (prompt tokens plus `expected_output_tokens`), which is corrected once the response
+    arrives.
+
+    The rates actually achieved over the run are reported by `stats` as `llm_effective_rpm` and
+    `llm_effective_tpm`.
+
+    Parameters:
+        requests_per_minute (Optional[float]): Request budget of the model. If None, requests are not limited.
+        tokens_per_minute (Optional[float]): Token budget of the model. If None, tokens are not limited.
+        expected_output_tokens (int): Output tokens expected for each request, reserved at dispatch.
+        headroom (float): Fraction of the budgets actually used, to stay just under the provider limits.
+    """
+
+    def __init__(
+            self,
+            requests_per_minute: Optional[float] = None,
+            tokens_per_minute: Optional[float] = None,
+            expected_output_tokens: int = 512,
+            headroom: float = .95,
+    ):
+        if not 0 < headroom <= 1:
+            raise ValueError(f"headroom must be in (0, 1], but got {headroom}")
+
+        # Requests are evenly spaced, while tokens can burst up to one second worth of budget
+        self._requests = TokenBucket(requests_per_minute * headroom, capacity=1) if requests_per_minute else None
+        self._tokens = TokenBucket(
+            tokens_per_minute * headroom, capacity=tokens_per_minute * headroom / 60
+        ) if tokens_per_minute else None
+        self._expected_output_tokens = expected_output_tokens
+        self._lock = threading.Lock()
+        self._dispatched = 0
+        self._consumed_tokens = 0
+        self._first_dispatch: Optional[float] = None
+        self._last_completion: Optional[float] = None
+
+    def acquire(self, messages: List[Dict[str, str]], n: int = 1) -> float:
+        """
+        Reserve the budget of a request for `n` responses.
+
+        Returns:
+            float: Seconds to wait before dispatching the request.
+        """
+        wait = 0.
+        if self._requests is not None:
+            wait = self._requests.reserve(1)
+        if self._tokens is not None:
+            wait = max(wait, self._tokens.reserve(self._estimate(messages, n)))
+
+        with self._lock:
+            self._dispatched += 1
+            if self._first_dispatch is None:
+                self._first_dispatch = time.monotonic() + wait
+        return wait
+
+    def complete(self, messages: List[Dict[str, str]], response: Optional[str], n: int = 1) -> None:
+        """
+        Record the completion of a request, correcting its token reservation with the tokens actually used, as
+        reported by a `Completion`, or otherwise estimated from the length of the response (all `n` responses
+        joined, see `join_chunks`).
+        """
+        if isinstance(response, Completion) and response.prompt_tokens:
+            used = response.prompt_tokens + response.completion_tokens
+        else:
+            prompt_tokens = sum(estimate_tokens(m["content"]) for m in messages)
+            used = prompt_tokens + (estimate_tokens(response) if response is not None else 0)
+        if self._tokens is not None:
+            self._tokens.refund(self._estimate(messages, n) - used)
+
+        with self._lock:
+            self._consumed_tokens += used
+            self._last_completion = time.monotonic()
+
+    def _estimate(self, messages: List[Dict[str, str]], n: int = 1) -> int:
+        return sum(estimate_tokens(m["content"]) for m in messages) + n * self._expected_output_tokens
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            if self._first_dispatch is None or self._last_completion is None:
+                return {"llm_effective_rpm": 0, "llm_effective_tpm": 0}
+            minutes = max(self._last_completion - self._first_dispatch, 1e-6) / 60
+            return {
+                "llm_effective_rpm": round(self._dispatched / minutes),
+                "llm_effective_tpm": round(self._consumed_tokens / minutes),
+            }
+
+
+class RateLimitedLLM(LLM):
+    """
+    An `LLM` wrapper dispatching requests at the pace allowed by a `RateLimiter`.
+
+    Wrap the LLM once and share it between steps (as `truth_pipeline` does), or share the limiter between several
+    wrappers of the same model, so that all requests draw from the same budgets.
+
+    Parameters:
+        llm (LLM): The language model to query.
+        limiter (RateLimiter): Budgets of the model.
+    """
+
+    def __init__(self, llm: LLM, limiter: RateLimiter):
+        self._llm = llm
+        self._limiter = limiter
+        self.model = getattr(llm, "model", type(llm).__name__)
+
+    def query(self, messages: List[Dict[str, str]]) -> str:
+        time.sleep(self._limiter.acquire(messages))
+        response = None
+        try:
+            response = self._llm.query(messages)
+            return response
+        finally:
+            self._limiter.complete(messages, response)
+
+    def query_n(self, messages: List[Dict[str, str]], n: int) -> List[str]:
+        time.sleep(self._limiter.acquire(messages, n))
+        responses = []
+        try:
+            responses = self._llm.query_n(messages, n)
+            return responses
+        finally:
+            self._limiter.complete(messages, join_chunks(responses), n)
+
+    def stream(self, messages: List[Dict[str, str]], stop: Optional[List[str]] = None) -> Iterator[str]:
+        time.sleep(self._limiter.acquire(messages))
+        received = []
+        try:
+            with contextlib.closing(self._llm.stream(messages, stop=stop)) as chunks:
+                for chunk in chunks:
+                    received.append(chunk)
+                    yield chunk
+        finally:
+            self._limiter.complete(messages, join_chunks(received))
+
+    def stats(self) -> Dict[str, int]:
+        return {**self._llm.stats(), **self._limiter.stats()}
+
+
+class AsyncRateLimitedLLM(AsyncLLM):
+    """
+    The `AsyncLLM` counterpart of `RateLimitedLLM`.
+    """
+
+    def __init__(self, llm: AsyncLLM, limiter: RateLimiter):
+        self._llm = llm
+        self._limiter = limiter
+        self.model = getattr(llm, "model", type(llm).__name__)
+
+    async def query(self, messages: List[Dict[str, str]]) -> str:
+        await asyncio.sleep(self._limiter.acquire(messages))
+        response = None
+        try:
+            response = await self._llm.query(messages)
+            return response
+        finally:
+            self._limiter.complete(messages, response)
+
+    async def query_n(self, messages: List[Dict[str, str]], n: int) -> List[str]:
+        await asyncio.sleep(self._limiter.acquire(messages, n))
+        responses = []
+        try:
+            responses = await self._llm.query_n(messages, n)
+            return responses
+        finally:
+            self._limiter.complete(messages, join_chunks(responses), n)
+
+    async def stream(self, messages: List[Dict[str, str]], stop: Optional[List[str]] = None) -> AsyncIterator[str]:
+        await asyncio.sleep(self._limiter.acquire(messages))
+        received = []
+        try:
+            async with contextlib.aclosing(self._llm.stream(messages, stop=stop)) as chunks:
+                async for chunk in chunks:
+                    received.append(chunk)
+                    yield chunk
+        finally:
+            self._limiter.complete(messages, join_chunks(received))
+
+    def stats(self) -> Dict[str, int]:
+        return {**self._llm.stats(), **self._limiter.stats()}
@@ -0,0 +1,393 @@
+import asyncio
+import contextlib
+import contextvars
+import random
+import threading
+import time
+from typing import Dict, List, Optional, Callable, Iterator, AsyncIterator, Any, Awaitable
+
+from truthbench.llms.ratelimit import RateLimiter
+from truthbench.pipeline import LLM, AsyncLLM, join_chunks
+
+
+def classify_error(error: BaseException) -> Optional[str]:
+    """
+    Classify a failed LLM request as transient or not.
+
+    Errors are recognized from their `status_code` attribute (as raised by the OpenAI client, among others) or
+    their type, so no client library is required.
+
+    Returns:
+        Optional[str]: "timeout", "rate_limit" (HTTP 429) or "server_error" (HTTP 408, 5xx or a connection
+        failure) for transient errors worth retrying, or None for errors that would fail again (e.g., HTTP 400).
+    """
+    if isinstance(error, (TimeoutError, asyncio.TimeoutError)):
+        return "timeout"
+
+    status_code = getattr(error, "status_code", None)
+    if status_code == 429:
+        return "rate_limit"
+    if status_code is not None and (status_code == 408 or status_code >= 500):
+        return "server_error"
+
+    if isinstance(error, ConnectionError) or any(c.__name__ == "APIConnectionError" for c in type(error).__mro__):
+        return "server_error"
+    return None
+
+
+class CircuitBreaker:
+    """
+    Pauses requests to a provider after too many consecutive transient failures.
+
+    Once `failure_threshold` failures happen in a row, the circuit opens and no request is dispatched for
+    `cooldown` seconds. A single probe request is then let through: the circuit closes if it succeeds and opens
+    again if it fails. It is shared by all threads (or coroutines) issuing requests to the same provider.
+
+    Parameters:
+        failure_threshold (int): Number of consecutive failures opening the circuit.
+        cooldown (float): Seconds during which the circuit stays open.
+    """
+
+    def __init__(self, failure_threshold: int = 5, cooldown: float = 30.):
+        if failure_threshold < 1:
+            raise ValueError(f"failure_threshold must be at least 1, but got {failure_threshold}")
+
+        self._failure_threshold = failure_threshold
+        self._cooldown = cooldown
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._open_until: Optional[float] = None
+        self._probing = False
+        self.opened = 0
+
+    def wait_time(self) -> float:
+        """
+        Seconds to wait before dispatching a request, or 0 if it can be dispatched right away (in which case,
+        it may be the probe request of a half-open circuit).
+        """
+        with self._lock:
+            if self._open_until is None:
+                return 0.
+            remaining = self._open_until - time.monotonic()
+            if remaining > 0:
+                return remaining
+            if self._probing:
+                return min(1., self._cooldown)
+            self._probing = True
+            return 0.
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._open_until = None
+            self._probing = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self._failure_threshold:
+                self._open_until = time.monotonic() + self._cooldown
+                self._probing = False
+                self._failures = 0
+                self.opened += 1
+
+
+class _Resilience:
+
+    def __init__(
+            self,
+            timeout: Optional[float],
+            max_retries: int,
+            base_delay: float,
+            max_delay: float,
+            breaker: Optional[CircuitBreaker],
+            classify: Callable[[BaseException], Optional[str]],
+            limiter: Optional[RateLimiter],
+    ):
+        if timeout is not None and timeout <= 0:
+            raise ValueError(f"timeout must be positive, but got {timeout}")
+        if max_retries < 0:
+            raise ValueError(f"max_retries must not be negative, but got {max_retries}")
+
+        self._timeout = timeout
+        self._max_retries = max_retries
+        self._base_delay = base_delay
+        self._max_delay = max_delay
+        self._breaker = breaker if breaker is not None else CircuitBreaker()
+        self._classify = classify
+        self._limiter = limiter
+        self._lock = threading.Lock()
+        self._counts = {"timeout": 0, "rate_limit": 0, "server_error": 0, "retries": 0}
+
+    def _handle_failure(self, error: BaseException, attempt: int) -> float:
+        # Returns the delay before the next attempt, or raises if the request must not be retried
+        kind = self._classify(error)
+        if kind is None:
+            # The provider did answer, so it does not count against the circuit breaker
+            self._breaker.record_success()
+            raise error
+
+        self._breaker.record_failure()
+        with self._lock:
+            self._counts[kind] += 1
+            if attempt >= self._max_retries:
+                raise error
+            self._counts["retries"] += 1
+
+        return self._delay(error, attempt)
+
+    def _pace(self, messages: List[Dict[str, str]], n: int = 1) -> float:
+        # Every attempt draws from the budgets, so that retries are paced and counted like any other request
+        return self._limiter.acquire(messages, n) if self._limiter is not None else 0.
+
+    def _complete(self, messages: List[Dict[str, str]], response: Any, n: int = 1) -> None:
+        if self._limiter is not None:
+            self._limiter.complete(messages, join_chunks(response) if isinstance(response, list) else response, n)
+
+    def _delay(self, error: BaseException, attempt: int) -> float:
+        # Honor the delay requested by the provider, if any, otherwise back off exponentially with full jitter
+        headers = getattr(getattr(error, "response", None), "headers", None) or {}
+        try:
+            return min(float(headers.get("retry-after")), self._max_delay)
+        except (TypeError, ValueError):
+            return random.uniform(0, min(self._max_delay, self._base_delay * 2 ** attempt))
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "llm_request_retries": self._counts["retries"],
+                "llm_timeouts": self._counts["timeout"],
+                "llm_rate_limited": self._counts["rate_limit"],
+                "llm_server_errors": self._counts["server_error"],
+                "llm_circuit_breaks": self._breaker.opened,
+                **(self._limiter.stats() if self._limiter is not None else {}),
+            }
+
+
+class ResilientLLM(_Resilience, LLM):
+    """
+    An `LLM` wrapper protecting a pipeline from a slow or degraded provider.
+
+    - Each request has a deadline of `timeout` seconds, after which it is abandoned and counts as a timeout.
+    - Transient failures (timeouts, rate limits, server errors, see `classify_error`) are retried up to
+      `max_retries` times with exponential backoff and full jitter, or after the delay requested by the provider
+      in a `retry-after` header. Other errors are raised right away.
+    - Consecutive transient failures open a `CircuitBreaker`, which pauses all requests for a while instead of
+      hammering the provider.
+
+    - If a `RateLimiter` is given, every attempt waits for its budget before its deadline starts, so that retries
+      are paced like first attempts and count towards the effective rates.
+
+    Retries, timeouts, rate limits, server errors and circuit breaks are reported by `stats`.
+
+    Streamed requests (see `stream`) are protected until their first chunk: the deadline applies to it, and failures
+    before it are retried. Failures in the middle of a stream are raised, since the caller already read part of it.
+
+    Parameters:
+        llm (LLM): The language model to protect.
+        timeout (Optional[float]): Deadline of each request in seconds. If None, requests have no deadline.
+        max_retries (int): Maximum number of retries of a request.
+        base_delay (float): Maximum delay in seconds before the first retry, doubled at each retry.
+        max_delay (float): Upper bound of the delay in seconds between retries.
+        breaker (Optional[CircuitBreaker]): Circuit breaker, which may be shared with other wrappers of the same
+            provider. By default, a new one is created.
+        classify (Callable[[BaseException], Optional[str]]): Function telling which errors are transient.
+        limiter (Optional[RateLimiter]): Budgets of the model, which may be shared with other wrappers. If None,
+            requests are not paced.
+    """
+
+    def __init__(
+            self,
+            llm: LLM,
+            timeout: Optional[float] = 120.,
+            max_retries: int = 5,
+            base_delay: float = 1.,
+            max_delay: float = 60.,
+            breaker: Optional[CircuitBreaker] = None,
+            classify: Callable[[BaseException], Optional[str]] = classify_error,
+            limiter: Optional[RateLimiter] = None,
+    ):
+        super().__init__(timeout, max_retries, base_delay, max_delay, breaker, classify, limiter)
+        self._llm = llm
+        self.model = getattr(llm, "model", type(llm).__name__)
+
+    def query(self, messages: List[Dict[str, str]]) -> str:
+        return self._retrying(lambda: self._llm.query(messages), messages)
+
+    def query_n(self, messages: List[Dict[str, str]], n: int) -> List[str]:
+        return self._retrying(lambda: self._llm.query_n(messages, n), messages, n)
+
+    def _retrying(self, call: Callable[[], Any], messages: List[Dict[str, str]], n: int = 1) -> Any:
+        attempt = 0
+        while True:
+            wait = self._breaker.wait_time()
+            while wait > 0:
+                time.sleep(wait)
+                wait = self._breaker.wait_time()
+
+            pace = self._pace(messages, n)
+            if pace > 0:
+                time.sleep(pace)
+            response = None
+            try:
+                response = self._with_deadline(call)
+            except Exception as e:
+                time.sleep(self._handle_failure(e, attempt))
+                attempt += 1
+                continue
+            finally:
+                self._complete(messages, response, n)
+
+            self._breaker.record_success()
+            return response
+
+    def stream(self, messages: List[Dict[str, str]], stop: Optional[List[str]] = None) -> Iterator[str]:
+        attempt = 0
+        while True:
+            wait = self._breaker.wait_time()
+            while wait > 0:
+                time.sleep(wait)
+                wait = self._breaker.wait_time()
+
+            pace = self._pace(messages)
+            if pace > 0:
+                time.sleep(pace)
+            chunks = self._llm.stream(messages, stop=stop)
+            try:
+                first = self._with_deadline(lambda: next(chunks, None))
+            except Exception as e:
+                self._complete(messages, None)
+                time.sleep(self._handle_failure(e, attempt))
+                attempt += 1
+                continue
+
+            self._breaker.record_success()
+            break
+
+        received = []
+        try:
+            with contextlib.closing(chunks):
+                if first is not None:
+                    received.append(first)
+                    yield first
+                    for chunk in chunks:
+                        received.append(chunk)
+                        yield chunk
+        finally:
+            self._complete(messages, join_chunks(received))
+
+    def _with_deadline(self, call: Callable[[], Any]) -> Any:
+        if self._timeout is None:
+            return call()
+
+        # A blocking call cannot be interrupted, so it runs in a daemon thread that is abandoned if it hangs
+        result = {}
+
+        def target() -> None:
+            try:
+                result["response"] = call()
+            except BaseException as e:
+                result["error"] = e
+
+        thread = threading.Thread(target=contextvars.copy_context().run, args=(target,), daemon=True)
+        thread.start()
+        thread.join(self._timeout)
+
+        if thread.is_alive():
+            raise TimeoutError(f"LLM request did not complete within {self._timeout} seconds")
+        if "error" in result:
+            raise result["error"]
+        return result["response"]
+
+    def stats(self) -> Dict[str, int]:
+        return {**self._llm.stats(), **super().stats()}
+
+
+class AsyncResilientLLM(_Resilience, AsyncLLM):
+    """
+    The `AsyncLLM` counterpart of `ResilientLLM`. Requests exceeding their deadline are cancelled.
+    """
+
+    def __init__(
+            self,
+            llm: AsyncLLM,
+            timeout: Optional[float] = 120.,
+            max_retries: int = 5,
+            base_delay: float = 1.,
+            max_delay: float = 60.,
+            breaker: Optional[CircuitBreaker] = None,
+            classify: Callable[[BaseException], Optional[str]] = classify_error,
+            limiter: Optional[RateLimiter] = None,
+    ):
+        super().__init__(timeout, max_retries, base_delay, max_delay, breaker, classify, limiter)
+        self._llm = llm
+        self.model = getattr(llm, "model", type(llm).__name__)
+
+    async def query(self, messages: List[Dict[str, str]]) -> str:
+        return await self._retrying(lambda: self._llm.query(messages), messages)
+
+    async def query_n(self, messages: List[Dict[str, str]], n: int) -> List[str]:
+        return await self._retrying(lambda: self._llm.query_n(messages, n), messages, n)
+
+    async def _retrying(self, call: Callable[[], Awaitable[Any]], messages: List[Dict[str, str]], n: int = 1) -> Any:
+        attempt = 0
+        while True:
+            wait = self._breaker.wait_time()
+            while wait > 0:
+                await asyncio.sleep(wait)
+                wait = self._breaker.wait_time()
+
+            pace = self._pace(messages, n)
+            if pace > 0:
+                await asyncio.sleep(pace)
+            response = None
+            try:
+                response = await asyncio.wait_for(call(), self._timeout)
+            except Exception as e:
+                await asyncio.sleep(self._handle_failure(e, attempt))
+                attempt += 1
+                continue
+            finally:
+                self._complete(messages, response, n)
+
+            self._breaker.record_success()
+            return response
+
+    async def stream(self, messages: List[Dict[str, str]], stop: Optional[List[str]] = None) -> AsyncIterator[str]:
+        attempt = 0
+        while True:
+            wait = self._breaker.wait_time()
+            while wait > 0:
+                await asyncio.sleep(wait)
+                wait = self._breaker.wait_time()
+
+            pace = self._pace(messages)
+            if pace > 0:
+                await asyncio.sleep(pace)
+            chunks = self._llm.stream(messages, stop=stop)
+            try:
+                first = await asyncio.wait_for(anext(chunks, None), self._timeout)
+            except Exception as e:
+                await chunks.aclose()
+                self._complete(messages, None)
+                await asyncio.sleep(self._handle_failure(e, attempt))
+                attempt += 1
+                continue
+
+            self._breaker.record_success()
+            break
+
+        received = []
+        try:
+            async with contextlib.aclosing(chunks):
+                if first is not None:
+                    received.append(first)
+                    yield first
+                    async for chunk in chunks:
+                        received.append(chunk)
+                        yield chunk
+        finally:
+            self._complete(messages, join_chunks(received))
+
+    def stats(self) -> Dict[str, int]:
+        return {**self._llm.stats(), **super().stats()}
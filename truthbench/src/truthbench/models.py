@@ -9,7 +9,35 @@ class Tracker(pydantic.BaseModel):
     json_parse_ranking_error: int = 0
     index_ranking_error: int = 0
     ranking_factual_data_error: int = 0
+    repaired_ranking: int = 0
+    regenerated_noise_level: int = 0
     output_samples: int = 0
+    failed_samples: int = 0
+    reused_step_outputs: int = 0
+    llm_cache_hits: int = 0
+    llm_cache_misses: int = 0
+    llm_batches: int = 0
+    llm_request_retries: int = 0
+    llm_timeouts: int = 0
+    llm_rate_limited: int = 0
+    llm_server_errors: int = 0
+    llm_circuit_breaks: int = 0
+    llm_effective_rpm: int = 0
+    llm_effective_tpm: int = 0
+
+
+class Usage(pydantic.BaseModel):
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0
+    cost: float = 0.
+
+
+class SampleError(pydantic.BaseModel):
+    step: str
+    type: str
+    message: str
+    traceback: str
 
 
 class Sample(pydantic.BaseModel):
@@ -22,9 +50,15 @@ class Sample(pydantic.BaseModel):
     factual_data: Optional[List[str]] = None
     ranked_factual_data: Optional[List[str]] = None
     answers: Optional[Dict[str, str]] = None
+    usage: Optional[Usage] = None
+    terminated_at: Optional[str] = None
+    error: Optional[SampleError] = None
 
     def is_valid(self) -> bool:
-        return len(self.answers.keys()) > 1
+        # A sample a step failed on or terminated may hold the answers of some of the noise levels only
+        if self.error is not None or self.terminated_at is not None:
+            return False
+        return self.answers is not None and len(self.answers.keys()) > 1
 
 
 class Item(pydantic.BaseModel):
@@ -42,8 +76,50 @@ class Dataset(pydantic.BaseModel):
     questions: List[Item]
 
 
-class Report(pydantic.BaseModel):
+class StageStats(pydantic.BaseModel):
+    processed: int = 0
+    utilization: float = 0.
+    mean_queue_depth: float = 0.
+    max_queue_depth: int = 0
+
+
+class StepMetrics(pydantic.BaseModel):
+    calls: int = 0
+    samples: int = 0
+    wall_time: float = 0.
+    samples_per_second: float = 0.
+    p50_latency: float = 0.
+    p95_latency: float = 0.
+    p99_latency: float = 0.
+    llm_calls: int = 0
+    llm_retries: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0
+    cost: float = 0.
+
+
+class ConcurrencyDecision(pydantic.BaseModel):
+    time: float
+    limit: int
+    reason: str
+    latency: Optional[float] = None
+
+
+class ConcurrencyReport(pydantic.BaseModel):
+    limit: int
+    peak_limit: int
+    decisions: List[ConcurrencyDecision]
+
+
+class Summary(pydantic.BaseModel):
     report: Tracker
+    stages: Optional[Dict[str, StageStats]] = None
+    steps: Optional[Dict[str, StepMetrics]] = None
+    concurrency: Optional[ConcurrencyReport] = None
+
+
+class Report(Summary):
     questions: List[Sample]
 
     def to_dataset(self) -> Dataset:
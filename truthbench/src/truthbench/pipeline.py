@@ -1,8 +1,25 @@
 import abc
-from typing import List, Dict, Tuple, Any, Set
+import asyncio
+import collections
+import concurrent.futures
+import contextlib
+import contextvars
+import copy
+import hashlib
+import itertools
+import json
+import multiprocessing
+import queue
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, Future, ProcessPoolExecutor
+from typing import List, Dict, Tuple, Any, Set, FrozenSet, Union, Iterator, Iterable, Optional, AsyncIterator, Callable
 
 from tqdm import tqdm
 
+from truthbench.artifacts import ArtifactStore
+
 
 class StrictTracker(dict):
     """
@@ -35,6 +52,101 @@ class StrictTracker(dict):
             )
         return super().__setitem__(key, value)
 
+    def merge(self, other: Dict[str, int]) -> None:
+        """
+        Add the counters of another tracker into this one.
+
+        Args:
+            other (Dict[str, int]): Counters to accumulate. All keys must be allowed in this tracker.
+        """
+        for key, value in other.items():
+            self[key] += value
+
+
+USAGE_FIELDS = ("prompt_tokens", "completion_tokens", "cached_tokens", "cost")
+
+
+class Completion(str):
+    """
+    The response of a language model along with its usage.
+
+    It is a `str`, so steps parse it like any other response and LLMs returning plain strings keep working.
+    Responses returned as a `Completion` have their usage accounted per step and per sample by `Pipeline`.
+
+    Args:
+        text (str): The response.
+        prompt_tokens (int): Tokens of the prompt, including cached ones.
+        completion_tokens (int): Tokens of the response.
+        cached_tokens (int): Tokens of the prompt served from the provider's prompt cache.
+        cost (float): Price of the request (e.g., in USD), if known (see `price`).
+    """
+
+    def __new__(
+            cls,
+            text: str,
+            prompt_tokens: int = 0,
+            completion_tokens: int = 0,
+            cached_tokens: int = 0,
+            cost: float = 0.,
+    ) -> 'Completion':
+        completion = super().__new__(cls, text)
+        completion.prompt_tokens = prompt_tokens
+        completion.completion_tokens = completion_tokens
+        completion.cached_tokens = cached_tokens
+        completion.cost = cost
+        return completion
+
+    def usage(self) -> Dict[str, float]:
+        return {field: getattr(self, field) for field in USAGE_FIELDS}
+
+
+def price(prices: Optional[Dict[str, float]], prompt_tokens: int, completion_tokens: int, cached_tokens: int) -> float:
+    """
+    Price of a request given the prices per million tokens of the model.
+
+    Args:
+        prices (Optional[Dict[str, float]]): Price per million tokens for "prompt", "completion" and optionally
+            "cached" prompt tokens (which default to the prompt price). If None, the request is free.
+        prompt_tokens (int): Tokens of the prompt, including cached ones.
+        completion_tokens (int): Tokens of the response.
+        cached_tokens (int): Tokens of the prompt served from the provider's prompt cache.
+
+    Returns:
+        float: The price of the request, in the currency of the prices.
+    """
+    if not prices:
+        return 0.
+    cached_price = prices.get("cached", prices["prompt"])
+    return (
+            (prompt_tokens - cached_tokens) * prices["prompt"] +
+            cached_tokens * cached_price +
+            completion_tokens * prices["completion"]
+    ) / 1_000_000
+
+
+def truncate(response: str, stop: Optional[List[str]]) -> str:
+    """
+    Cut a response right before the first occurrence of any of the `stop` sequences, as providers do. The usage of
+    a `Completion` is kept.
+    """
+    positions = [response.find(s) for s in stop or [] if s in response]
+    if not positions:
+        return response
+    text = response[:min(positions)]
+    return Completion(text, **response.usage()) if isinstance(response, Completion) else text
+
+
+def join_chunks(chunks: List[str]) -> str:
+    """
+    Join the chunks of a streamed response. If some of them are `Completion`s, the result is a `Completion` with
+    their usage summed.
+    """
+    text = "".join(chunks)
+    usages = [chunk.usage() for chunk in chunks if isinstance(chunk, Completion)]
+    if not usages:
+        return text
+    return Completion(text, **{field: sum(usage[field] for usage in usages) for field in USAGE_FIELDS})
+
 
 class LLM(abc.ABC):
     """
@@ -53,10 +165,490 @@ class LLM(abc.ABC):
             messages (List[Dict[str, str]]): A list of message dicts with keys like 'role' and 'content'.
 
         Returns:
-            str: The LLM's response as a string.
+            str: The LLM's response as a string. Return a `Completion` to report the usage of the request.
         """
         ...
 
+    def stream(self, messages: List[Dict[str, str]], stop: Optional[List[str]] = None) -> Iterator[str]:
+        """
+        Query the language model and get its response in chunks, as it is generated.
+
+        The response ends right before the first of the `stop` sequences, which is not included. The caller may
+        close the stream as soon as it has what it needs (see `query_stream`), which aborts the request.
+
+        By default, the whole response is queried with `query` and cut at the stop sequences, so that any LLM can
+        be streamed. Override it to actually save latency and tokens.
+
+        Args:
+            messages (List[Dict[str, str]]): A list of message dicts with keys like 'role' and 'content'.
+            stop (Optional[List[str]]): Sequences where the response stops.
+
+        Returns:
+            Iterator[str]: The chunks of the response. Chunks may be `Completion`s carrying the usage of their part
+            of the request.
+        """
+        yield truncate(self.query(messages), stop)
+
+    def query_n(self, messages: List[Dict[str, str]], n: int) -> List[str]:
+        """
+        Query the language model for `n` alternative responses to the same messages.
+
+        By default, `n` requests are sent concurrently, each one from its own thread. Override it when the provider
+        generates several responses in a single request (e.g., the `n` parameter of OpenAI).
+
+        Args:
+            messages (List[Dict[str, str]]): A list of message dicts with keys like 'role' and 'content'.
+            n (int): Number of responses.
+
+        Returns:
+            List[str]: The responses.
+        """
+        if n == 1:
+            return [self.query(messages)]
+        with ThreadPoolExecutor(max_workers=n) as executor:
+            futures = [executor.submit(contextvars.copy_context().run, self.query, messages) for _ in range(n)]
+            return [future.result() for future in futures]
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Counters collected by the language model itself across all requests (e.g., cache hits), reported next
+        to the tracker counters of the run. By default, there are none.
+        """
+        return {}
+
+
+class AsyncLLM(abc.ABC):
+    """
+    Abstract base class for Language Models accessed through asyncio.
+
+    It is the asynchronous counterpart of `LLM`: subclasses implement `query` as a coroutine, so that many
+    requests can be awaited concurrently from a single event loop (see `Pipeline.run_async`).
+    """
+
+    @abc.abstractmethod
+    async def query(self, messages: List[Dict[str, str]]) -> str:
+        """
+        Query the language model with a list of messages and get the output string.
+
+        Args:
+            messages (List[Dict[str, str]]): A list of message dicts with keys like 'role' and 'content'.
+
+        Returns:
+            str: The LLM's response as a string. Return a `Completion` to report the usage of the request.
+        """
+        ...
+
+    async def stream(self, messages: List[Dict[str, str]], stop: Optional[List[str]] = None) -> AsyncIterator[str]:
+        """
+        The asynchronous counterpart of `LLM.stream`.
+        """
+        yield truncate(await self.query(messages), stop)
+
+    async def query_n(self, messages: List[Dict[str, str]], n: int) -> List[str]:
+        """
+        The asynchronous counterpart of `LLM.query_n`. By default, `n` requests are awaited concurrently.
+        """
+        return list(await asyncio.gather(*(self.query(messages) for _ in range(n))))
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Counters collected by the language model itself across all requests (e.g., cache hits), reported next
+        to the tracker counters of the run. By default, there are none.
+        """
+        return {}
+
+
+class StepMetrics:
+    """
+    Runtime metrics of a step, collected by `Pipeline` over a run (see `Pipeline.step_metrics`).
+
+    Metrics are updated from every worker running the step, so updates are serialized by a lock.
+
+    Attributes:
+        calls (int): Number of times the step was called (once per micro-batch, or per sample in `run_async`).
+        samples (int): Number of samples processed by the step.
+        wall_time (float): Seconds spent in the step, summed over all calls.
+        latencies (List[float]): Duration in seconds of each call.
+        llm_calls (int): Number of LLM requests issued by the step (see `query` and `aquery`).
+        llm_retries (int): Number of those requests that were retries of a previous one.
+        usage (Dict[str, float]): Tokens and cost of those requests, for those answered with a `Completion`.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.samples = 0
+        self.wall_time = 0.
+        self.latencies: List[float] = []
+        self.llm_calls = 0
+        self.llm_retries = 0
+        self.usage: Dict[str, float] = dict.fromkeys(USAGE_FIELDS, 0)
+        self._lock = threading.Lock()
+
+    def observe(self, batch_size: int, latency: float) -> None:
+        with self._lock:
+            self.calls += 1
+            self.samples += batch_size
+            self.wall_time += latency
+            self.latencies.append(latency)
+
+    def record_llm_call(self, retry: bool = False) -> None:
+        with self._lock:
+            self.llm_calls += 1
+            self.llm_retries += int(retry)
+
+    def record_usage(self, usage: Dict[str, float]) -> None:
+        with self._lock:
+            for field, value in usage.items():
+                self.usage[field] += value
+
+    def llm_counts(self) -> Dict[str, float]:
+        with self._lock:
+            return {"llm_calls": self.llm_calls, "llm_retries": self.llm_retries, **self.usage}
+
+    def merge_llm_counts(self, counts: Dict[str, float]) -> None:
+        with self._lock:
+            self.llm_calls += counts["llm_calls"]
+            self.llm_retries += counts["llm_retries"]
+            for field in USAGE_FIELDS:
+                self.usage[field] += counts[field]
+
+    @staticmethod
+    def percentile(values: List[float], q: float) -> float:
+        """
+        Nearest-rank percentile `q` (between 0 and 100) of the values, or 0 if there are none.
+        """
+        if not values:
+            return 0.
+        ordered = sorted(values)
+        rank = max(1, -(-len(ordered) * q // 100))
+        return ordered[int(rank) - 1]
+
+    def summary(self) -> Dict[str, float]:
+        """
+        Summarize the step behavior: counts, total wall time, throughput while running and latency percentiles.
+        """
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "samples": self.samples,
+                "wall_time": self.wall_time,
+                "samples_per_second": self.samples / self.wall_time if self.wall_time > 0 else 0.,
+                "p50_latency": self.percentile(self.latencies, 50),
+                "p95_latency": self.percentile(self.latencies, 95),
+                "p99_latency": self.percentile(self.latencies, 99),
+                "llm_calls": self.llm_calls,
+                "llm_retries": self.llm_retries,
+                **self.usage,
+            }
+
+
+_CURRENT_METRICS: contextvars.ContextVar[Optional[StepMetrics]] = contextvars.ContextVar(
+    "_CURRENT_METRICS", default=None
+)
+
+
+@contextlib.contextmanager
+def _measuring(metrics: StepMetrics, batch_size: int) -> Iterator[None]:
+    # LLM requests issued while the step runs are attributed to it through the context variable
+    token = _CURRENT_METRICS.set(metrics)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.observe(batch_size, time.perf_counter() - start)
+        _CURRENT_METRICS.reset(token)
+
+
+_CURRENT_SAMPLE: contextvars.ContextVar[Optional[Dict[str, Any]]] = contextvars.ContextVar(
+    "_CURRENT_SAMPLE", default=None
+)
+_SAMPLE_USAGE_LOCK = threading.Lock()
+
+
+@contextlib.contextmanager
+def _attributing_to(sample: Dict[str, Any]) -> Iterator[None]:
+    # The usage of LLM requests issued while processing the sample is accumulated in its "usage" field
+    token = _CURRENT_SAMPLE.set(sample)
+    try:
+        yield
+    finally:
+        _CURRENT_SAMPLE.reset(token)
+
+
+class _AttributedTracker(StrictTracker):
+    # Also keeps the updates of each counter made while processing a sample (see `_attributing_to`), so that they
+    # can be withdrawn for that sample only
+
+    def __init__(self, allowed_keys: Set[str]):
+        super().__init__(allowed_keys)
+        self.by_sample: Dict[int, Dict[str, int]] = collections.defaultdict(collections.Counter)
+        self._samples: Dict[int, Dict[str, Any]] = {}
+
+    def __setitem__(self, key, value):
+        sample = _CURRENT_SAMPLE.get()
+        if sample is not None:
+            self.by_sample[id(sample)][key] += value - self.get(key, 0)
+            self._samples[id(sample)] = sample
+        return super().__setitem__(key, value)
+
+    def withdraw(self, sample: Dict[str, Any]) -> None:
+        for key, value in self.by_sample.pop(id(sample), {}).items():
+            super().__setitem__(key, self[key] - value)
+
+    def merge_into(self, tracker: StrictTracker) -> None:
+        """
+        Add these counters into the tracker, attributing them to the same samples, in case it keeps track of them.
+        """
+        unattributed = collections.Counter(self)
+        for sample_id, counters in self.by_sample.items():
+            with _attributing_to(self._samples[sample_id]):
+                for key, value in counters.items():
+                    tracker[key] += value
+            unattributed.subtract(counters)
+        for key, value in unattributed.items():
+            if value:
+                tracker[key] += value
+
+
+def _record_usage(response: str) -> None:
+    if not isinstance(response, Completion):
+        return
+
+    usage = response.usage()
+    metrics = _CURRENT_METRICS.get()
+    if metrics is not None:
+        metrics.record_usage(usage)
+
+    sample = _CURRENT_SAMPLE.get()
+    if sample is not None:
+        _add_usage(sample, usage)
+
+
+def _add_usage(sample: Dict[str, Any], usage: Dict[str, float]) -> None:
+    with _SAMPLE_USAGE_LOCK:
+        total = sample.get("usage") or dict.fromkeys(USAGE_FIELDS, 0)
+        sample["usage"] = {field: total[field] + usage[field] for field in USAGE_FIELDS}
+
+
+def share_usage(response: str, samples: List[Dict[str, Any]]) -> None:
+    """
+    Split the usage of a response evenly among the samples it answers, for requests made on behalf of several
+    samples at once, outside of the sample being processed.
+    """
+    if not isinstance(response, Completion) or not samples:
+        return
+
+    usage = response.usage()
+    for i, sample in enumerate(samples):
+        # Tokens stay integers, the remainder going to the first samples
+        share = {
+            field: usage[field] // len(samples) + (i < usage[field] % len(samples))
+            for field in USAGE_FIELDS if field != "cost"
+        }
+        _add_usage(sample, {**share, "cost": usage["cost"] / len(samples)})
+
+
+_RETRY: contextvars.ContextVar[bool] = contextvars.ContextVar("_RETRY", default=False)
+
+
+def _record_llm_call(retry: bool) -> None:
+    metrics = _CURRENT_METRICS.get()
+    if metrics is not None:
+        metrics.record_llm_call(retry)
+    _RETRY.set(retry)
+
+
+def is_retry() -> bool:
+    """
+    Whether the LLM request being issued through `query` or `aquery` repeats a previous one, e.g., because the
+    previous response was invalid. LLM wrappers can use it to avoid serving the same response again.
+    """
+    return _RETRY.get()
+
+
+def query(llm: LLM, *args, retry: bool = False, **kwargs) -> str:
+    """
+    Query a language model on behalf of the step being run, so the request and its usage (see `Completion`) are
+    counted in its metrics and in the sample being processed.
+
+    Args:
+        llm (LLM): The language model to query. The remaining arguments are passed to its `query` method.
+        retry (bool): Whether this request repeats a previous one (e.g., after an invalid response).
+
+    Returns:
+        str: The LLM's response as a string.
+    """
+    _record_llm_call(retry)
+    try:
+        response = llm.query(*args, **kwargs)
+    finally:
+        _RETRY.set(False)
+    _record_usage(response)
+    return response
+
+
+async def aquery(llm: Union[LLM, AsyncLLM], *args, retry: bool = False, **kwargs) -> str:
+    """
+    Query either kind of language model from a coroutine.
+
+    An `AsyncLLM` is awaited directly, while a blocking `LLM` is run in a worker thread so the event loop
+    is not blocked while waiting for the response. Like `query`, the request and its usage are counted in the
+    metrics of the step being run and in the sample being processed.
+    """
+    _record_llm_call(retry)
+    try:
+        if isinstance(llm, AsyncLLM):
+            response = await llm.query(*args, **kwargs)
+        else:
+            response = await asyncio.to_thread(llm.query, *args, **kwargs)
+    finally:
+        _RETRY.set(False)
+    _record_usage(response)
+    return response
+
+
+def query_n(llm: LLM, messages: List[Dict[str, str]], n: int, retry: bool = False) -> List[str]:
+    """
+    Like `query`, but asks for `n` alternative responses at once (see `LLM.query_n`), counted as a single request.
+    """
+    _record_llm_call(retry)
+    try:
+        responses = llm.query_n(messages, n)
+    finally:
+        _RETRY.set(False)
+    for response in responses:
+        _record_usage(response)
+    return responses
+
+
+async def aquery_n(llm: Union[LLM, AsyncLLM], messages: List[Dict[str, str]], n: int, retry: bool = False) -> List[str]:
+    """
+    The counterpart of `query_n` for coroutines, which accepts either kind of language model (see `aquery`).
+    """
+    _record_llm_call(retry)
+    try:
+        if isinstance(llm, AsyncLLM):
+            responses = await llm.query_n(messages, n)
+        else:
+            responses = await asyncio.to_thread(llm.query_n, messages, n)
+    finally:
+        _RETRY.set(False)
+    for response in responses:
+        _record_usage(response)
+    return responses
+
+
+def _consume(chunks: Iterator[str], until: Optional[Callable[[str], bool]]) -> str:
+    received, text = [], ""
+    with contextlib.closing(chunks):
+        for chunk in chunks:
+            received.append(chunk)
+            text += chunk
+            if until is not None and until(text):
+                break
+    return join_chunks(received)
+
+
+async def _aconsume(chunks: AsyncIterator[str], until: Optional[Callable[[str], bool]]) -> str:
+    received, text = [], ""
+    async with contextlib.aclosing(chunks):
+        async for chunk in chunks:
+            received.append(chunk)
+            text += chunk
+            if until is not None and until(text):
+                break
+    return join_chunks(received)
+
+
+def query_stream(
+        llm: LLM,
+        messages: List[Dict[str, str]],
+        stop: Optional[List[str]] = None,
+        until: Optional[Callable[[str], bool]] = None,
+        retry: bool = False,
+) -> str:
+    """
+    Like `query`, but the response is streamed (see `LLM.stream`) and returned as soon as it is complete for the
+    caller: once `until` holds for the text received so far, the stream is closed and the rest of the response is
+    not generated.
+
+    Args:
+        llm (LLM): The language model to query.
+        messages (List[Dict[str, str]]): A list of message dicts with keys like 'role' and 'content'.
+        stop (Optional[List[str]]): Sequences where the response stops.
+        until (Optional[Callable[[str], bool]]): Incremental parser, telling whether the text received so far
+            holds everything the caller needs. If None, the whole response is received.
+        retry (bool): Whether this request repeats a previous one (e.g., after an invalid response).
+
+    Returns:
+        str: The response received, up to the chunk completing it.
+    """
+    _record_llm_call(retry)
+    try:
+        response = _consume(llm.stream(messages, stop=stop), until)
+    finally:
+        _RETRY.set(False)
+    _record_usage(response)
+    return response
+
+
+async def aquery_stream(
+        llm: Union[LLM, AsyncLLM],
+        messages: List[Dict[str, str]],
+        stop: Optional[List[str]] = None,
+        until: Optional[Callable[[str], bool]] = None,
+        retry: bool = False,
+) -> str:
+    """
+    The counterpart of `query_stream` for coroutines, which accepts either kind of language model (see `aquery`).
+    """
+    _record_llm_call(retry)
+    try:
+        if isinstance(llm, AsyncLLM):
+            response = await _aconsume(llm.stream(messages, stop=stop), until)
+        else:
+            response = await asyncio.to_thread(_consume, llm.stream(messages, stop=stop), until)
+    finally:
+        _RETRY.set(False)
+    _record_usage(response)
+    return response
+
+
+def _describe(value: Any) -> Any:
+    # JSON-serializable description of a step parameter, for its fingerprint
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, (LLM, AsyncLLM)):
+        # Wrappers (caches, retries, rate limits...) do not change the responses, only the model does
+        return {"llm": getattr(value, "model", type(value).__name__)}
+    if isinstance(value, dict):
+        return {str(k): _describe(v) for k, v in value.items()}
+    if isinstance(value, (set, frozenset)):
+        return sorted((_describe(v) for v in value), key=lambda v: json.dumps(v, sort_keys=True))
+    if isinstance(value, (list, tuple)):
+        return [_describe(v) for v in value]
+    model = getattr(value, "model", None)
+    return {"type": type(value).__name__, "model": model} if isinstance(model, str) else type(value).__name__
+
+
+def _save(sample: Dict[str, Any], fields: Optional[Iterable[str]]) -> Dict[str, Any]:
+    # Copy of the given fields of a sample (all of them if None), to restore it with `_restore`
+    if fields is None:
+        return copy.deepcopy(sample)
+    return {field: copy.deepcopy(sample[field]) for field in fields if field in sample}
+
+
+def _restore(sample: Dict[str, Any], fields: Optional[Iterable[str]], saved: Dict[str, Any]) -> None:
+    if fields is None:
+        sample.clear()
+        sample.update(saved)
+        return
+    for field in fields:
+        if field in saved:
+            sample[field] = saved[field]
+        else:
+            sample.pop(field, None)
+
 
 class Step(abc.ABC):
     """
@@ -65,11 +657,19 @@ class Step(abc.ABC):
     Args:
         required_fields (Set[str]): Set of keys that must be present in each sample before running this step.
         counters (Set[str]): Set of counter names that this step may increment in the tracker.
+        produced_fields (Set[str]): Set of keys this step sets in each sample. A sample for which any of them is
+            left unset or None is considered failed, and is skipped by the following steps (see `Pipeline`).
     """
 
-    def __init__(self, required_fields: Set[str] = frozenset(), counters: Set[str] = frozenset()):
+    def __init__(
+            self,
+            required_fields: Set[str] = frozenset(),
+            counters: Set[str] = frozenset(),
+            produced_fields: Set[str] = frozenset(),
+    ):
         self.required_fields = required_fields
         self.counters = counters
+        self.produced_fields = produced_fields
 
     def validate(self, sample: Dict[str, Any]) -> None:
         """
@@ -98,12 +698,81 @@ class Step(abc.ABC):
         """
         ...
 
+    async def step_async(self, sample: Dict[str, Any], tracker: Dict[str, int]) -> None:
+        """
+        Asynchronous variant of `step`, used by `Pipeline.run_async`.
+
+        By default, it runs `step` in a worker thread. Steps waiting on an LLM should override it and await
+        the network instead (see `aquery`).
+
+        Args:
+            sample (Dict[str, Any]): The data sample to process.
+            tracker (Dict[str, int]): A dictionary tracking counters/errors during processing.
+        """
+        await asyncio.to_thread(self.step, sample, tracker)
+
+    def setup(self) -> None:
+        """
+        Prepare expensive resources (e.g., load a model) before processing samples.
+
+        It is called once in each worker process when the step runs in a process pool (see `Pipeline.with_step`),
+        so such resources can be created there instead of being pickled along with the step. By default, it does
+        nothing.
+        """
+
+    def step_batch(self, samples: List[Dict[str, Any]], tracker: Dict[str, int]) -> None:
+        """
+        Execute the step logic on a micro-batch of samples, possibly updating the tracker.
+
+        By default, it calls `step` on each sample. Steps that can amortize work across samples (e.g., parsing
+        several texts at once, or sending several prompts in one request) should override it. The size of the
+        micro-batches is set by `Pipeline`'s `batch_size`.
+
+        Args:
+            samples (List[Dict[str, Any]]): The data samples to process.
+            tracker (Dict[str, int]): A dictionary tracking counters/errors during processing.
+        """
+        for sample in samples:
+            with _attributing_to(sample):
+                self.step(sample, tracker)
+
+    @property
+    def batched(self) -> bool:
+        """
+        Whether `step_batch` processes the samples of a micro-batch together, instead of calling `step` on each
+        one. If not, `Pipeline` may call `step` on each sample itself, e.g., to tell which sample a failure comes
+        from. By default, it holds if `step_batch` is overridden.
+        """
+        return type(self).step_batch is not Step.step_batch
+
+    def config(self) -> Dict[str, Any]:
+        """
+        Parameters of the step determining its outputs, from which its `fingerprint` is computed.
+
+        By default, they are the attributes of the step: numbers, strings and collections of them as they are,
+        language models by their model name, and other objects by their type (and `model` attribute, if any).
+        Steps whose outputs depend on other state should override it.
+        """
+        return {
+            name: _describe(value) for name, value in vars(self).items()
+            if name not in ("required_fields", "counters", "produced_fields")
+        }
+
+    def fingerprint(self) -> str:
+        """
+        Hash of the class and `config` of the step, identifying the outputs it produces from given inputs (see
+        `truthbench.artifacts.ArtifactStore`).
+        """
+        payload = json.dumps({"step": type(self).__name__, "config": self.config()}, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
 
 class Reader(abc.ABC):
     """
     Abstract base class for data readers that provide samples to the pipeline.
 
-    Subclasses must implement the `samples` method that returns a list of validated samples.
+    Subclasses must implement the `samples` method that returns a list of validated samples. Readers over large
+    sources can also override `stream` to produce samples lazily (see `Pipeline.stream`).
     """
 
     @abc.abstractmethod
@@ -119,6 +788,89 @@ class Reader(abc.ABC):
         """
         ...
 
+    def stream(self) -> Iterator[Dict[str, Any]]:
+        """
+        Lazily yield validated samples.
+
+        By default, it iterates over `samples`, thus loading the whole source at once.
+
+        Yields:
+            Dict[str, Any]: A dictionary containing 'question' and 'ground_truth' keys.
+
+        Raises:
+            ValueError: If the source could not be read or has an invalid format.
+        """
+        yield from self.samples()
+
+
+_WORKER_STEP: Optional[Step] = None
+
+
+def _initialize_worker(step: Step) -> None:
+    global _WORKER_STEP
+    step.setup()
+    _WORKER_STEP = step
+
+
+def _step_in_worker(
+        batch: List[Dict[str, Any]], counters: Set[str]
+) -> Tuple[List[Dict[str, Any]], Dict[str, int], Dict[str, float]]:
+    tracker = StrictTracker(counters)
+    metrics = StepMetrics()
+    with _measuring(metrics, len(batch)):
+        _WORKER_STEP.step_batch(batch, tracker)
+    return batch, dict(tracker), metrics.llm_counts()
+
+
+class StageStats:
+    """
+    Runtime statistics of a step running as its own stage (see `Pipeline`'s `staged`).
+
+    Attributes:
+        processed (int): Number of samples processed by the stage.
+        busy_time (float): Seconds spent processing samples.
+        queue_depth_sum (int): Sum of the input queue depths observed each time the stage took a micro-batch.
+        max_queue_depth (int): Largest input queue depth observed.
+        observations (int): Number of micro-batches taken by the stage.
+    """
+
+    def __init__(self):
+        self.processed = 0
+        self.busy_time = 0.
+        self.queue_depth_sum = 0
+        self.max_queue_depth = 0
+        self.observations = 0
+
+    def observe(self, queue_depth: int, batch_size: int, busy_time: float) -> None:
+        self.processed += batch_size
+        self.busy_time += busy_time
+        self.queue_depth_sum += queue_depth
+        self.max_queue_depth = max(self.max_queue_depth, queue_depth)
+        self.observations += 1
+
+    def summary(self, elapsed: float) -> Dict[str, float]:
+        """
+        Summarize the stage behavior over a run lasting `elapsed` seconds.
+
+        A stage with high utilization and an empty input queue is the bottleneck of the pipeline, while stages
+        right before it show full input queues.
+        """
+        return {
+            "processed": self.processed,
+            "utilization": self.busy_time / elapsed if elapsed > 0 else 0.,
+            "mean_queue_depth": self.queue_depth_sum / self.observations if self.observations else 0.,
+            "max_queue_depth": self.max_queue_depth,
+        }
+
+
+class _Failure:
+
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+_DONE = object()
+
 
 class Pipeline:
     """
@@ -126,49 +878,860 @@ class Pipeline:
 
     Args:
         with_progress (bool): Whether to display a progress bar during execution (tqdm).
+        max_workers (int): Number of micro-batches processed concurrently. Steps are shared across workers, so
+            they must be safe to call from multiple threads when this is larger than 1.
+        batch_size (int): Number of samples in each micro-batch fed to `Step.step_batch`. Samples of a
+            micro-batch go through the steps together, so steps that amortize work across samples can do so.
+        staged (bool): Whether to run each step as its own stage, in a dedicated thread, connected to the next
+            one by a bounded queue. Micro-batches then flow through the steps like in an assembly line, so that
+            a CPU-bound step works on a micro-batch while an LLM-bound step waits for the network on another.
+            Statistics about each stage are available from `stage_stats` after the run. It requires
+            `max_workers` to be 1.
+        queue_size (int): Maximum number of micro-batches waiting in front of each stage when `staged`.
+        input_fields (Optional[Set[str]]): Keys present in every sample provided by the reader. If given, the
+            dependencies between steps are checked once, when each step is added (see `with_step`), instead of
+            validating every sample before every step.
+        isolate_failures (bool): Whether an exception raised by a step for a sample only fails that sample, instead
+            of aborting the run. The failed sample is terminated (see below), the step name, error and traceback are
+            recorded in its "error" field, and it is counted as "failed_samples". If a step processes its samples
+            together (see `Step.batched`), the failing sample of a micro-batch is unknown, so the samples of a failed
+            micro-batch are restored and processed again one by one.
+        parallel_steps (bool): Whether steps that do not depend on each other (see `step_dependencies`) process the
+            same samples concurrently, to shorten the path of each sample through the pipeline (e.g., a CPU-bound
+            step runs while an LLM-bound one waits for the network). Outcomes are applied in the order of the steps:
+            if a step terminates a sample, the outputs and counters of the steps running alongside it are withdrawn
+            for that sample, so results are the same as when running them one after the other. The LLM requests
+            those steps already sent for it are still paid for, and reported in the usage of the sample and the
+            metrics of the steps. Counters a step updates for several samples at once (e.g., in a batched request,
+            outside of `Step.step`) cannot be withdrawn. Dependencies are derived from the declared fields of the
+            steps, so it requires `input_fields`, and steps must declare every field they set. It cannot be
+            combined with `staged`.
+        artifacts (Optional[ArtifactStore]): Where the outputs of the steps are stored, keyed on the fingerprint of
+            each step and the fields it requires in each sample. When given, a step whose outputs for a sample are
+            already stored reuses them instead of running, and is counted as "reused_step_outputs". Its counters
+            and usage are those of the run that computed them, so they are not accounted again. Only outputs of
+            successful samples are stored, so failed and terminated samples are computed again. It requires
+            `input_fields`, since the inputs of each step are its declared required fields.
+
+    A sample for which a step leaves one of its `Step.produced_fields` unset or None is terminated: the name of
+    that step is recorded in its "terminated_at" field, and the following steps skip it.
     """
 
-    def __init__(self, with_progress: bool = True):
+    def __init__(
+            self,
+            with_progress: bool = True,
+            max_workers: int = 1,
+            batch_size: int = 1,
+            staged: bool = False,
+            queue_size: int = 4,
+            input_fields: Optional[Set[str]] = None,
+            isolate_failures: bool = False,
+            parallel_steps: bool = False,
+            artifacts: Optional[ArtifactStore] = None,
+    ):
+        if max_workers < 1:
+            raise ValueError(f"max_workers must be at least 1, but got {max_workers}")
+        if batch_size < 1:
+            raise ValueError(f"batch_size must be at least 1, but got {batch_size}")
+        if queue_size < 1:
+            raise ValueError(f"queue_size must be at least 1, but got {queue_size}")
+        if staged and max_workers > 1:
+            raise ValueError("Staged execution runs one thread per step, so max_workers must be 1")
+        if parallel_steps and input_fields is None:
+            raise ValueError("Parallel steps are scheduled from the declared fields, so input_fields is required")
+        if parallel_steps and staged:
+            raise ValueError("Staged execution already runs steps concurrently, so it cannot run parallel_steps")
+        if artifacts is not None and input_fields is None:
+            raise ValueError("Artifacts are keyed on the declared fields of the steps, so input_fields is required")
+
         self._steps: List[Step] = []
+        self._processes: List[int] = []
         self._with_progress = with_progress
+        self._max_workers = max_workers
+        self._batch_size = batch_size
+        self._staged = staged
+        self._queue_size = queue_size
+        self._stage_stats: Dict[str, Dict[str, float]] = {}
+        self._step_metrics: Dict[str, StepMetrics] = {}
+        self._input_fields = frozenset(input_fields) if input_fields is not None else None
+        self._available_fields = self._input_fields
+        self._isolate_failures = isolate_failures
+        self._parallel_steps = parallel_steps
+        self._artifacts = artifacts
+        self._fingerprints: List[str] = []
 
-    def with_step(self, step: Step) -> 'Pipeline':
+    def with_step(self, step: Step, processes: int = 0) -> 'Pipeline':
         """
         Add a processing step to the pipeline.
 
+        CPU-bound steps (e.g., parsing with spaCy) can be run in a pool of worker processes to scale with the
+        number of cores instead of competing for the GIL. The step is pickled once per worker, where its `setup`
+        method is called, and each micro-batch is split among the workers. Samples and counters are sent back
+        and forth between processes, so the step must be picklable.
+
+        If the pipeline knows its `input_fields`, the fields required by the step must be among them or produced by
+        a previous step.
+
         Args:
             step (Step): A step instance to add.
+            processes (int): Number of worker processes to run the step in. If 0, it runs in the calling thread.
 
         Returns:
             Pipeline: Self, to allow method chaining.
+
+        Raises:
+            ValueError: If a field required by the step is not available at this point of the pipeline.
         """
+        if processes < 0:
+            raise ValueError(f"processes must not be negative, but got {processes}")
+
+        if self._available_fields is not None:
+            missing = step.required_fields - self._available_fields
+            if missing:
+                raise ValueError(
+                    f"{type(step).__name__} requires {sorted(step.required_fields)}, but {sorted(missing)} are "
+                    f"neither input fields nor produced by a previous step."
+                )
+            self._available_fields = self._available_fields | step.produced_fields
+
+        if self._artifacts is not None:
+            self._fingerprints.append(step.fingerprint())
         self._steps.append(step)
+        self._processes.append(processes)
         return self
 
+    @property
+    def output_fields(self) -> Optional[FrozenSet[str]]:
+        """
+        Fields available in the samples once they went through all the steps, i.e., the `input_fields` and the
+        fields produced by the steps, or None if the `input_fields` are unknown. Samples terminated by a step lack
+        the fields of the following steps.
+        """
+        return self._available_fields
+
+    @property
+    def stage_stats(self) -> Dict[str, Dict[str, float]]:
+        """
+        Per-step statistics of the last staged run, keyed by step name: number of processed samples,
+        utilization (fraction of the run the stage spent processing) and mean/max depth of its input queue.
+        """
+        return self._stage_stats
+
+    @property
+    def step_metrics(self) -> Dict[str, Dict[str, float]]:
+        """
+        Per-step metrics of the last run, keyed by step name: number of calls and samples, wall time,
+        throughput, p50/p95/p99 latency of each call, number of LLM requests and retries, and their tokens and
+        cost (see `StepMetrics`).
+        """
+        return {name: metrics.summary() for name, metrics in self._step_metrics.items()}
+
+    def _reset_metrics(self) -> List[StepMetrics]:
+        self._step_metrics = {name: StepMetrics() for name in self.step_names()}
+        return list(self._step_metrics.values())
+
+    def step_names(self) -> List[str]:
+        """
+        Names identifying each step, in order. It is the class name, suffixed by its position if the same
+        class appears more than once.
+        """
+        names = [type(step).__name__ for step in self._steps]
+        counts = collections.Counter(names)
+        return [name if counts[name] == 1 else f"{name}_{i}" for i, name in enumerate(names)]
+
+    def _allowed_keys(self) -> Set[str]:
+        keys = {"input_samples", "failed_samples"} if self._isolate_failures else {"input_samples"}
+        if self._artifacts is not None:
+            keys.add("reused_step_outputs")
+        return keys | frozenset.union(*(step.counters for step in self._steps))
+
+    @contextlib.contextmanager
+    def _process_pools(self) -> Iterator[List[Optional[ProcessPoolExecutor]]]:
+        # Forking a process holding threads (progress bar, thread pools) is unsafe, so workers are spawned
+        context = multiprocessing.get_context("spawn")
+        pools = [
+            ProcessPoolExecutor(
+                max_workers=processes, mp_context=context, initializer=_initialize_worker, initargs=(step,)
+            ) if processes else None
+            for step, processes in zip(self._steps, self._processes)
+        ]
+        try:
+            yield pools
+        finally:
+            for pool in pools:
+                if pool is not None:
+                    pool.shutdown(wait=True, cancel_futures=True)
+
+    @staticmethod
+    def _merge_from_worker(
+            batch: List[Dict[str, Any]],
+            result: Tuple[List[Dict[str, Any]], Dict[str, int], Dict[str, float]],
+            tracker: StrictTracker,
+            metrics: StepMetrics,
+    ) -> None:
+        processed, counters, llm_counts = result
+        # Samples are updated in place, as if the step had run in this process
+        for sample, updated in zip(batch, processed):
+            sample.clear()
+            sample.update(updated)
+        tracker.merge(counters)
+        metrics.merge_llm_counts(llm_counts)
+
+    def _schedule(self) -> List[List[int]]:
+        # Waves of steps, in order, whose steps may run concurrently
+        if not self._parallel_steps:
+            return [[i] for i in range(len(self._steps))]
+
+        levels = []
+        for dependencies in self._dependencies():
+            levels.append(1 + max((levels[i] for i in dependencies), default=-1))
+        return [[i for i, level in enumerate(levels) if level == wave] for wave in range(max(levels, default=-1) + 1)]
+
+    def _dependencies(self) -> List[List[int]]:
+        # Samples are replaced as a whole by worker processes (see `_merge_from_worker`), so a step running in a
+        # process pool never runs concurrently with another one
+        return [
+            [
+                i for i, previous in enumerate(self._steps[:j])
+                if previous.produced_fields & (step.required_fields | step.produced_fields)
+                or previous.required_fields & step.produced_fields
+                or self._processes[i] or self._processes[j]
+            ]
+            for j, step in enumerate(self._steps)
+        ]
+
+    def step_dependencies(self) -> Dict[str, List[str]]:
+        """
+        Names of the steps each step depends on, keyed by step name. They are derived from the declared fields of
+        the steps: a step depends on a previous one if it requires a field the previous one produces, or if it
+        produces a field the previous one requires or produces. Steps running in worker processes depend on all
+        previous steps. With `parallel_steps`, a step starts once all the steps it depends on are done.
+        """
+        names = self.step_names()
+        return {names[j]: [names[i] for i in dependencies] for j, dependencies in enumerate(self._dependencies())}
+
+    def _run_step(
+            self,
+            i: int,
+            batch: List[Dict[str, Any]],
+            tracker: StrictTracker,
+            pools: List[Optional[ProcessPoolExecutor]],
+            metrics: List[StepMetrics],
+    ) -> None:
+        batch = self._pending(i, batch)
+        errors = self._execute_step(i, batch, tracker, pools, metrics)
+        self._conclude(i, batch, errors, tracker)
+
+    def _run_wave(
+            self,
+            wave: List[int],
+            batch: List[Dict[str, Any]],
+            tracker: StrictTracker,
+            pools: List[Optional[ProcessPoolExecutor]],
+            metrics: List[StepMetrics],
+            executor: Optional[ThreadPoolExecutor],
+    ) -> None:
+        if len(wave) == 1:
+            self._run_step(wave[0], batch, tracker, pools, metrics)
+            return
+
+        # The steps of a wave do not depend on each other, so they process the micro-batch concurrently. Their
+        # outcomes are then applied in order, as if they had run one after the other.
+        batches = [self._pending(i, batch) for i in wave]
+        snapshots = [
+            [_save(sample, self._steps[i].produced_fields) for sample in pending] for i, pending in zip(wave, batches)
+        ]
+        counters = [_AttributedTracker(self._allowed_keys()) for _ in wave]
+        futures = [
+            executor.submit(self._execute_step, i, pending, step_counters, pools, metrics)
+            for i, pending, step_counters in zip(wave[1:], batches[1:], counters[1:])
+        ]
+        try:
+            first = self._execute_step(wave[0], batches[0], counters[0], pools, metrics)
+        finally:
+            concurrent.futures.wait(futures)
+        outcomes = [first] + [future.result() for future in futures]
+
+        for i, pending, snapshot, step_counters, errors in zip(wave, batches, snapshots, counters, outcomes):
+            # Samples terminated by a previous step of the wave would have been skipped by this one
+            for sample, fields in zip(pending, snapshot):
+                if "terminated_at" in sample:
+                    _restore(sample, self._steps[i].produced_fields, fields)
+                    step_counters.withdraw(sample)
+            kept = [(sample, error) for sample, error in zip(pending, errors) if "terminated_at" not in sample]
+            tracker.merge(step_counters)
+            self._conclude(i, [sample for sample, _ in kept], [error for _, error in kept], tracker)
+
+    def _pending(self, i: int, batch: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        batch = [sample for sample in batch if "terminated_at" not in sample]
+        if self._input_fields is None:
+            for sample in batch:
+                self._steps[i].validate(sample)
+        return batch
+
+    def _execute_step(
+            self,
+            i: int,
+            batch: List[Dict[str, Any]],
+            tracker: StrictTracker,
+            pools: List[Optional[ProcessPoolExecutor]],
+            metrics: List[StepMetrics],
+    ) -> List[Optional[Exception]]:
+        # Returns the error raised for each sample, if failures are isolated
+        if self._artifacts is None or not self._steps[i].produced_fields:
+            return self._compute_step(i, batch, tracker, pools, metrics)
+
+        # Inputs are read before the step runs, since it may update some of them (e.g., answers)
+        keys = [self._artifact_key(i, sample) for sample in batch]
+        missing = [j for j, (sample, key) in enumerate(zip(batch, keys)) if not self._reuse(sample, key, tracker)]
+        errors = [None] * len(batch)
+        computed = self._compute_step(i, [batch[j] for j in missing], tracker, pools, metrics)
+        for j, error in zip(missing, computed):
+            errors[j] = error
+            if error is None:
+                self._store(i, batch[j], keys[j])
+        return errors
+
+    def _artifact_key(self, i: int, sample: Dict[str, Any]) -> str:
+        return ArtifactStore.key(self._fingerprints[i], sample, sorted(self._steps[i].required_fields))
+
+    def _reuse(self, sample: Dict[str, Any], key: str, tracker: StrictTracker) -> bool:
+        outputs = self._artifacts.get(key)
+        if outputs is None:
+            return False
+        sample.update(outputs)
+        with _attributing_to(sample):
+            tracker["reused_step_outputs"] += 1
+        return True
+
+    def _store(self, i: int, sample: Dict[str, Any], key: str) -> None:
+        outputs = {field: sample.get(field) for field in self._steps[i].produced_fields}
+        if all(value is not None for value in outputs.values()):
+            self._artifacts.put(key, outputs)
+
+    def _compute_step(
+            self,
+            i: int,
+            batch: List[Dict[str, Any]],
+            tracker: StrictTracker,
+            pools: List[Optional[ProcessPoolExecutor]],
+            metrics: List[StepMetrics],
+    ) -> List[Optional[Exception]]:
+        if not batch:
+            return []
+        if not self._isolate_failures:
+            self._call_step(i, batch, tracker, pools, metrics)
+            return [None] * len(batch)
+
+        step = self._steps[i]
+        if pools[i] is None and not step.batched:
+            # Samples are processed one by one anyway, so the failing ones are known and the others not run again
+            with _measuring(metrics[i], len(batch)):
+                return [self._attempt_sample(step, sample, tracker) for sample in batch]
+
+        error = self._attempt_step(i, batch, tracker, pools, metrics)
+        if error is None:
+            return [None] * len(batch)
+        if len(batch) == 1:
+            return [error]
+        # The failing sample is unknown, so each one is processed again on its own
+        return [self._attempt_step(i, [sample], tracker, pools, metrics) for sample in batch]
+
+    def _attempt_sample(self, step: Step, sample: Dict[str, Any], tracker: StrictTracker) -> Optional[Exception]:
+        counters = StrictTracker(self._allowed_keys())
+        with _attributing_to(sample):
+            try:
+                step.step(sample, counters)
+            except Exception as e:
+                return e
+            tracker.merge(counters)
+        return None
+
+    def _call_step(
+            self,
+            i: int,
+            batch: List[Dict[str, Any]],
+            tracker: StrictTracker,
+            pools: List[Optional[ProcessPoolExecutor]],
+            metrics: List[StepMetrics],
+    ) -> None:
+        step, pool, step_metrics = self._steps[i], pools[i], metrics[i]
+        if pool is None:
+            with _measuring(step_metrics, len(batch)):
+                step.step_batch(batch, tracker)
+            return
+
+        # The micro-batch is split among the workers, so it is processed in parallel
+        chunk_size = -(-len(batch) // self._processes[i])
+        chunks = [batch[j:j + chunk_size] for j in range(0, len(batch), chunk_size)]
+        with _measuring(step_metrics, len(batch)):
+            futures = [pool.submit(_step_in_worker, chunk, step.counters) for chunk in chunks]
+            results = [future.result() for future in futures]
+        for chunk, result in zip(chunks, results):
+            self._merge_from_worker(chunk, result, tracker, step_metrics)
+
+    def _attempt_step(
+            self,
+            i: int,
+            batch: List[Dict[str, Any]],
+            tracker: StrictTracker,
+            pools: List[Optional[ProcessPoolExecutor]],
+            metrics: List[StepMetrics],
+    ) -> Optional[Exception]:
+        # Counters are only kept if the step succeeds, and samples are restored if it fails, since the samples of a
+        # failed micro-batch are processed again. Only the fields the step may write are saved, if it declares them
+        counters = _AttributedTracker(self._allowed_keys())
+        produced_fields = self._steps[i].produced_fields
+        fields = produced_fields | {"usage"} if produced_fields else None
+        snapshots = [_save(sample, fields) for sample in batch] if len(batch) > 1 else []
+        try:
+            self._call_step(i, batch, counters, pools, metrics)
+        except Exception as e:
+            for sample, snapshot in zip(batch, snapshots):
+                _restore(sample, fields, snapshot)
+            return e
+        counters.merge_into(tracker)
+        return None
+
+    def _conclude(
+            self, i: int, batch: List[Dict[str, Any]], errors: List[Optional[Exception]], tracker: StrictTracker
+    ) -> None:
+        for sample, error in zip(batch, errors):
+            if error is not None:
+                self._fail(i, sample, error, tracker)
+        self._terminate(i, batch)
+
+    def _fail(self, i: int, sample: Dict[str, Any], error: Exception, tracker: StrictTracker) -> None:
+        if "terminated_at" in sample:
+            # Terminated by a previous step running concurrently, so this step would not have run otherwise
+            return
+        name = self.step_names()[i]
+        sample["terminated_at"] = name
+        sample["error"] = {
+            "step": name,
+            "type": type(error).__name__,
+            "message": str(error),
+            "traceback": "".join(traceback.format_exception(error)),
+        }
+        tracker["failed_samples"] += 1
+
+    def _terminate(self, i: int, batch: List[Dict[str, Any]]) -> None:
+        produced_fields = self._steps[i].produced_fields
+        if not produced_fields:
+            return
+        name = self.step_names()[i]
+        for sample in batch:
+            if "terminated_at" not in sample and any(sample.get(field) is None for field in produced_fields):
+                sample["terminated_at"] = name
+
+    def _process(
+            self,
+            batch: List[Dict[str, Any]],
+            allowed_keys: Set[str],
+            pools: List[Optional[ProcessPoolExecutor]],
+            metrics: List[StepMetrics],
+            waves: List[List[int]],
+            executor: Optional[ThreadPoolExecutor] = None,
+    ) -> Tuple[List[Dict[str, Any]], StrictTracker]:
+        tracker = StrictTracker(allowed_keys)
+        tracker["input_samples"] += len(batch)
+        for wave in waves:
+            self._run_wave(wave, batch, tracker, pools, metrics, executor)
+        return batch, tracker
+
+    async def _process_async(
+            self,
+            sample: Dict[str, Any],
+            allowed_keys: Set[str],
+            pools: List[Optional[ProcessPoolExecutor]],
+            metrics: List[StepMetrics],
+            waves: List[List[int]],
+    ) -> Tuple[Dict[str, Any], StrictTracker]:
+        tracker = StrictTracker(allowed_keys)
+        tracker["input_samples"] += 1
+        for wave in waves:
+            if "terminated_at" in sample:
+                break
+            if self._input_fields is None:
+                for i in wave:
+                    self._steps[i].validate(sample)
+
+            snapshots = [_save(sample, self._steps[i].produced_fields) if len(wave) > 1 else {} for i in wave]
+            counters = [StrictTracker(allowed_keys) for _ in wave]
+            errors = await asyncio.gather(*(
+                self._step_async(i, sample, step_counters, pools, metrics) for i, step_counters in zip(wave, counters)
+            ))
+            for i, fields, step_counters, error in zip(wave, snapshots, counters, errors):
+                if "terminated_at" in sample:
+                    # Terminated by a previous step of the wave, so this one would have been skipped
+                    _restore(sample, self._steps[i].produced_fields, fields)
+                    continue
+                if error is None:
+                    tracker.merge(step_counters)
+                self._conclude(i, [sample], [error], tracker)
+        return sample, tracker
+
+    async def _step_async(
+            self,
+            i: int,
+            sample: Dict[str, Any],
+            tracker: StrictTracker,
+            pools: List[Optional[ProcessPoolExecutor]],
+            metrics: List[StepMetrics],
+    ) -> Optional[Exception]:
+        key = None
+        if self._artifacts is not None and self._steps[i].produced_fields:
+            key = self._artifact_key(i, sample)
+            if self._reuse(sample, key, tracker):
+                return None
+
+        step, pool, step_metrics = self._steps[i], pools[i], metrics[i]
+        try:
+            if pool is not None:
+                with _measuring(step_metrics, 1):
+                    result = await asyncio.wrap_future(pool.submit(_step_in_worker, [sample], step.counters))
+                self._merge_from_worker([sample], result, tracker, step_metrics)
+            else:
+                with _measuring(step_metrics, 1), _attributing_to(sample):
+                    await step.step_async(sample, tracker)
+        except Exception as e:
+            if not self._isolate_failures:
+                raise
+            return e
+        if key is not None:
+            self._store(i, sample, key)
+        return None
+
+    def _stream(
+            self,
+            samples: Iterable[Dict[str, Any]],
+            total: Optional[int] = None,
+            tracker: Optional[Dict[str, int]] = None,
+    ) -> Iterator[Tuple[Dict[str, Any], Dict[str, int]]]:
+        allowed_keys = self._allowed_keys()
+        initial, tracker = tracker, StrictTracker(allowed_keys)
+        if initial:
+            tracker.merge(initial)
+
+        samples = iter(samples)
+        batches = iter(lambda: list(itertools.islice(samples, self._batch_size)), [])
+        metrics = self._reset_metrics()
+
+        with self._process_pools() as pools:
+            if self._staged:
+                yield from self._stream_staged(batches, allowed_keys, tracker, total, pools, metrics)
+            else:
+                yield from self._stream_pooled(batches, allowed_keys, tracker, total, pools, metrics)
+
+    def _stream_pooled(
+            self,
+            batches: Iterator[List[Dict[str, Any]]],
+            allowed_keys: Set[str],
+            tracker: StrictTracker,
+            total: Optional[int],
+            pools: List[Optional[ProcessPoolExecutor]],
+            metrics: List[StepMetrics],
+    ) -> Iterator[Tuple[Dict[str, Any], Dict[str, int]]]:
+        # Only a few batches per worker are read ahead, so memory does not grow with the size of the input
+        window: collections.deque[Future] = collections.deque()
+        waves = self._schedule()
+        width = max(map(len, waves), default=1)
+        with tqdm(total=total, desc="Samples:", disable=not self._with_progress) as progress, \
+                ThreadPoolExecutor(max_workers=self._max_workers) as executor, \
+                ThreadPoolExecutor(max_workers=self._max_workers * width) as step_executor:
+            try:
+                for batch in batches:
+                    window.append(
+                        executor.submit(self._process, batch, allowed_keys, pools, metrics, waves, step_executor)
+                    )
+                    if len(window) >= 2 * self._max_workers:
+                        yield from self._collect(window.popleft(), tracker, progress)
+                while window:
+                    yield from self._collect(window.popleft(), tracker, progress)
+            except BaseException:
+                executor.shutdown(wait=True, cancel_futures=True)
+                raise
+
+    def _stream_staged(
+            self,
+            batches: Iterator[List[Dict[str, Any]]],
+            allowed_keys: Set[str],
+            tracker: StrictTracker,
+            total: Optional[int],
+            pools: List[Optional[ProcessPoolExecutor]],
+            metrics: List[StepMetrics],
+    ) -> Iterator[Tuple[Dict[str, Any], Dict[str, int]]]:
+        names = self.step_names()
+        stats = {name: StageStats() for name in names}
+        queues = [queue.Queue(maxsize=self._queue_size) for _ in range(len(self._steps) + 1)]
+        stop = threading.Event()
+
+        def put(q: queue.Queue, item: Any) -> None:
+            while not stop.is_set():
+                try:
+                    q.put(item, timeout=.1)
+                    return
+                except queue.Full:
+                    continue
+
+        def get(q: queue.Queue) -> Any:
+            while not stop.is_set():
+                try:
+                    return q.get(timeout=.1)
+                except queue.Empty:
+                    continue
+            return _DONE
+
+        def feed() -> None:
+            try:
+                for batch in batches:
+                    counters = StrictTracker(allowed_keys)
+                    counters["input_samples"] += len(batch)
+                    put(queues[0], (batch, counters))
+            except BaseException as e:
+                put(queues[0], _Failure(e))
+                return
+            put(queues[0], _DONE)
+
+        def work(i: int, stage: StageStats, inbox: queue.Queue, outbox: queue.Queue) -> None:
+            while True:
+                depth = inbox.qsize()
+                item = get(inbox)
+                if item is _DONE or isinstance(item, _Failure):
+                    put(outbox, item)
+                    return
+
+                batch, counters = item
+                start = time.perf_counter()
+                try:
+                    self._run_step(i, batch, counters, pools, metrics)
+                except BaseException as e:
+                    put(outbox, _Failure(e))
+                    return
+                stage.observe(depth, len(batch), time.perf_counter() - start)
+                put(outbox, item)
+
+        threads = [threading.Thread(target=feed, daemon=True)] + [
+            threading.Thread(target=work, args=(i, stats[name], queues[i], queues[i + 1]), daemon=True)
+            for i, name in enumerate(names)
+        ]
+
+        start = time.perf_counter()
+        with tqdm(total=total, desc="Samples:", disable=not self._with_progress) as progress:
+            for thread in threads:
+                thread.start()
+            try:
+                while True:
+                    item = get(queues[-1])
+                    if item is _DONE:
+                        break
+                    if isinstance(item, _Failure):
+                        raise item.error
+
+                    batch, counters = item
+                    tracker.merge(counters)
+                    progress.update(len(batch))
+                    for sample in batch:
+                        yield sample, tracker
+            finally:
+                stop.set()
+                for thread in threads:
+                    thread.join()
+                elapsed = time.perf_counter() - start
+                self._stage_stats = {name: stage.summary(elapsed) for name, stage in stats.items()}
+
+    @staticmethod
+    def _collect(
+            future: Future, tracker: StrictTracker, progress: tqdm
+    ) -> Iterator[Tuple[Dict[str, Any], Dict[str, int]]]:
+        batch, counters = future.result()
+        tracker.merge(counters)
+        progress.update(len(batch))
+        for sample in batch:
+            yield sample, tracker
+
+    def stream(
+            self, reader: Reader, skip: int = 0, tracker: Optional[Dict[str, int]] = None
+    ) -> Iterator[Tuple[Dict[str, Any], Dict[str, int]]]:
+        """
+        Execute all steps on each sample provided by the reader, yielding samples as soon as they are finished.
+
+        Samples are pulled lazily from `Reader.stream` and only a small window of them (proportional to
+        `max_workers` and `batch_size`) is kept in memory, so the memory usage stays flat regardless of the size of
+        the input. Samples are yielded in the same order as provided by the reader.
+
+        Since the order is preserved, an interrupted run can be resumed by skipping the samples it already
+        yielded and by starting from the last tracker it yielded (see `truthbench.journal.Journal`).
+
+        Args:
+            reader (Reader): Data reader yielding samples.
+            skip (int): Number of samples at the beginning of the reader to skip without processing them.
+            tracker (Optional[Dict[str, int]]): Counters to start from, e.g., those of an interrupted run.
+
+        Yields:
+            Tuple[Dict[str, Any], Dict[str, int]]:
+                - The processed sample.
+                - Tracker dictionary with counters collected so far. The same tracker instance is yielded
+                  every time and it keeps being updated until the stream is exhausted.
+        """
+        yield from self._stream(itertools.islice(reader.stream(), skip, None), tracker=tracker)
+
     def run(self, reader: Reader) -> Tuple[List[Dict[str, Any]], Dict[str, int]]:
         """
         Execute all steps in sequence on each sample provided by the reader.
 
+        Micro-batches of `batch_size` samples are processed by up to `max_workers` threads at once. Each
+        micro-batch keeps its own counters while being processed, which are merged into the returned tracker in
+        reader order, so the output is the same regardless of the number of workers.
+
         Args:
             reader (Reader): Data reader yielding samples.
 
         Returns:
             Tuple[List[Dict[str, Any]], Dict[str, int]]:
-                - List of processed samples.
+                - List of processed samples, in the same order as provided by the reader.
                 - Tracker dictionary with counters collected during processing.
         """
-        allowed_keys = {"input_samples"} | frozenset.union(*(step.counters for step in self._steps))
+        samples = reader.samples()
 
-        tracker = StrictTracker(allowed_keys)
+        collected = []
+        tracker = StrictTracker(self._allowed_keys())
+        for sample, tracker in self._stream(samples, total=len(samples)):
+            collected.append(sample)
+
+        return collected, tracker
+
+    async def run_async(
+            self, reader: Reader, max_in_flight: int = 64
+    ) -> Tuple[List[Dict[str, Any]], Dict[str, int]]:
+        """
+        Execute all steps on each sample provided by the reader from a single event loop.
+
+        Up to `max_in_flight` samples are processed at once. Since the steps of a sample run in sequence, this
+        is also the maximum number of concurrent LLM requests issued by the built-in steps. Steps are awaited
+        through `Step.step_async`, so steps backed by an `AsyncLLM` do not tie up a thread per request. Samples
+        are not grouped into micro-batches in this mode.
+
+        Args:
+            reader (Reader): Data reader yielding samples.
+            max_in_flight (int): Maximum number of samples being processed at the same time.
+
+        Returns:
+            Tuple[List[Dict[str, Any]], Dict[str, int]]:
+                - List of processed samples, in the same order as provided by the reader.
+                - Tracker dictionary with counters collected during processing.
+        """
+        if max_in_flight < 1:
+            raise ValueError(f"max_in_flight must be at least 1, but got {max_in_flight}")
+
+        allowed_keys = self._allowed_keys()
+        metrics = self._reset_metrics()
+        waves = self._schedule()
 
         samples = reader.samples()
 
+        results: List[Tuple[Dict[str, Any], StrictTracker]] = [None] * len(samples)
+        pending = iter(enumerate(samples))
+        progress = tqdm(total=len(samples), desc="Samples:", disable=not self._with_progress)
+
+        async def worker() -> None:
+            # All workers share the same iterator, which is safe since they run on the same event loop
+            for i, s in pending:
+                results[i] = await self._process_async(s, allowed_keys, pools, metrics, waves)
+                progress.update()
+
+        with self._process_pools() as pools:
+            workers = [asyncio.ensure_future(worker()) for _ in range(min(max_in_flight, len(samples)))]
+            try:
+                await asyncio.gather(*workers)
+            except BaseException:
+                for w in workers:
+                    w.cancel()
+                raise
+            finally:
+                progress.close()
+
+        tracker = StrictTracker(allowed_keys)
         collected = []
-        for sample in tqdm(samples, desc="Samples:", disable=not self._with_progress):
-            tracker["input_samples"] += 1
-            for step in self._steps:
-                step.validate(sample)
-                step.step(sample, tracker)
+        for sample, counters in results:
+            tracker.merge(counters)
             collected.append(sample)
 
         return collected, tracker
+
+
+class _SamplesReader(Reader):
+
+    def __init__(self, samples: List[Dict[str, Any]]):
+        self._samples = samples
+
+    def samples(self) -> List[Dict[str, Any]]:
+        return self._samples
+
+
+class Sweep:
+    """
+    Runs several configurations of a pipeline that only differ in their last steps (e.g., the fraction of factual
+    data kept, or the number of noise levels), sharing the work of their common steps.
+
+    Every sample goes through the `prefix` once, then a copy of it goes through each of the `branches`, so the
+    expensive common steps (e.g., paraphrasing, parsing and ranking) run once instead of once per configuration.
+    Each branch gets its own processed samples and tracker, as if it had run the whole pipeline on its own.
+
+    Args:
+        prefix (Pipeline): Steps shared by all configurations.
+        branches (Dict[str, Pipeline]): Remaining steps of each configuration, keyed by configuration name. Their
+            `input_fields` should be the `output_fields` of the prefix.
+    """
+
+    def __init__(self, prefix: Pipeline, branches: Dict[str, Pipeline]):
+        if not branches:
+            raise ValueError("A sweep needs at least one branch")
+
+        self.prefix = prefix
+        self.branches = branches
+
+    def run(self, reader: Reader) -> Dict[str, Tuple[List[Dict[str, Any]], Dict[str, int]]]:
+        """
+        Run the prefix over all samples of the reader, then each branch over a copy of its output.
+
+        Returns:
+            Dict[str, Tuple[List[Dict[str, Any]], Dict[str, int]]]: Processed samples and tracker of each branch,
+            keyed by configuration name. Trackers include the counters of the prefix.
+        """
+        samples, tracker = self.prefix.run(reader)
+        return {
+            name: self._merge(tracker, *branch.run(_SamplesReader(copy.deepcopy(samples))))
+            for name, branch in self.branches.items()
+        }
+
+    async def run_async(
+            self, reader: Reader, max_in_flight: int = 64
+    ) -> Dict[str, Tuple[List[Dict[str, Any]], Dict[str, int]]]:
+        """
+        Asynchronous variant of `run`, running the prefix and the branches with `Pipeline.run_async`. The branches
+        run concurrently, each with up to `max_in_flight` samples in flight.
+        """
+        samples, tracker = await self.prefix.run_async(reader, max_in_flight)
+        results = await asyncio.gather(*(
+            branch.run_async(_SamplesReader(copy.deepcopy(samples)), max_in_flight)
+            for branch in self.branches.values()
+        ))
+        return {name: self._merge(tracker, *result) for name, result in zip(self.branches, results)}
+
+    @staticmethod
+    def _merge(
+            prefix_tracker: Dict[str, int], samples: List[Dict[str, Any]], tracker: Dict[str, int]
+    ) -> Tuple[List[Dict[str, Any]], Dict[str, int]]:
+        # Samples were counted as they entered the prefix, not again as they entered the branch
+        merged = dict(prefix_tracker)
+        for key, value in tracker.items():
+            if key != "input_samples":
+                merged[key] = merged.get(key, 0) + value
+        return samples, merged
+
+    def step_metrics(self, name: str) -> Dict[str, Dict[str, float]]:
+        """
+        Per-step metrics of the last run of the prefix followed by the branch `name` (see `Pipeline.step_metrics`).
+        """
+        return {**self.prefix.step_metrics, **self.branches[name].step_metrics}
@@ -0,0 +1,53 @@
+import json
+import pathlib
+from typing import List, Dict, Any, Iterator
+
+from truthbench.pipeline import Reader
+
+
+class JsonLinesReader(Reader):
+    """
+    A reader that lazily loads question-answer samples from a JSON Lines file.
+
+    Each non-empty line of the file must be a JSON object including the following keys:
+        - "question" (str)
+        - "ground_truth" (str)
+
+    Unlike `JsonReader`, the file is read one line at a time, so it suits inputs too large to be held in memory
+    when used with `Pipeline.stream`.
+
+    Example input file:
+        {"question": "What is Python?", "ground_truth": "A programming language."}
+        {"question": "What is 2+2?", "ground_truth": "4"}
+
+    Parameters:
+        input_file (pathlib.Path): Path to the input JSON Lines file.
+
+    Raises:
+        ValueError: If a line is not valid JSON, not an object, or missing required keys.
+    """
+
+    def __init__(self, input_file: pathlib.Path):
+        self._input_file = input_file
+
+    def stream(self) -> Iterator[Dict[str, Any]]:
+        with open(self._input_file, "r") as f:
+            for line_number, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+
+                try:
+                    d = json.loads(line)
+                except json.JSONDecodeError as e:
+                    raise ValueError(f"Invalid JSON at line {line_number}: {e}") from e
+
+                if not isinstance(d, dict):
+                    raise ValueError(f"Samples must be JSON objects (line {line_number})")
+                if "question" not in d or "ground_truth" not in d:
+                    raise ValueError(
+                        f"Missing required keys: 'question' and 'ground_truth' (line {line_number})"
+                    )
+                yield {"question": d["question"], "ground_truth": d["ground_truth"]}
+
+    def samples(self) -> List[Dict[str, Any]]:
+        return list(self.stream())
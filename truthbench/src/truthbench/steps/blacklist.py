@@ -42,7 +42,8 @@ class BlacklistItemsFromQuestionStep(Step):
     def __init__(self, stop_words: Set[str]):
         self._stop_words = stop_words
         super().__init__(
-            required_fields=frozenset({"question", "raw_factual_data"})
+            required_fields=frozenset({"question", "raw_factual_data"}),
+            produced_fields=frozenset({"blacklisted"}),
         )
 
     def step(self, sample: Dict[str, Any], tracker: Dict[str, int]) -> None:
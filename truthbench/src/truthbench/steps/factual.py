@@ -1,7 +1,8 @@
 import abc
 import re
-from typing import Union, Iterator, List, Tuple, Dict, Any
+from typing import Union, Iterator, List, Tuple, Dict, Any, Optional
 
+import spacy
 from spacy import Language, Errors
 from spacy.symbols import NOUN, PROPN, ADV, ADJ, amod, NUM
 from spacy.tokens import Doc, Span
@@ -18,6 +19,17 @@ class FactualChunker(abc.ABC):
     def tag(self, sentence: str) -> str:
         ...
 
+    def tag_batch(self, sentences: List[str]) -> List[str]:
+        """
+        Tag several sentences at once. Chunkers able to amortize work across sentences should override it.
+        """
+        return [self.tag(sentence) for sentence in sentences]
+
+    def setup(self) -> None:
+        """
+        Load expensive resources ahead of tagging (see `Step.setup`). By default, it does nothing.
+        """
+
 
 class NounAdverbFactualChunker(FactualChunker):
     """
@@ -48,15 +60,45 @@ class NounAdverbFactualChunker(FactualChunker):
      Methods:
          - tag(sentence: str) -> str:
              Returns the input sentence with factual spans bracketed.
+         - tag_batch(sentences: List[str]) -> List[str]:
+             Same as `tag`, but parses all sentences in a single `nlp.pipe` call.
 
      Notes:
          - Requires a syntactic dependency parse (e.g., from spaCy).
          - Focuses on spans relevant for factual content modification.
          - Does not modify spans related to sentence subjects to prevent meaning distortion.
+         - When given the name of a spaCy model instead of a `Language`, the model is only loaded on first use
+           (or by `setup`) and it is not pickled with the chunker. This is how it should be configured to run in
+           worker processes, so that each worker loads the model once.
      """
 
-    def __init__(self, nlp: Language):
-        self._nlp = nlp
+    def __init__(self, nlp: Union[Language, str]):
+        self._model_name: Optional[str] = nlp if isinstance(nlp, str) else None
+        self._loaded: Optional[Language] = None if isinstance(nlp, str) else nlp
+
+    @property
+    def _nlp(self) -> Language:
+        if self._loaded is None:
+            self._loaded = spacy.load(self._model_name)
+        return self._loaded
+
+    @property
+    def model(self) -> str:
+        """
+        Name of the spaCy model (e.g., "en_core_web_sm"), which identifies the chunker in step fingerprints.
+        """
+        if self._model_name is not None:
+            return self._model_name
+        return f"{self._loaded.meta['lang']}_{self._loaded.meta['name']}"
+
+    def setup(self) -> None:
+        _ = self._nlp
+
+    def __getstate__(self) -> Dict[str, Any]:
+        state = self.__dict__.copy()
+        if self._model_name is not None:
+            state["_loaded"] = None
+        return state
 
     def span_boxes(self, doclike: Union[Doc, Span]) -> Iterator[Span]:
         """
@@ -138,8 +180,12 @@ class NounAdverbFactualChunker(FactualChunker):
         )
 
     def tag(self, sentence: str) -> str:
-        doc = self._nlp(sentence)
+        return self.tag_doc(sentence, self._nlp(sentence))
+
+    def tag_batch(self, sentences: List[str]) -> List[str]:
+        return [self.tag_doc(sentence, doc) for sentence, doc in zip(sentences, self._nlp.pipe(sentences))]
 
+    def tag_doc(self, sentence: str, doc: Doc) -> str:
         idx = []
         for box in self.span_boxes(doc):
             idx.append((min(b.idx for b in box), max(b.idx + len(b) for b in box)))
@@ -200,29 +246,46 @@ class FactualDataStep(Step):
         # sample["raw_factual_data"] will be:
         # ["the new policy", "2021", "confidence"]
         # tracker["find_factual_data_error"] remains 0 because factual spans were found.
+
+    When run in micro-batches (see `Pipeline`'s `batch_size`), all answers of the batch are tagged with a single
+    `FactualChunker.tag_batch` call.
     """
 
     def __init__(self, chunker: FactualChunker):
         self._chunker = chunker
         super().__init__(
             required_fields=frozenset({"answers"}),
-            counters=frozenset({"find_factual_data_error"})
+            counters=frozenset({"find_factual_data_error"}),
+            produced_fields=frozenset({"with_brackets", "raw_factual_data"}),
         )
 
+    def setup(self) -> None:
+        self._chunker.setup()
+
     def step(self, sample: Dict[str, Any], tracker: Dict[str, int]) -> None:
-        if not sample["answers"] or "A0" not in sample["answers"].keys():
-            sample["with_brackets"] = None
-            sample["raw_factual_data"] = None
+        self.step_batch([sample], tracker)
+
+    def step_batch(self, samples: List[Dict[str, Any]], tracker: Dict[str, int]) -> None:
+        taggable = []
+        for sample in samples:
+            if not sample["answers"] or "A0" not in sample["answers"].keys():
+                sample["with_brackets"] = None
+                sample["raw_factual_data"] = None
+            else:
+                taggable.append(sample)
+
+        if not taggable:
             return
 
-        sample["with_brackets"] = {}
-        response_text = self._chunker.tag(sample["answers"]["A0"])
-        sample["with_brackets"]["A0"] = response_text
+        tagged = self._chunker.tag_batch([sample["answers"]["A0"] for sample in taggable])
+        for sample, response_text in zip(taggable, tagged):
+            sample["with_brackets"] = {}
+            sample["with_brackets"]["A0"] = response_text
 
-        matches = re.findall(r"\[(.*?)]", response_text)
-        if not matches:
-            tracker["find_factual_data_error"] += 1
-            sample["raw_factual_data"] = None
-            return
+            matches = re.findall(r"\[(.*?)]", response_text)
+            if not matches:
+                tracker["find_factual_data_error"] += 1
+                sample["raw_factual_data"] = None
+                continue
 
-        sample["raw_factual_data"] = matches
+            sample["raw_factual_data"] = matches
@@ -49,7 +49,8 @@ class FilterFactualDataStep(Step):
         self._keep = keep
 
         super().__init__(
-            required_fields=frozenset({"ranked_factual_data", "blacklisted"})
+            required_fields=frozenset({"ranked_factual_data", "blacklisted"}),
+            produced_fields=frozenset({"factual_data"}),
         )
 
     def step(self, sample: Dict[str, Any], tracker: Dict[str, int]) -> None:
@@ -1,8 +1,11 @@
+import asyncio
+import contextvars
 import random
 import re
-from typing import List, Tuple, Dict, Any, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple, Dict, Any, Optional, Union
 
-from truthbench.pipeline import Step, LLM
+from truthbench.pipeline import Step, LLM, AsyncLLM, query, aquery, query_stream, aquery_stream
 
 
 def batch(iterable, n=1):
@@ -27,8 +30,17 @@ class CreateNoiseExamplesStep(Step):
     Attributes:
         - prompt (str): Full prompt template used to instruct the LLM for perturbation. Uses
                         CreateNoiseExamplesStep.PROMPT if none is provided.
-        - llm (LLM): An LLM interface capable of structured prompting and response parsing.
+        - llm (LLM or AsyncLLM): An LLM interface capable of structured prompting and response parsing. An
+          `AsyncLLM` can only be used through `Pipeline.run_async`.
         - levels (int): Number of perturbation rounds to perform (A_1, A_2, ..., A_{N-1}).
+        - early_stop (bool): Stream the LLM responses and stop them at `</output>`, instead of waiting for the
+          whole generation (and any trailing chatter).
+        - mode (str): How levels are generated. "chained" (default) perturbs the output of the previous level, one
+          request after another. "independent" perturbs A0 directly for every level, with the spans of all groups
+          up to that level marked for change, so that all levels are requested concurrently. "single_call" asks
+          for all levels in a single request, sharing the instructions and the planning: each level is validated
+          separately (see `is_valid_level`), and only the invalid ones are requested again, as in "independent"
+          mode.
 
     Expected Sample Fields:
         - "factual_data" (List[str]): List of factual spans to selectively perturb.
@@ -41,7 +53,8 @@ class CreateNoiseExamplesStep(Step):
         - "thinking" (Dict[str, str]): Stores LLM’s planning output for each perturbation level.
 
     Counter:
-        - None
+        - regenerated_noise_level: Incremented for each level of a "single_call" response that is invalid and
+          requested again on its own.
 
     Notes:
         - Perturbations are groupwise: each level changes a unique subset of factual spans.
@@ -107,16 +120,33 @@ The ozone layer protects [the Earth] by absorbing [harmful ultraviolet radiation
 <output>The ozone layer protects the biosphere by absorbing harmful infrared radiation from deep space. It is {{primarily}} found in the troposphere, a layer of the atmosphere. Concerns about ozone depletion rose in the late 1990s after a theory of an irregularity over {{Antarctica}}.</output>
 """
 
-    def __init__(self, llm: LLM, levels: int = 5, prompt: Optional[str] = None):
+    STOP = "</output>"
+    MODES = ("chained", "independent", "single_call")
+    LEVEL_OUTPUT = re.compile(r'<output level="(\d+)">(.*?)</output>', re.DOTALL)
+
+    def __init__(
+            self,
+            llm: Union[LLM, AsyncLLM],
+            levels: int = 5,
+            prompt: Optional[str] = None,
+            early_stop: bool = False,
+            mode: str = "chained",
+    ):
         if levels < 2:
             raise ValueError("Number of noisy levels must be larger than 2.")
+        if mode not in self.MODES:
+            raise ValueError(f"mode must be one of {self.MODES}, but got {mode!r}")
 
         self._llm = llm
+        self._early_stop = early_stop
+        self._mode = mode
         self._prompt = prompt or CreateNoiseExamplesStep.PROMPT
         self._noise_levels = levels - 1
 
         super().__init__(
             required_fields=frozenset({"factual_data", "with_brackets", "answers"}),
+            counters=frozenset({"regenerated_noise_level"}),
+            produced_fields=frozenset({"thinking", "answers", "with_brackets"}),
         )
 
     def process_terms(self, text: str, allowed_terms: List[str]) -> str:
@@ -160,39 +190,204 @@ The ozone layer protects [the Earth] by absorbing [harmful ultraviolet radiation
             output_match.group(1).strip() if output_match else None
         )
 
+    def is_noisable(self, sample: Dict[str, Any]) -> bool:
+        return bool(
+            sample["with_brackets"] and
+            "A0" in sample["with_brackets"] and
+            sample["factual_data"] and
+            sample["answers"] and
+            "A0" in sample["answers"]
+        )
+
+    def level_messages(self, text: str, selected: List[str]) -> List[Dict[str, str]]:
+        input_sample = self.process_terms(text, selected)
+        prompt = f"```\n{input_sample}\n```"
+        return [
+            {"role": "system", "content": self._prompt},
+            {"role": "user", "content": prompt},
+        ]
+
+    def ask(self, messages: List[Dict[str, str]]) -> str:
+        if self._early_stop:
+            return self.close_output(query_stream(self._llm, messages, stop=[self.STOP]))
+        return query(self._llm, messages)
+
+    async def ask_async(self, messages: List[Dict[str, str]]) -> str:
+        if self._early_stop:
+            return self.close_output(await aquery_stream(self._llm, messages, stop=[self.STOP]))
+        return await aquery(self._llm, messages)
+
+    def close_output(self, response: str) -> str:
+        """
+        Restore the closing tag of the output, which a response stopped at it does not include.
+        """
+        if "<output>" in response and self.STOP not in response:
+            return response + self.STOP
+        return response
+
+    def apply_response(self, sample: Dict[str, Any], level: int, response: str) -> Optional[str]:
+        """
+        Store the LLM response for a perturbation level into the sample.
+
+        Returns:
+            Optional[str]: The perturbed text with all factual spans in square brackets, ready to be used as
+            input for the next level, or None if the response has no output.
+        """
+        thinking, output = self.parse_response(response)
+
+        if thinking:
+            sample["thinking"][f"A{level}"] = thinking
+
+        if not output:
+            return None
+
+        noised_sample = re.sub(r'\{\{(.*?)}}', r'[\1]', output)
+        sample["with_brackets"][f"A{level}"] = noised_sample
+        cleaned = re.sub(r'\{\{(.*?)}}', r'\1', output)
+        sample["answers"][f"A{level}"] = cleaned
+        return noised_sample
+
+    def independent_messages(self, sample: Dict[str, Any], groups: List[List[int]]) -> List[List[Dict[str, str]]]:
+        """
+        Messages of every level in "independent" mode: A0 with the spans of all groups up to the level marked.
+        """
+        messages, selected = [], []
+        for group in groups:
+            selected = selected + [sample["factual_data"][j] for j in group]
+            messages.append(self.level_messages(sample["with_brackets"]["A0"], selected))
+        return messages
+
+    def single_call_messages(self, sample: Dict[str, Any], groups: List[List[int]]) -> List[Dict[str, str]]:
+        """
+        Messages asking for all levels at once: A0 with the spans of all groups marked, and the spans to change at
+        each level.
+        """
+        text = self.process_terms(sample["with_brackets"]["A0"], list(sample["factual_data"]))
+        levels = "\n".join(
+            f"Level {i}: " + ", ".join(f"[{sample['factual_data'][j]}]" for j in group)
+            for i, group in enumerate(groups, start=1)
+        )
+        prompt = (
+            f"```\n{text}\n```\n"
+            f"Produce {len(groups)} outputs, one per level. At each level, change the following terms in addition "
+            f"to those of the previous levels, keeping their previous replacements:\n{levels}\n"
+            f"In the output of a level, terms in square brackets [ ] that are not changed yet must be written "
+            f"between double curly braces {{{{ }}}}. Plan all levels between the marks <thinking></thinking>, then "
+            f'produce the output of each level i between the marks <output level="i"></output>.'
+        )
+        return [
+            {"role": "system", "content": self._prompt},
+            {"role": "user", "content": prompt},
+        ]
+
+    def is_valid_level(self, sample: Dict[str, Any], groups: List[List[int]], level: int, output: str) -> bool:
+        """
+        Whether the output of a level in a "single_call" response keeps every term that must stay unchanged at
+        that level (i.e., the protected terms and those of later levels) between double curly braces.
+        """
+        selected = [sample["factual_data"][j] for group in groups[:level] for j in group]
+        expected = self.process_terms(sample["with_brackets"]["A0"], selected)
+        return all(f"{{{{{term}}}}}" in output for term in re.findall(r'\{\{(.*?)}}', expected))
+
+    def apply_single_call(self, sample: Dict[str, Any], groups: List[List[int]], response: str) -> List[int]:
+        """
+        Store the valid levels of a "single_call" response into the sample.
+
+        Returns:
+            List[int]: The levels that are missing or invalid.
+        """
+        thinking, _ = self.parse_response(response)
+        outputs = {int(level): output for level, output in self.LEVEL_OUTPUT.findall(response)}
+
+        invalid = []
+        for level in range(1, len(groups) + 1):
+            output = outputs.get(level)
+            if output is None or not self.is_valid_level(sample, groups, level, output):
+                invalid.append(level)
+                continue
+            self.apply_response(sample, level, f"<thinking>{thinking or ''}</thinking><output>{output}</output>")
+        return invalid
+
+    def has_all_levels(self, num_levels: int, text: str) -> bool:
+        """
+        Incremental parser of a streamed "single_call" response: whether the output of the last level is complete.
+        """
+        return any(int(level) == num_levels for level, _ in self.LEVEL_OUTPUT.findall(text))
+
+    def generate_independently(self, sample: Dict[str, Any], groups: List[List[int]], levels: List[int]) -> None:
+        messages = self.independent_messages(sample, groups)
+        with ThreadPoolExecutor(max_workers=max(1, len(levels))) as executor:
+            # Each thread runs in a copy of the context, so requests are accounted to the step and sample
+            futures = {i: executor.submit(contextvars.copy_context().run, self.ask, messages[i - 1]) for i in levels}
+            for i, future in futures.items():
+                self.apply_response(sample, i, future.result())
+
+    async def generate_independently_async(
+            self, sample: Dict[str, Any], groups: List[List[int]], levels: List[int]
+    ) -> None:
+        messages = self.independent_messages(sample, groups)
+        responses = await asyncio.gather(*(self.ask_async(messages[i - 1]) for i in levels))
+        for i, response in zip(levels, responses):
+            self.apply_response(sample, i, response)
+
     def step(self, sample: Dict[str, Any], tracker: Dict[str, int]) -> None:
-        if (not sample["with_brackets"] or
-                "A0" not in sample["with_brackets"] or
-                not sample["factual_data"] or
-                not sample["answers"] or
-                "A0" not in sample["answers"]):
+        if not self.is_noisable(sample):
             sample["thinking"] = None
             return
 
         sample["thinking"] = {}
         groups = self.split_groups(len(sample["factual_data"]), self._noise_levels)
         random.shuffle(groups)
-        a0 = sample["with_brackets"]["A0"]
-        noised_sample = a0
+
+        if self._mode == "independent":
+            self.generate_independently(sample, groups, list(range(1, len(groups) + 1)))
+            return
+
+        if self._mode == "single_call":
+            messages = self.single_call_messages(sample, groups)
+            if self._early_stop:
+                response = query_stream(self._llm, messages, until=lambda t: self.has_all_levels(len(groups), t))
+            else:
+                response = query(self._llm, messages)
+            invalid = self.apply_single_call(sample, groups, response)
+            tracker["regenerated_noise_level"] += len(invalid)
+            self.generate_independently(sample, groups, invalid)
+            return
+
+        noised_sample = sample["with_brackets"]["A0"]
+        for i, group in enumerate(groups, start=1):
+            selected = [sample["factual_data"][j] for j in group]
+            output_sample = self.ask(self.level_messages(noised_sample, selected))
+            noised_sample = self.apply_response(sample, i, output_sample) or noised_sample
+
+    async def step_async(self, sample: Dict[str, Any], tracker: Dict[str, int]) -> None:
+        if not self.is_noisable(sample):
+            sample["thinking"] = None
+            return
+
+        sample["thinking"] = {}
+        groups = self.split_groups(len(sample["factual_data"]), self._noise_levels)
+        random.shuffle(groups)
+
+        if self._mode == "independent":
+            await self.generate_independently_async(sample, groups, list(range(1, len(groups) + 1)))
+            return
+
+        if self._mode == "single_call":
+            messages = self.single_call_messages(sample, groups)
+            if self._early_stop:
+                response = await aquery_stream(
+                    self._llm, messages, until=lambda t: self.has_all_levels(len(groups), t)
+                )
+            else:
+                response = await aquery(self._llm, messages)
+            invalid = self.apply_single_call(sample, groups, response)
+            tracker["regenerated_noise_level"] += len(invalid)
+            await self.generate_independently_async(sample, groups, invalid)
+            return
+
+        noised_sample = sample["with_brackets"]["A0"]
         for i, group in enumerate(groups, start=1):
             selected = [sample["factual_data"][j] for j in group]
-            input_sample = self.process_terms(noised_sample, selected)
-            prompt = f"```\n{input_sample}\n```"
-
-            output_sample = self._llm.query(
-                [
-                    {"role": "system", "content": self._prompt},
-                    {"role": "user", "content": prompt},
-                ]
-            )
-
-            thinking, output = self.parse_response(output_sample)
-
-            if thinking:
-                sample["thinking"][f"A{i}"] = thinking
-
-            if output:
-                noised_sample = re.sub(r'\{\{(.*?)}}', r'[\1]', output)
-                sample["with_brackets"][f"A{i}"] = noised_sample
-                cleaned = re.sub(r'\{\{(.*?)}}', r'\1', output)
-                sample["answers"][f"A{i}"] = cleaned
+            output_sample = await self.ask_async(self.level_messages(noised_sample, selected))
+            noised_sample = self.apply_response(sample, i, output_sample) or noised_sample
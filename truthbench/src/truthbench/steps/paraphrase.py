@@ -1,6 +1,6 @@
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, Union, List
 
-from truthbench.pipeline import Step, LLM
+from truthbench.pipeline import Step, LLM, AsyncLLM, query, aquery
 
 
 class ParaphraseStep(Step):
@@ -15,7 +15,8 @@ class ParaphraseStep(Step):
     equivalent and includes all important content without elaboration or omission.
 
     Attributes:
-        - llm (LLM): A language model interface capable of responding to structured prompts.
+        - llm (LLM or AsyncLLM): A language model interface capable of responding to structured prompts. An
+          `AsyncLLM` can only be used through `Pipeline.run_async`.
         - prompt (str): The prompt to use for paraphrasing (it must contain a ground_truth placement).
 
     Expected Sample Fields:
@@ -56,17 +57,29 @@ class ParaphraseStep(Step):
         "Paraphrased version:"
     )
 
-    def __init__(self, llm: LLM, prompt: Optional[str] = None):
+    def __init__(self, llm: Union[LLM, AsyncLLM], prompt: Optional[str] = None):
         self._prompt = prompt if prompt else ParaphraseStep.PROMPT
         self._llm = llm
-        super().__init__(required_fields=frozenset({"ground_truth"}))
+        super().__init__(required_fields=frozenset({"ground_truth"}), produced_fields=frozenset({"answers"}))
+
+    def messages(self, sample: Dict[str, Any]) -> List[Dict[str, str]]:
+        prompt = self._prompt.format(ground_truth=sample["ground_truth"])
+        return [{"role": "user", "content": prompt}]
 
     def step(self, sample: Dict[str, Any], tracker: Dict[str, int]) -> None:
         if not sample["ground_truth"]:
             sample["answers"] = None
             return
 
-        prompt = self._prompt.format(ground_truth=sample["ground_truth"])
-        paraphrased = self._llm.query([{"role": "user", "content": prompt}])
+        paraphrased = query(self._llm, self.messages(sample))
+        sample["answers"] = {}
+        sample["answers"]["A0"] = paraphrased
+
+    async def step_async(self, sample: Dict[str, Any], tracker: Dict[str, int]) -> None:
+        if not sample["ground_truth"]:
+            sample["answers"] = None
+            return
+
+        paraphrased = await aquery(self._llm, self.messages(sample))
         sample["answers"] = {}
         sample["answers"]["A0"] = paraphrased
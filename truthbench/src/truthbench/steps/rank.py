@@ -1,9 +1,11 @@
 import json
 import re
 from json import JSONDecodeError
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, Union, List
 
-from truthbench.pipeline import Step, LLM
+from truthbench.pipeline import (
+    Step, LLM, AsyncLLM, query, aquery, query_stream, aquery_stream, query_n, aquery_n, share_usage
+)
 
 
 class RankFactualDataStep(Step):
@@ -21,8 +23,22 @@ class RankFactualDataStep(Step):
     retries are attempted if the output is invalid or incomplete.
 
     Attributes:
-        - llm (LLM): The language model interface used to rank the factual spans.
+        - llm (LLM or AsyncLLM): The language model interface used to rank the factual spans. An `AsyncLLM` can
+          only be used through `Pipeline.run_async`.
         - max_retries (int): Maximum number of retry attempts in case of malformed or incomplete LLM output.
+        - early_stop (bool): Stream the LLM response and stop it right after the ranking following `OUTPUT:`,
+          instead of waiting for the whole generation (and any trailing chatter).
+        - candidates (int): Number of alternative rankings requested at each attempt (see `LLM.query_n`), in a
+          single request or as concurrent ones. The first valid one is kept, so a sample only needs another
+          round-trip when all of them are invalid. It cannot be combined with `early_stop`.
+        - repair (bool): Repair near-miss rankings instead of querying the LLM again (see `repair_ranking`).
+        - max_missing (float): Fraction of the indices a repaired ranking may miss. Missing indices are appended
+          last, i.e., ranked as the least important, so a small fraction barely changes what is kept downstream.
+        - samples_per_request (int): Number of samples of a micro-batch (see `Pipeline`'s `batch_size`) ranked
+          in a single request, so that the long instructions and example are sent once for all of them. Each
+          ranking is validated separately, and only the samples whose ranking is invalid are queried again on
+          their own. The usage of the shared request is split evenly among its samples. It does not apply to
+          `step_async`, which ranks a single sample.
 
     Expected Sample Fields:
         - with_brackets (Dict[str, str]): A dictionary containing the paraphrased sentence with factual spans in brackets.
@@ -36,6 +52,8 @@ class RankFactualDataStep(Step):
         - json_parse_ranking_error: Incremented when the LLM's ranking output fails JSON decoding.
         - index_ranking_error: Incremented when the output list is not a complete permutation of indices.
         - ranking_factual_data_error: Incremented when all retries fail to produce a valid output.
+        - repaired_ranking: Incremented when an invalid output is repaired into a valid ranking. Repaired outputs
+          do not count as JSON or index errors.
 
     Notes:
         - Uses a structured prompt with in-context example and <thinking> tags to improve LLM reliability.
@@ -86,23 +104,56 @@ class RankFactualDataStep(Step):
         "OUTPUT: [1, 3, 9, 2, 8, 6, 7, 4, 10, 0, 11, 5]"
     )
 
-    def __init__(self, llm: LLM, max_retries: int = 8, prompt: Optional[str] = None):
+    RANKING = re.compile(r"OUTPUT:\s*\[[^\[\]]*]")
+
+    def __init__(
+            self,
+            llm: Union[LLM, AsyncLLM],
+            max_retries: int = 8,
+            prompt: Optional[str] = None,
+            early_stop: bool = False,
+            candidates: int = 1,
+            repair: bool = False,
+            max_missing: float = .25,
+            samples_per_request: int = 1,
+    ):
+        if samples_per_request < 1:
+            raise ValueError(f"samples_per_request must be at least 1, but got {samples_per_request}")
+        if not 0 <= max_missing <= 1:
+            raise ValueError(f"max_missing must be in [0, 1], but got {max_missing}")
+        if candidates < 1:
+            raise ValueError(f"candidates must be at least 1, but got {candidates}")
+        if early_stop and candidates > 1:
+            raise ValueError("early_stop cannot be combined with several candidates")
+
         self._llm = llm
         self._max_retries = max_retries
+        self._early_stop = early_stop
+        self._candidates = candidates
+        self._repair = repair
+        self._max_missing = max_missing
+        self._samples_per_request = samples_per_request
         self._prompt = prompt if prompt else RankFactualDataStep.PROMPT
         super().__init__(
             required_fields=frozenset({"question", "with_brackets", "raw_factual_data"}),
-            counters=frozenset({"json_parse_ranking_error", "index_ranking_error", "ranking_factual_data_error"})
+            counters=frozenset({
+                "json_parse_ranking_error", "index_ranking_error", "ranking_factual_data_error", "repaired_ranking"
+            }),
+            produced_fields=frozenset({"ranked_factual_data"}),
         )
 
-    def step(self, sample: Dict[str, Any], tracker: Dict[str, int]) -> None:
-        if (not sample["question"] or
-                not sample["with_brackets"] or
-                not sample["raw_factual_data"] or
-                len(sample["raw_factual_data"]) <= 0):
-            sample["ranked_factual_data"] = None
-            return
+    def is_rankable(self, sample: Dict[str, Any]) -> bool:
+        return bool(
+            sample["question"] and
+            sample["with_brackets"] and
+            sample["raw_factual_data"] and
+            len(sample["raw_factual_data"]) > 0
+        )
 
+    def build_prompt(self, sample: Dict[str, Any]) -> str:
+        return f"{self._prompt}\n\nNow it's your turn.\n\n{self.build_task(sample)}"
+
+    def build_task(self, sample: Dict[str, Any]) -> str:
         question = sample["question"]
         text = sample["with_brackets"]["A0"]
 
@@ -110,32 +161,195 @@ class RankFactualDataStep(Step):
         for idx, term in enumerate(terms):
             text = text.replace(f'[{term}]', f'[{term}:{idx}]', 1)
 
-        prompt = f"{self._prompt}\n\nNow it's your turn.\n\nQuestion: {question}\n```\n{text}\n```\n"
+        return f"Question: {question}\n```\n{text}\n```\n"
 
-        for _ in range(self._max_retries):
-            llm_judgement = self._llm.query(messages=[{"role": "user", "content": prompt}])
+    def build_batch_prompt(self, samples: List[Dict[str, Any]]) -> str:
+        tasks = "\n".join(f"Text {i}:\n{self.build_task(sample)}" for i, sample in enumerate(samples, start=1))
+        return (
+            f"{self._prompt}\n\nNow it's your turn, with {len(samples)} texts. Rank the terms of each text "
+            f"independently, one text after another: give your thinking between the tags <thinking></thinking> "
+            f"followed by `OUTPUT <number of the text>: [...]`, e.g., `OUTPUT 1: [...]` for the first text.\n\n"
+            f"{tasks}"
+        )
 
-            if "OUTPUT:" not in llm_judgement:
-                continue
+    @staticmethod
+    def split_batch_response(llm_judgement: str) -> Dict[int, str]:
+        """
+        Split the response to a batch prompt into the ranking of each text, as the response to a single sample
+        prompt would give it (i.e., `OUTPUT: [...]`), keyed by the position of the text in the batch.
+        """
+        return {
+            int(number) - 1: f"OUTPUT: {ranks}"
+            for number, ranks in re.findall(r"OUTPUT\s*(\d+)\s*:\s*(\[[^\[\]]*])", llm_judgement)
+        }
 
-            value = llm_judgement.split("OUTPUT:")
+    def has_ranking(self, text: str) -> bool:
+        """
+        Incremental parser of a streamed response: whether the ranking is complete.
+        """
+        return self.RANKING.search(text) is not None
 
-            if len(value) != 2:
-                continue
+    def cut_ranking(self, text: str) -> str:
+        """
+        Drop whatever follows the ranking in a response stopped early, i.e., the rest of its last chunk.
+        """
+        match = self.RANKING.search(text)
+        return text[:match.end()] if match else text
 
-            _, ranks_str = value
+    def ask(self, prompt: str, attempt: int) -> List[str]:
+        """
+        Query the LLM for the candidate rankings of an attempt.
+        """
+        messages = [{"role": "user", "content": prompt}]
+        if self._early_stop:
+            return [self.cut_ranking(query_stream(self._llm, messages, until=self.has_ranking, retry=attempt > 0))]
+        if self._candidates > 1:
+            return query_n(self._llm, messages, self._candidates, retry=attempt > 0)
+        return [query(self._llm, messages=messages, retry=attempt > 0)]
 
+    async def ask_async(self, prompt: str, attempt: int) -> List[str]:
+        messages = [{"role": "user", "content": prompt}]
+        if self._early_stop:
+            response = await aquery_stream(self._llm, messages, until=self.has_ranking, retry=attempt > 0)
+            return [self.cut_ranking(response)]
+        if self._candidates > 1:
+            return await aquery_n(self._llm, messages, self._candidates, retry=attempt > 0)
+        return [await aquery(self._llm, messages=messages, retry=attempt > 0)]
+
+    def parse_ranking(
+            self, llm_judgement: str, sample: Dict[str, Any], tracker: Dict[str, int]
+    ) -> Optional[List[str]]:
+        """
+        Parse an LLM response into the ranked factual spans of the sample.
+
+        Returns:
+            Optional[List[str]]: The ranked spans, or None if the response is not a valid ranking.
+        """
+        num_terms = len(sample["raw_factual_data"])
+        error = None
+        value = llm_judgement.split("OUTPUT:")
+
+        if len(value) == 2:
+            _, ranks_str = value
             try:
                 ranks = json.loads(ranks_str.strip())
             except JSONDecodeError:
-                tracker["json_parse_ranking_error"] += 1
+                error = "json_parse_ranking_error"
+            else:
+                if self.is_permutation(ranks, num_terms):
+                    return [sample["raw_factual_data"][i] for i in ranks]
+                error = "index_ranking_error"
+
+        if self._repair:
+            ranks = self.repair_ranking(llm_judgement, num_terms)
+            if ranks is not None:
+                tracker["repaired_ranking"] += 1
+                return [sample["raw_factual_data"][i] for i in ranks]
+
+        if error is not None:
+            tracker[error] += 1
+        return None
+
+    @staticmethod
+    def is_permutation(ranks: Any, num_terms: int) -> bool:
+        return (
+            isinstance(ranks, list) and
+            all(type(r) is int for r in ranks) and
+            sorted(ranks) == list(range(num_terms))
+        )
+
+    def repair_ranking(self, llm_judgement: str, num_terms: int) -> Optional[List[int]]:
+        """
+        Repair a near-miss ranking: the list after the last `OUTPUT:` is read even if wrapped in a code fence or
+        followed by more text, invalid and duplicated indices are dropped, and missing indices are appended in their
+        original order, as long as they are at most `max_missing` of them.
+
+        Returns:
+            Optional[List[int]]: A permutation of the indices, or None if the response cannot be repaired.
+        """
+        if "OUTPUT:" not in llm_judgement:
+            return None
+
+        output = re.sub(r"```[a-z]*", "", llm_judgement.rsplit("OUTPUT:", 1)[1])
+        match = re.search(r"\[[^\[\]]*]", output)
+        if not match:
+            return None
+
+        try:
+            ranks = json.loads(match.group(0))
+        except JSONDecodeError:
+            return None
+
+        ranks = list(dict.fromkeys(r for r in ranks if type(r) is int and 0 <= r < num_terms))
+        missing = [i for i in range(num_terms) if i not in ranks]
+        if not ranks or len(missing) > self._max_missing * num_terms:
+            return None
+        return ranks + missing
+
+    def step(self, sample: Dict[str, Any], tracker: Dict[str, int]) -> None:
+        if not self.is_rankable(sample):
+            sample["ranked_factual_data"] = None
+            return
+
+        prompt = self.build_prompt(sample)
+
+        for attempt in range(self._max_retries):
+            for llm_judgement in self.ask(prompt, attempt):
+                ranked = self.parse_ranking(llm_judgement, sample, tracker)
+                if ranked is not None:
+                    sample["ranked_factual_data"] = ranked
+                    return
+
+        sample["ranked_factual_data"] = None
+        tracker["ranking_factual_data_error"] += 1
+
+    @property
+    def batched(self) -> bool:
+        return self._samples_per_request > 1
+
+    def step_batch(self, samples: List[Dict[str, Any]], tracker: Dict[str, int]) -> None:
+        if self._samples_per_request == 1:
+            super().step_batch(samples, tracker)
+            return
+
+        rankable = [sample for sample in samples if self.is_rankable(sample)]
+        for sample in samples:
+            if not self.is_rankable(sample):
+                sample["ranked_factual_data"] = None
+
+        failed = []
+        for start in range(0, len(rankable), self._samples_per_request):
+            group = rankable[start:start + self._samples_per_request]
+            if len(group) == 1:
+                failed.extend(group)
                 continue
 
-            if sorted(ranks) == list(range(len(sample["raw_factual_data"]))):
-                terms = [sample["raw_factual_data"][i] for i in ranks]
-                sample["ranked_factual_data"] = terms
-                return
+            llm_judgement = query(self._llm, messages=[{"role": "user", "content": self.build_batch_prompt(group)}])
+            share_usage(llm_judgement, group)
+
+            rankings = self.split_batch_response(llm_judgement)
+            for i, sample in enumerate(group):
+                ranked = self.parse_ranking(rankings.get(i, ""), sample, tracker)
+                if ranked is None:
+                    failed.append(sample)
+                else:
+                    sample["ranked_factual_data"] = ranked
+
+        super().step_batch(failed, tracker)
+
+    async def step_async(self, sample: Dict[str, Any], tracker: Dict[str, int]) -> None:
+        if not self.is_rankable(sample):
+            sample["ranked_factual_data"] = None
+            return
+
+        prompt = self.build_prompt(sample)
 
-            tracker["index_ranking_error"] += 1
+        for attempt in range(self._max_retries):
+            for llm_judgement in await self.ask_async(prompt, attempt):
+                ranked = self.parse_ranking(llm_judgement, sample, tracker)
+                if ranked is not None:
+                    sample["ranked_factual_data"] = ranked
+                    return
 
+        sample["ranked_factual_data"] = None
         tracker["ranking_factual_data_error"] += 1
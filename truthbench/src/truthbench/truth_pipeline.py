@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import Optional, Union, Dict, List, Tuple
 
 import spacy
 from spacy import Language
@@ -6,13 +6,17 @@ from spacy import Language
 from truthbench.steps.counter import CounterStep
 
 try:
-    from truthbench.llms.openai import GPT
-    from openai import OpenAI
+    from truthbench.llms.openai import GPT, AsyncGPT, BatchGPT
+    from openai import OpenAI, AsyncOpenAI
 except ImportError:
     GPT = None
+    AsyncGPT = None
+    BatchGPT = None
     OpenAI = None
+    AsyncOpenAI = None
 
-from truthbench.pipeline import Pipeline, LLM
+from truthbench.artifacts import ArtifactStore
+from truthbench.pipeline import Pipeline, Sweep, LLM, AsyncLLM
 from truthbench.steps.blacklist import BlacklistItemsFromQuestionStep
 from truthbench.steps.factual import FactualDataStep, NounAdverbFactualChunker
 from truthbench.steps.filter import FilterFactualDataStep
@@ -21,34 +25,163 @@ from truthbench.steps.paraphrase import ParaphraseStep
 from truthbench.steps.rank import RankFactualDataStep
 
 
-def truth_pipeline(
-        llm: Optional[LLM] = None,
-        stop_words: Optional[str] = None,
-        with_progress: bool = True,
-        num_levels: int = 5,
-        keep: float = 0.8,
-) -> Pipeline:
-    try:
-        nlp: Language = spacy.load("en_core_web_sm")
-    except OSError:
-        raise ImportError("Install EN spacy language with python -m spacy download en_core_web_sm")
+def openai_llm(
+        asynchronous: bool = False, batch: bool = False, prices: Optional[Dict[str, float]] = None
+) -> Union[LLM, AsyncLLM]:
+    """
+    The default language model of `truth_pipeline`: GPT through the OpenAI client, configured from the environment.
+
+    With `batch`, requests go through the Batch API (see `BatchGPT`), which requires `Pipeline.run_async`. With
+    `prices` (per million "prompt", "completion" and "cached" tokens), the cost of each request is accounted.
+    """
+    if GPT is None or OpenAI is None:
+        raise ImportError("Install with: pip install truthbench[openai]")
+    if batch:
+        return BatchGPT(AsyncOpenAI(), prices=prices)
+    return AsyncGPT(AsyncOpenAI(), prices=prices) if asynchronous else GPT(OpenAI(), prices=prices)
+
+
+INPUT_FIELDS = frozenset({"question", "ground_truth"})
+
+
+def _resources(
+        llm: Optional[Union[LLM, AsyncLLM]], stop_words: Optional[str], asynchronous: bool, processes: int
+) -> Tuple[Union[LLM, AsyncLLM], NounAdverbFactualChunker, str]:
+    if processes > 0:
+        # Each worker process loads its own copy of the model, so it is only checked to be installed here
+        if not spacy.util.is_package("en_core_web_sm"):
+            raise ImportError("Install EN spacy language with python -m spacy download en_core_web_sm")
+        chunker = NounAdverbFactualChunker("en_core_web_sm")
+    else:
+        try:
+            nlp: Language = spacy.load("en_core_web_sm")
+        except OSError:
+            raise ImportError("Install EN spacy language with python -m spacy download en_core_web_sm")
+        chunker = NounAdverbFactualChunker(nlp)
 
     if stop_words is None:
         from spacy.lang.en.stop_words import STOP_WORDS
         stop_words = STOP_WORDS
 
     if llm is None:
-        if GPT is None or OpenAI is None:
-            raise ImportError("Install with: pip install truthbench[openai]")
-        llm = GPT(OpenAI())
+        llm = openai_llm(asynchronous)
+
+    return llm, chunker, stop_words
+
 
+def _with_common_steps(
+        pipeline: Pipeline,
+        llm: Union[LLM, AsyncLLM],
+        chunker: NounAdverbFactualChunker,
+        stop_words: str,
+        processes: int,
+        early_stop: bool,
+        rank_candidates: int,
+        repair_rankings: bool,
+        rank_samples_per_request: int,
+) -> Pipeline:
+    # Steps that do not depend on keep and num_levels
     return (
-        Pipeline(with_progress)
+        pipeline
         .with_step(ParaphraseStep(llm))
-        .with_step(FactualDataStep(NounAdverbFactualChunker(nlp)))
+        .with_step(FactualDataStep(chunker), processes=processes)
         .with_step(BlacklistItemsFromQuestionStep(stop_words))
-        .with_step(RankFactualDataStep(llm))
+        .with_step(RankFactualDataStep(
+            llm, early_stop=early_stop, candidates=rank_candidates, repair=repair_rankings,
+            samples_per_request=rank_samples_per_request
+        ))
+    )
+
+
+def _with_configured_steps(
+        pipeline: Pipeline, llm: Union[LLM, AsyncLLM], keep: float, num_levels: int, early_stop: bool, noise_mode: str
+) -> Pipeline:
+    return (
+        pipeline
         .with_step(FilterFactualDataStep(keep))
-        .with_step(CreateNoiseExamplesStep(llm, num_levels))
+        .with_step(CreateNoiseExamplesStep(llm, num_levels, early_stop=early_stop, mode=noise_mode))
         .with_step(CounterStep(num_levels))
     )
+
+
+def truth_pipeline(
+        llm: Optional[Union[LLM, AsyncLLM]] = None,
+        stop_words: Optional[str] = None,
+        with_progress: bool = True,
+        num_levels: int = 5,
+        keep: float = 0.8,
+        max_workers: int = 1,
+        batch_size: int = 1,
+        staged: bool = False,
+        asynchronous: bool = False,
+        processes: int = 0,
+        early_stop: bool = False,
+        rank_candidates: int = 1,
+        repair_rankings: bool = False,
+        rank_samples_per_request: int = 1,
+        noise_mode: str = "chained",
+        isolate_failures: bool = True,
+        parallel_steps: bool = False,
+        artifacts: Optional[ArtifactStore] = None,
+) -> Pipeline:
+    llm, chunker, stop_words = _resources(llm, stop_words, asynchronous, processes)
+    pipeline = Pipeline(
+        with_progress, max_workers=max_workers, batch_size=batch_size, staged=staged, input_fields=INPUT_FIELDS,
+        isolate_failures=isolate_failures, parallel_steps=parallel_steps, artifacts=artifacts
+    )
+    _with_common_steps(
+        pipeline, llm, chunker, stop_words, processes, early_stop, rank_candidates, repair_rankings,
+        rank_samples_per_request
+    )
+    return _with_configured_steps(pipeline, llm, keep, num_levels, early_stop, noise_mode)
+
+
+def sweep_name(keep: float, num_levels: int) -> str:
+    """
+    Name of the branch of `truth_sweep` building the dataset with the given `keep` and `num_levels`.
+    """
+    return f"keep={keep}_levels={num_levels}"
+
+
+def truth_sweep(
+        configurations: List[Tuple[float, int]],
+        llm: Optional[Union[LLM, AsyncLLM]] = None,
+        stop_words: Optional[str] = None,
+        with_progress: bool = True,
+        max_workers: int = 1,
+        batch_size: int = 1,
+        staged: bool = False,
+        asynchronous: bool = False,
+        processes: int = 0,
+        early_stop: bool = False,
+        rank_candidates: int = 1,
+        repair_rankings: bool = False,
+        rank_samples_per_request: int = 1,
+        noise_mode: str = "chained",
+        isolate_failures: bool = True,
+        parallel_steps: bool = False,
+        artifacts: Optional[ArtifactStore] = None,
+) -> Sweep:
+    """
+    The `truth_pipeline` of several configurations, given as (keep, num_levels) pairs, run as a `Sweep`.
+
+    Paraphrasing, parsing, blacklisting and ranking run once per sample. Filtering, noise generation and counting
+    run once per configuration, in branches named by `sweep_name`. Other parameters are those of `truth_pipeline`.
+    """
+    llm, chunker, stop_words = _resources(llm, stop_words, asynchronous, processes)
+    options = dict(
+        max_workers=max_workers, batch_size=batch_size, staged=staged, isolate_failures=isolate_failures,
+        parallel_steps=parallel_steps, artifacts=artifacts
+    )
+    prefix = _with_common_steps(
+        Pipeline(with_progress, input_fields=INPUT_FIELDS, **options), llm, chunker, stop_words, processes,
+        early_stop, rank_candidates, repair_rankings, rank_samples_per_request
+    )
+    branches = {
+        sweep_name(keep, num_levels): _with_configured_steps(
+            Pipeline(with_progress, input_fields=prefix.output_fields, **options), llm, keep, num_levels, early_stop,
+            noise_mode
+        )
+        for keep, num_levels in configurations
+    }
+    return Sweep(prefix, branches)
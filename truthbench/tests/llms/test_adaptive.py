@@ -0,0 +1,158 @@
+import asyncio
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock, AsyncMock
+
+import pytest
+
+from truthbench.llms.adaptive import AdaptiveConcurrency, AdaptiveConcurrencyLLM, AsyncAdaptiveConcurrencyLLM
+from truthbench.llms.resilient import AsyncResilientLLM
+from truthbench.pipeline import LLM, AsyncLLM
+
+MESSAGES = [{"role": "user", "content": "Paraphrase this."}]
+
+
+class RateLimitError(Exception):
+    status_code = 429
+
+
+def test_limit_grows_additively_while_latency_is_flat():
+    controller = AdaptiveConcurrency(initial=2, max_limit=4)
+
+    # About one more request per round of `limit` requests
+    for _ in range(3):
+        controller.on_success(.1)
+    assert controller.limit == 3
+
+    for _ in range(3):
+        controller.on_success(.1)
+    assert controller.limit == 4
+
+    for _ in range(10):
+        controller.on_success(.1)
+    assert controller.limit == 4
+
+
+def test_limit_decreases_multiplicatively_on_congestion():
+    controller = AdaptiveConcurrency(initial=8, max_limit=8)
+
+    controller.on_congestion("rate_limit")
+    assert controller.limit == 4
+
+    controller.on_success(.01)
+    time.sleep(.02)
+    controller.on_success(.05)  # latency spike
+    assert controller.limit == 2
+
+    report = controller.report()
+    assert report["limit"] == 2
+    assert report["peak_limit"] == 8
+    assert [(d["limit"], d["reason"]) for d in report["decisions"]] == [(4, "rate_limit"), (2, "latency")]
+
+
+def test_simultaneous_congestion_cuts_once():
+    controller = AdaptiveConcurrency(initial=8, max_limit=8)
+    controller.on_success(10.)  # long baseline latency
+
+    controller.on_congestion("rate_limit")
+    controller.on_congestion("rate_limit")
+
+    assert controller.limit == 4
+
+
+def test_limit_never_goes_below_minimum():
+    controller = AdaptiveConcurrency(initial=2, min_limit=2)
+
+    controller.on_congestion("rate_limit")
+
+    assert controller.limit == 2
+    assert controller.report()["decisions"] == []
+
+
+@pytest.mark.parametrize("kwargs", [{"initial": 0}, {"initial": 8, "max_limit": 4}, {"decrease_factor": 1}])
+def test_invalid_parameters(kwargs):
+    with pytest.raises(ValueError):
+        AdaptiveConcurrency(**kwargs)
+
+
+def test_llm_wrapper_bounds_requests_in_flight():
+    lock = threading.Lock()
+    in_flight, peak = [0], [0]
+
+    def query(messages):
+        with lock:
+            in_flight[0] += 1
+            peak[0] = max(peak[0], in_flight[0])
+        time.sleep(.01)
+        with lock:
+            in_flight[0] -= 1
+        return "response"
+
+    llm = MagicMock(spec=LLM)
+    llm.query.side_effect = query
+    controller = AdaptiveConcurrency(initial=2, max_limit=2)
+    wrapper = AdaptiveConcurrencyLLM(llm, controller)
+
+    threads = [threading.Thread(target=wrapper.query, args=(MESSAGES,)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert llm.query.call_count == 8
+    assert peak[0] == 2
+
+
+def test_llm_wrapper_reports_rate_limits():
+    llm = MagicMock(spec=LLM)
+    llm.query.side_effect = RateLimitError()
+    controller = AdaptiveConcurrency(initial=4)
+
+    with pytest.raises(RateLimitError):
+        AdaptiveConcurrencyLLM(llm, controller).query(MESSAGES)
+
+    assert controller.limit == 2
+
+
+def test_async_llm_wrapper():
+    in_flight, peak = [0], [0]
+
+    async def query(messages):
+        in_flight[0] += 1
+        peak[0] = max(peak[0], in_flight[0])
+        await asyncio.sleep(.01)
+        in_flight[0] -= 1
+        return "response"
+
+    llm = AsyncMock(spec=AsyncLLM)
+    llm.query.side_effect = query
+    wrapper = AsyncAdaptiveConcurrencyLLM(llm, AdaptiveConcurrency(initial=3, max_limit=3))
+
+    async def run():
+        return await asyncio.gather(*(wrapper.query(MESSAGES) for _ in range(10)))
+
+    assert asyncio.run(run()) == ["response"] * 10
+    assert peak[0] == 3
+
+
+def test_async_llm_wrapper_reports_timeouts():
+    async def query(messages):
+        if llm.query.call_count == 1:
+            await asyncio.sleep(5)
+        return "response"
+
+    llm = AsyncMock(spec=AsyncLLM)
+    llm.stats = MagicMock(return_value={})
+    llm.query.side_effect = query
+    controller = AdaptiveConcurrency(initial=4)
+    resilient = AsyncResilientLLM(AsyncAdaptiveConcurrencyLLM(llm, controller), timeout=.05, base_delay=0)
+
+    assert asyncio.run(resilient.query(MESSAGES)) == "response"
+
+    assert controller.report()["decisions"][0]["reason"] == "timeout"
+    assert controller.limit == 2
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,187 @@
+import asyncio
+import unittest
+from unittest.mock import MagicMock, AsyncMock
+
+import pytest
+
+from truthbench.llms import cache as cache_module
+from truthbench.llms.cache import ResponseCache, CachedLLM, AsyncCachedLLM
+from truthbench.pipeline import LLM, AsyncLLM, query, query_stream
+
+MESSAGES = [{"role": "user", "content": "Paraphrase this."}]
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ResponseCache(tmp_path / "cache.sqlite3")
+
+
+def mock_llm(model="gpt-4o"):
+    llm = MagicMock(spec=LLM)
+    llm.model = model
+    llm.stats.return_value = {}
+    llm.query.side_effect = lambda messages: f"response {llm.query.call_count}"
+    return llm
+
+
+def test_cached_llm_serves_repeated_requests(store):
+    llm = mock_llm()
+    cached = CachedLLM(llm, store)
+
+    assert cached.query(MESSAGES) == "response 1"
+    assert cached.query(MESSAGES) == "response 1"
+    assert cached.query([{"role": "user", "content": "Something else."}]) == "response 2"
+
+    assert llm.query.call_count == 2
+    assert cached.stats() == {"llm_cache_hits": 1, "llm_cache_misses": 2}
+
+
+def test_cache_is_keyed_on_model(store):
+    CachedLLM(mock_llm("gpt-4o"), store).query(MESSAGES)
+
+    other = mock_llm("gpt-4o-mini")
+    assert CachedLLM(other, store).query(MESSAGES) == "response 1"
+    other.query.assert_called_once_with(MESSAGES)
+
+
+def test_cache_persists_across_runs(tmp_path):
+    CachedLLM(mock_llm(), ResponseCache(tmp_path / "cache.sqlite3")).query(MESSAGES)
+
+    llm = mock_llm()
+    assert CachedLLM(llm, ResponseCache(tmp_path / "cache.sqlite3")).query(MESSAGES) == "response 1"
+    llm.query.assert_not_called()
+
+
+def test_retries_bypass_and_replace_cached_response(store):
+    llm = mock_llm()
+    cached = CachedLLM(llm, store)
+
+    assert query(cached, MESSAGES) == "response 1"
+    assert query(cached, MESSAGES, retry=True) == "response 2"
+    assert query(cached, MESSAGES) == "response 2"
+    assert llm.query.call_count == 2
+
+
+def test_expired_entries_are_misses(tmp_path, monkeypatch):
+    now = [1000.]
+    monkeypatch.setattr(cache_module.time, "time", lambda: now[0])
+    llm = mock_llm()
+    cached = CachedLLM(llm, ResponseCache(tmp_path / "cache.sqlite3", ttl=60))
+
+    cached.query(MESSAGES)
+    now[0] += 30
+    assert cached.query(MESSAGES) == "response 1"
+    now[0] += 61
+    assert cached.query(MESSAGES) == "response 2"
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path, monkeypatch):
+    now = [1000.]
+    monkeypatch.setattr(cache_module.time, "time", lambda: now[0])
+    store = ResponseCache(tmp_path / "cache.sqlite3", max_entries=2)
+
+    for key in ("a", "b"):
+        store.put(key, key)
+        now[0] += 1
+    assert store.get("a") == "a"
+    now[0] += 1
+    store.put("c", "c")
+
+    assert len(store) == 2
+    assert store.get("b") is None
+    assert store.get("a") == "a"
+    assert store.get("c") == "c"
+
+
+@pytest.mark.parametrize("kwargs", [{"ttl": 0}, {"max_entries": 0}])
+def test_invalid_limits(tmp_path, kwargs):
+    with pytest.raises(ValueError):
+        ResponseCache(tmp_path / "cache.sqlite3", **kwargs)
+
+
+def test_async_cached_llm(store):
+    llm = AsyncMock(spec=AsyncLLM)
+    llm.model = "gpt-4o"
+    llm.stats = MagicMock(return_value={})
+    llm.query.return_value = "response"
+    cached = AsyncCachedLLM(llm, store)
+
+    async def run():
+        return [await cached.query(MESSAGES) for _ in range(3)]
+
+    assert asyncio.run(run()) == ["response"] * 3
+    llm.query.assert_awaited_once_with(MESSAGES)
+    assert cached.stats() == {"llm_cache_hits": 2, "llm_cache_misses": 1}
+
+
+def test_alternatives_are_cached_together(store):
+    llm = mock_llm()
+    llm.query_n.side_effect = lambda messages, n: [f"response {i}" for i in range(n)]
+    cached = CachedLLM(llm, store)
+
+    assert cached.query_n(MESSAGES, 2) == ["response 0", "response 1"]
+    assert cached.query_n(MESSAGES, 2) == ["response 0", "response 1"]
+    assert cached.query_n(MESSAGES, 3) == ["response 0", "response 1", "response 2"]
+    assert cached.query(MESSAGES) == "response 1"
+
+    assert llm.query_n.call_count == 2
+
+
+def test_streams_are_cached_once_read_to_the_end(store):
+    llm = mock_llm()
+    llm.stream.side_effect = lambda messages, stop=None: (c for c in ["<a>", "x</a>", " chatter"])
+    cached = CachedLLM(llm, store)
+
+    assert query_stream(cached, MESSAGES) == "<a>x</a> chatter"
+    assert query_stream(cached, MESSAGES, until=lambda text: "</a>" in text) == "<a>x</a> chatter"
+    assert query_stream(cached, MESSAGES, stop=["x"]) == "<a>x</a> chatter"  # keyed on the stop sequences
+
+    assert llm.stream.call_count == 2
+    assert cached.stats() == {"llm_cache_hits": 1, "llm_cache_misses": 2}
+
+
+def test_streams_closed_early_are_not_cached(store):
+    llm = mock_llm()
+    llm.stream.side_effect = lambda messages, stop=None: (c for c in ["<a>", "x</a>", " chatter"])
+    cached = CachedLLM(llm, store)
+
+    for chunk in cached.stream(MESSAGES):
+        break
+
+    assert len(store) == 0
+    assert query_stream(cached, MESSAGES) == "<a>x</a> chatter"
+    assert llm.stream.call_count == 2
+
+
+def test_async_streams_closed_early_are_not_cached(store):
+    async def stream(messages, stop=None):
+        for chunk in ["<a>", "x</a>"]:
+            yield chunk
+
+    llm = MagicMock(spec=AsyncLLM)
+    llm.model = "gpt-4o"
+    llm.stream.side_effect = stream
+    cached = AsyncCachedLLM(llm, store)
+
+    async def run():
+        chunks = cached.stream(MESSAGES)
+        first = await anext(chunks)
+        await chunks.aclose()
+        return first
+
+    assert asyncio.run(run()) == "<a>"
+    assert len(store) == 0
+
+
+def test_streams_closed_early_are_not_served_to_queries(store):
+    llm = mock_llm()
+    llm.stream.side_effect = lambda messages, stop=None: (c for c in ["<a>", "x</a>", " chatter"])
+    cached = CachedLLM(llm, store)
+
+    assert query_stream(cached, MESSAGES, until=lambda text: "</a>" in text) == "<a>x</a>"
+    assert cached.query(MESSAGES) == "response 1"
+    assert llm.query.call_count == 1
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,252 @@
+import asyncio
+import json
+import re
+import unittest
+
+import httpx
+import pytest
+
+openai = pytest.importorskip("openai")
+
+from truthbench.llms.openai import GPT, AsyncGPT, BatchGPT
+from truthbench.pipeline import Completion, query_stream
+
+PRICES = {"prompt": 2., "completion": 10., "cached": 1.}
+USAGE = {"prompt_tokens": 1000, "completion_tokens": 100, "prompt_tokens_details": {"cached_tokens": 500}}
+
+
+def chat_completion(content):
+    return {
+        "id": "chatcmpl-0", "object": "chat.completion", "created": 0, "model": "gpt-4o",
+        "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+        "usage": {**USAGE, "total_tokens": 1100},
+    }
+
+
+def chat_handler(request: httpx.Request) -> httpx.Response:
+    body = json.loads(request.read())
+    completion = chat_completion(f" {body['messages'][-1]['content'].upper()} ")
+    completion["choices"] = [{**completion["choices"][0], "index": i} for i in range(body.get("n", 1))]
+    return httpx.Response(200, json=completion)
+
+
+class BatchServer:
+    """
+    A local stand-in for the Files and Batches endpoints of the OpenAI API.
+    """
+
+    def __init__(self, answer, polls=2, fail=()):
+        self.answer = answer
+        self.polls = polls
+        self.fail = set(fail)
+        self.files = {}
+        self.batches = {}
+
+    def handle(self, request: httpx.Request) -> httpx.Response:
+        path = request.url.path
+        if request.method == "POST" and path.endswith("/files"):
+            body = request.read().decode("utf-8")
+            lines = re.findall(r'^\{"custom_id".*$', body, re.MULTILINE)
+            file_id = f"file-{len(self.files)}"
+            self.files[file_id] = "\n".join(lines) + "\n"
+            return httpx.Response(200, json={
+                "id": file_id, "object": "file", "bytes": len(body), "created_at": 0,
+                "filename": "batch.jsonl", "purpose": "batch", "status": "processed",
+            })
+        if request.method == "POST" and path.endswith("/batches"):
+            batch_id = f"batch-{len(self.batches)}"
+            self.batches[batch_id] = {"input": json.loads(request.read())["input_file_id"], "polls": 0}
+            return httpx.Response(200, json=self.batch(batch_id))
+        if request.method == "GET" and "/batches/" in path:
+            return httpx.Response(200, json=self.batch(path.rsplit("/", 1)[-1]))
+        if request.method == "GET" and path.endswith("/content"):
+            return httpx.Response(200, content=self.files[path.split("/")[-2]].encode("utf-8"))
+        return httpx.Response(404)
+
+    def batch(self, batch_id):
+        batch = self.batches[batch_id]
+        batch["polls"] += 1
+        completed = batch["polls"] > self.polls
+        if completed and "output" not in batch:
+            batch["output"], batch["errors"] = self.run(self.files[batch["input"]])
+        return {
+            "id": batch_id, "object": "batch", "endpoint": "/v1/chat/completions", "completion_window": "24h",
+            "created_at": 0, "input_file_id": batch["input"],
+            "status": "completed" if completed else "in_progress",
+            "output_file_id": batch.get("output"), "error_file_id": batch.get("errors"),
+        }
+
+    def run(self, requests):
+        outputs, errors = [], []
+        for line in requests.splitlines():
+            request = json.loads(line)
+            content = request["body"]["messages"][-1]["content"]
+            if content in self.fail:
+                errors.append({"custom_id": request["custom_id"], "response": {
+                    "status_code": 500, "body": {"error": {"message": "server error"}}
+                }})
+                continue
+            outputs.append({"custom_id": request["custom_id"], "response": {"status_code": 200, "body": {
+                "choices": [{"message": {"role": "assistant", "content": self.answer(content)}}], "usage": USAGE
+            }}})
+
+        output_id, error_id = f"file-{len(self.files)}", f"file-{len(self.files) + 1}"
+        self.files[output_id] = "\n".join(json.dumps(o) for o in outputs)
+        self.files[error_id] = "\n".join(json.dumps(e) for e in errors)
+        return output_id, error_id
+
+
+def client_for(server):
+    return openai.AsyncOpenAI(
+        api_key="test", base_url="http://stand-in/v1",
+        http_client=httpx.AsyncClient(transport=httpx.MockTransport(server.handle))
+    )
+
+
+def test_gpt_returns_usage_and_cost():
+    client = openai.OpenAI(
+        api_key="test", base_url="http://stand-in/v1",
+        http_client=httpx.Client(transport=httpx.MockTransport(chat_handler))
+    )
+
+    response = GPT(client, prices=PRICES).query([{"role": "user", "content": "q"}])
+
+    assert isinstance(response, Completion)
+    assert response == "Q"
+    assert response.usage() == {
+        "prompt_tokens": 1000, "completion_tokens": 100, "cached_tokens": 500, "cost": pytest.approx(.0025)
+    }
+
+
+def test_gpt_generates_alternatives_in_one_request():
+    client = openai.OpenAI(
+        api_key="test", base_url="http://stand-in/v1",
+        http_client=httpx.Client(transport=httpx.MockTransport(chat_handler))
+    )
+
+    responses = GPT(client, prices=PRICES).query_n([{"role": "user", "content": "q"}], 3)
+
+    assert responses == ["Q", "Q", "Q"]
+    assert [r.prompt_tokens for r in responses] == [1000, 0, 0]
+
+
+def test_async_gpt_returns_usage():
+    client = openai.AsyncOpenAI(
+        api_key="test", base_url="http://stand-in/v1",
+        http_client=httpx.AsyncClient(transport=httpx.MockTransport(chat_handler))
+    )
+
+    response = asyncio.run(AsyncGPT(client).query([{"role": "user", "content": "q"}]))
+
+    assert response == "Q"
+    assert (response.prompt_tokens, response.cached_tokens, response.cost) == (1000, 500, 0.)
+
+
+def stream_handler(request: httpx.Request) -> httpx.Response:
+    body = json.loads(request.read())
+    assert body["stream"] and body["stop"] == ["</o>"]
+    events = [
+        {"choices": [{"index": 0, "delta": {"role": "assistant", "content": text}, "finish_reason": None}]}
+        for text in ["<o>", "x"]
+    ]
+    events.append({"choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+    events.append({"choices": [], "usage": {**USAGE, "completion_tokens": 3, "total_tokens": 1003}})
+    header = {"id": "chatcmpl-0", "object": "chat.completion.chunk", "created": 0, "model": "gpt-4o"}
+    lines = "".join(f"data: {json.dumps({**header, **event})}\n\n" for event in events)
+    return httpx.Response(200, headers={"content-type": "text/event-stream"}, content=lines + "data: [DONE]\n\n")
+
+
+def test_gpt_stream_reports_actual_usage():
+    client = openai.OpenAI(
+        api_key="test", base_url="http://stand-in/v1",
+        http_client=httpx.Client(transport=httpx.MockTransport(stream_handler))
+    )
+
+    response = query_stream(GPT(client, prices=PRICES), [{"role": "user", "content": "q"}], stop=["</o>"])
+
+    assert response == "<o>x"
+    assert (response.prompt_tokens, response.completion_tokens, response.cached_tokens) == (1000, 3, 500)
+    assert response.cost == pytest.approx((500 * 2 + 500 * 1 + 3 * 10) / 1_000_000)
+
+
+def test_gpt_stream_closed_early_estimates_usage():
+    client = openai.AsyncOpenAI(
+        api_key="test", base_url="http://stand-in/v1",
+        http_client=httpx.AsyncClient(transport=httpx.MockTransport(stream_handler))
+    )
+    llm = AsyncGPT(client, prices=PRICES)
+
+    async def run():
+        chunks = llm.stream([{"role": "user", "content": "q" * 40}], stop=["</o>"])
+        received = [await anext(chunks), await anext(chunks)]
+        await chunks.aclose()
+        return received
+
+    start, first = asyncio.run(run())
+
+    assert (start, first) == ("", "<o>")
+    assert (start.prompt_tokens, first.completion_tokens) == (11, 1)
+    assert start.cost + first.cost == pytest.approx((11 * 2 + 10) / 1_000_000)
+
+
+def test_batch_gpt_gathers_requests_in_one_batch():
+    server = BatchServer(answer=lambda content: f" {content.upper()} ")
+    llm = BatchGPT(client_for(server), window=.01, poll_interval=.01)
+
+    async def run():
+        return await asyncio.gather(*(llm.query([{"role": "user", "content": f"q{i}"}]) for i in range(5)))
+
+    responses = asyncio.run(run())
+
+    assert responses == [f"Q{i}" for i in range(5)]
+    assert all(r.completion_tokens == 100 for r in responses)
+    assert len(server.batches) == 1
+    assert llm.stats() == {"llm_batches": 1}
+
+
+def test_batch_gpt_runs_sequential_rounds_as_separate_batches():
+    server = BatchServer(answer=lambda content: content + "!")
+    llm = BatchGPT(client_for(server), window=.01, poll_interval=.01)
+
+    async def chain(i):
+        text = f"q{i}"
+        for _ in range(3):
+            text = await llm.query([{"role": "user", "content": text}])
+        return text
+
+    async def run():
+        return await asyncio.gather(*(chain(i) for i in range(4)))
+
+    assert asyncio.run(run()) == [f"q{i}!!!" for i in range(4)]
+    assert len(server.batches) == 3
+
+
+def test_batch_gpt_splits_full_batches():
+    server = BatchServer(answer=lambda content: content)
+    llm = BatchGPT(client_for(server), window=.01, max_batch_size=2, poll_interval=.01)
+
+    async def run():
+        return await asyncio.gather(*(llm.query([{"role": "user", "content": f"q{i}"}]) for i in range(5)))
+
+    assert asyncio.run(run()) == [f"q{i}" for i in range(5)]
+    assert len(server.batches) == 3
+
+
+def test_batch_gpt_fails_only_failed_requests():
+    server = BatchServer(answer=lambda content: content, fail={"q1"})
+    llm = BatchGPT(client_for(server), window=.01, poll_interval=.01)
+
+    async def run():
+        return await asyncio.gather(
+            *(llm.query([{"role": "user", "content": f"q{i}"}]) for i in range(3)), return_exceptions=True
+        )
+
+    ok, failed, other = asyncio.run(run())
+
+    assert (ok, other) == ("q0", "q2")
+    assert isinstance(failed, RuntimeError)
+    assert "server error" in str(failed)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,107 @@
+import asyncio
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock, AsyncMock
+
+import pytest
+
+from truthbench.llms.ratelimit import TokenBucket, RateLimiter, RateLimitedLLM, AsyncRateLimitedLLM, estimate_tokens
+from truthbench.pipeline import LLM, AsyncLLM
+
+MESSAGES = [{"role": "user", "content": "x" * 399}]
+
+
+def mock_llm(response="y" * 399):
+    llm = MagicMock(spec=LLM)
+    llm.stats.return_value = {}
+    llm.query.return_value = response
+    return llm
+
+
+def test_estimate_tokens():
+    assert estimate_tokens("") == 1
+    assert estimate_tokens("x" * 399) == 100
+
+
+def test_token_bucket_paces_reservations_in_order():
+    bucket = TokenBucket(per_minute=600)  # 10 per second, burst of 10
+
+    waits = [bucket.reserve(5) for _ in range(4)]
+
+    assert waits[:2] == [0., 0.]
+    assert waits[2] == pytest.approx(.5, abs=.05)
+    assert waits[3] == pytest.approx(1., abs=.05)
+
+
+def test_token_bucket_refund():
+    bucket = TokenBucket(per_minute=60, capacity=10)
+
+    assert bucket.reserve(15) == pytest.approx(5, abs=.05)
+    bucket.refund(10)
+    assert bucket.reserve(1) == pytest.approx(0, abs=.05)
+
+
+def test_invalid_budgets():
+    with pytest.raises(ValueError):
+        TokenBucket(per_minute=0)
+    with pytest.raises(ValueError):
+        RateLimiter(requests_per_minute=60, headroom=0)
+
+
+def test_rate_limited_llm_stays_under_requests_per_minute():
+    llm = mock_llm()
+    limited = RateLimitedLLM(llm, RateLimiter(requests_per_minute=1200, headroom=1.))  # one every 50ms
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=limited.query, args=(MESSAGES,)) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    assert llm.query.call_count == 6
+    assert elapsed >= .25
+    # Six requests over five intervals of 50ms
+    assert limited.stats()["llm_effective_rpm"] <= 1200 * 6 / 5 * 1.05
+
+
+def test_rate_limited_llm_stays_under_tokens_per_minute():
+    # 200 tokens per request (prompt and response), with a budget of 12000 tokens per minute (200 per second)
+    limited = RateLimitedLLM(
+        mock_llm(), RateLimiter(tokens_per_minute=12_000, expected_output_tokens=100, headroom=1.)
+    )
+
+    start = time.perf_counter()
+    for _ in range(4):
+        limited.query(MESSAGES)
+    elapsed = time.perf_counter() - start
+
+    assert elapsed >= 2.9
+    # Four requests over three intervals of one second
+    assert limited.stats()["llm_effective_tpm"] <= 12_000 * 4 / 3 * 1.05
+
+
+def test_effective_rates_without_requests():
+    assert RateLimitedLLM(mock_llm(), RateLimiter(requests_per_minute=60)).stats() == {
+        "llm_effective_rpm": 0, "llm_effective_tpm": 0
+    }
+
+
+def test_async_rate_limited_llm():
+    llm = AsyncMock(spec=AsyncLLM)
+    llm.stats = MagicMock(return_value={})
+    llm.query.return_value = "response"
+    limited = AsyncRateLimitedLLM(llm, RateLimiter(requests_per_minute=1200, headroom=1.))
+
+    async def run():
+        return await asyncio.gather(*(limited.query(MESSAGES) for _ in range(5)))
+
+    start = time.perf_counter()
+    assert asyncio.run(run()) == ["response"] * 5
+    assert time.perf_counter() - start >= .2
+
+
+if __name__ == "__main__":
+    unittest.main()
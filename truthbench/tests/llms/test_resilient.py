@@ -0,0 +1,216 @@
+import asyncio
+import threading
+import time
+import unittest
+from types import SimpleNamespace
+from unittest.mock import MagicMock, AsyncMock
+
+import pytest
+
+from truthbench.llms import resilient as resilient_module
+from truthbench.llms.ratelimit import RateLimiter
+from truthbench.llms.resilient import ResilientLLM, AsyncResilientLLM, CircuitBreaker, classify_error
+from truthbench.pipeline import LLM, AsyncLLM, query_stream
+
+MESSAGES = [{"role": "user", "content": "Paraphrase this."}]
+
+
+class APIError(Exception):
+    def __init__(self, status_code, headers=None):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        self.response = SimpleNamespace(headers=headers or {})
+
+
+class APIConnectionError(Exception):
+    pass
+
+
+def mock_llm(*outcomes):
+    llm = MagicMock(spec=LLM)
+    llm.stats.return_value = {}
+    llm.query.side_effect = list(outcomes)
+    return llm
+
+
+@pytest.mark.parametrize(
+    "error, kind",
+    [
+        (TimeoutError(), "timeout"),
+        (APIError(429), "rate_limit"),
+        (APIError(503), "server_error"),
+        (APIError(408), "server_error"),
+        (APIConnectionError(), "server_error"),
+        (ConnectionResetError(), "server_error"),
+        (APIError(400), None),
+        (ValueError(), None),
+    ]
+)
+def test_classify_error(error, kind):
+    assert classify_error(error) == kind
+
+
+def test_transient_errors_are_retried():
+    llm = mock_llm(APIError(429), APIError(500), "response")
+    resilient = ResilientLLM(llm, base_delay=0)
+
+    assert resilient.query(MESSAGES) == "response"
+    assert llm.query.call_count == 3
+    assert resilient.stats() == {
+        "llm_request_retries": 2,
+        "llm_timeouts": 0,
+        "llm_rate_limited": 1,
+        "llm_server_errors": 1,
+        "llm_circuit_breaks": 0,
+    }
+
+
+def test_other_errors_are_raised_right_away():
+    llm = mock_llm(APIError(400), "response")
+
+    with pytest.raises(APIError):
+        ResilientLLM(llm, base_delay=0).query(MESSAGES)
+    assert llm.query.call_count == 1
+
+
+def test_gives_up_after_max_retries():
+    llm = mock_llm(*[APIError(500)] * 3)
+    resilient = ResilientLLM(llm, max_retries=2, base_delay=0)
+
+    with pytest.raises(APIError):
+        resilient.query(MESSAGES)
+    assert llm.query.call_count == 3
+    assert resilient.stats()["llm_request_retries"] == 2
+
+
+def test_hung_requests_time_out():
+    release = threading.Event()
+    calls = []
+
+    def query(messages):
+        calls.append(messages)
+        if len(calls) == 1:
+            release.wait(5)
+        return "response"
+
+    llm = MagicMock(spec=LLM)
+    llm.stats.return_value = {}
+    llm.query.side_effect = query
+    resilient = ResilientLLM(llm, timeout=.05, base_delay=0)
+
+    start = time.perf_counter()
+    assert resilient.query(MESSAGES) == "response"
+    release.set()
+
+    assert time.perf_counter() - start < 1
+    assert resilient.stats()["llm_timeouts"] == 1
+
+
+def test_backoff_honors_retry_after(monkeypatch):
+    delays = []
+    monkeypatch.setattr(resilient_module.time, "sleep", delays.append)
+    llm = mock_llm(APIError(429, headers={"retry-after": "7"}), APIError(500), "response")
+
+    ResilientLLM(llm, base_delay=2, max_delay=60).query(MESSAGES)
+
+    assert delays[0] == 7
+    assert 0 <= delays[1] <= 4
+
+
+def test_circuit_breaker_pauses_requests():
+    breaker = CircuitBreaker(failure_threshold=2, cooldown=.2)
+    llm = mock_llm(APIError(503), APIError(503), "response")
+    resilient = ResilientLLM(llm, base_delay=0, breaker=breaker)
+
+    start = time.perf_counter()
+    assert resilient.query(MESSAGES) == "response"
+
+    assert time.perf_counter() - start >= .2
+    assert resilient.stats()["llm_circuit_breaks"] == 1
+    assert breaker.wait_time() == 0
+
+
+def test_circuit_breaker_reopens_if_probe_fails():
+    breaker = CircuitBreaker(failure_threshold=1, cooldown=.05)
+
+    breaker.record_failure()
+    assert breaker.wait_time() > 0
+    time.sleep(.06)
+    assert breaker.wait_time() == 0  # probe
+    assert breaker.wait_time() > 0  # others wait for the probe
+    breaker.record_failure()
+
+    assert breaker.opened == 2
+    assert breaker.wait_time() > 0
+
+
+def test_alternatives_are_retried():
+    llm = mock_llm()
+    llm.query_n.side_effect = [APIError(429), ["a", "b"]]
+    resilient = ResilientLLM(llm, base_delay=0)
+
+    assert resilient.query_n(MESSAGES, 2) == ["a", "b"]
+    assert resilient.stats()["llm_rate_limited"] == 1
+
+
+def test_streams_are_retried_until_first_chunk():
+    def stream(messages, stop=None):
+        if llm.stream.call_count == 1:
+            raise APIError(503)
+        yield "a"
+        if llm.stream.call_count == 2:
+            raise APIError(503)
+        yield "b"
+
+    llm = mock_llm()
+    llm.stream.side_effect = stream
+    resilient = ResilientLLM(llm, base_delay=0)
+
+    with pytest.raises(APIError):
+        query_stream(resilient, MESSAGES)
+    assert query_stream(resilient, MESSAGES) == "ab"
+
+    assert llm.stream.call_count == 3
+    assert resilient.stats()["llm_request_retries"] == 1
+
+
+def test_every_attempt_draws_from_the_rate_limiter():
+    limiter = RateLimiter(requests_per_minute=6000, headroom=1)
+    llm = mock_llm(APIError(429), APIError(500), "response")
+    resilient = ResilientLLM(llm, base_delay=0, limiter=limiter)
+
+    start = time.perf_counter()
+    assert resilient.query(MESSAGES) == "response"
+
+    # Requests are spaced by 10 ms, the first one going out right away
+    assert time.perf_counter() - start >= .02
+    assert limiter._dispatched == 3
+    assert "llm_effective_rpm" in resilient.stats()
+
+
+def test_async_resilient_llm():
+    calls = []
+
+    async def query(messages):
+        calls.append(messages)
+        if len(calls) == 1:
+            await asyncio.sleep(5)
+        if len(calls) == 2:
+            raise APIError(429)
+        return "response"
+
+    llm = AsyncMock(spec=AsyncLLM)
+    llm.stats = MagicMock(return_value={})
+    llm.query.side_effect = query
+    resilient = AsyncResilientLLM(llm, timeout=.05, base_delay=0)
+
+    assert asyncio.run(resilient.query(MESSAGES)) == "response"
+
+    stats = resilient.stats()
+    assert stats["llm_timeouts"] == 1
+    assert stats["llm_rate_limited"] == 1
+    assert stats["llm_request_retries"] == 2
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+import json
+import unittest
+
+import pytest
+
+from truthbench.readers.jsonl_reader import JsonLinesReader
+
+
+@pytest.fixture
+def save_jsonl(tmp_path):
+    def _write_jsonl(lines):
+        file_path = tmp_path / "data.jsonl"
+        with open(file_path, "w") as f:
+            for line in lines:
+                f.write((line if isinstance(line, str) else json.dumps(line)) + "\n")
+        return file_path
+
+    return _write_jsonl
+
+
+def test_samples_reads_jsonl_correctly(save_jsonl):
+    test_data = [
+        {"question": "What is Python?", "ground_truth": "A programming language.", "extra": 1},
+        "",
+        {"question": "What is 2+2?", "ground_truth": "4"}
+    ]
+    file_path = save_jsonl(test_data)
+
+    reader = JsonLinesReader(file_path)
+
+    assert reader.samples() == [
+        {"question": "What is Python?", "ground_truth": "A programming language."},
+        {"question": "What is 2+2?", "ground_truth": "4"}
+    ]
+
+
+def test_stream_is_lazy(save_jsonl):
+    file_path = save_jsonl([{"question": "What is 2+2?", "ground_truth": "4"}, "{broken"])
+
+    stream = JsonLinesReader(file_path).stream()
+
+    assert next(stream) == {"question": "What is 2+2?", "ground_truth": "4"}
+    with pytest.raises(ValueError, match="Invalid JSON at line 2"):
+        next(stream)
+
+
+@pytest.mark.parametrize("test_input,error_message", [
+    (["What is 2+2?", "4"], r"Samples must be JSON objects \(line 1\)"),
+    ({"q": "Where?", "a": "There"}, r"Missing required keys: 'question' and 'ground_truth' \(line 1\)"),
+])
+def test_invalid_jsonl(save_jsonl, test_input, error_message):
+    file_path = save_jsonl([test_input])
+
+    reader = JsonLinesReader(file_path)
+
+    with pytest.raises(ValueError, match=error_message):
+        reader.samples()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,3 +1,4 @@
+import pickle
 import re
 import unittest
 from typing import Callable
@@ -128,6 +129,18 @@ class TestNounAdverbFactualChunker:
 
         assert tagged == expected
 
+    def test_factual_extraction_in_batch(self):
+        nlp = spacy.load("en_core_web_sm")
+        chunker = NounAdverbFactualChunker(nlp)
+        sentences = [
+            "The quick brown fox jumps over a box.",
+            "The government announced the new policy in 2021 with confidence.",
+        ]
+
+        tagged = chunker.tag_batch(sentences)
+
+        assert tagged == [chunker.tag(sentence) for sentence in sentences]
+
 
 class DummyChunker(FactualChunker):
 
@@ -176,6 +189,50 @@ def test_successful_span_extraction(tracker):
     assert tracker["find_factual_data_error"] == 0
 
 
+def test_step_batch_tags_all_answers_at_once(tracker):
+    class BatchChunker(DummyChunker):
+        def __init__(self):
+            super().__init__(lambda s: s.replace("Paris", "[Paris]"))
+            self.calls = []
+
+        def tag_batch(self, sentences):
+            self.calls.append(sentences)
+            return super().tag_batch(sentences)
+
+    chunker = BatchChunker()
+    samples = [
+        {"answers": {"A0": "I visited Paris."}},
+        {"answers": None},
+        {"answers": {"A0": "I visited Rome."}},
+    ]
+    step = FactualDataStep(chunker=chunker)
+
+    step.step_batch(samples, tracker)
+
+    assert chunker.calls == [["I visited Paris.", "I visited Rome."]]
+    assert [s["raw_factual_data"] for s in samples] == [["Paris"], None, None]
+    assert samples[0]["with_brackets"] == {"A0": "I visited [Paris]."}
+    assert samples[1]["with_brackets"] is None
+    assert tracker["find_factual_data_error"] == 1
+
+
+def test_chunker_from_model_name_is_loaded_lazily_and_not_pickled(monkeypatch):
+    loaded = []
+    monkeypatch.setattr(spacy, "load", lambda name: loaded.append(name) or spacy.lang.en.English())
+
+    chunker = NounAdverbFactualChunker("en_core_web_sm")
+    assert loaded == []
+
+    FactualDataStep(chunker).setup()
+    assert loaded == ["en_core_web_sm"]
+
+    restored = pickle.loads(pickle.dumps(chunker))
+    assert restored._loaded is None
+
+    restored.setup()
+    assert loaded == ["en_core_web_sm", "en_core_web_sm"]
+
+
 @pytest.mark.parametrize(
     "sample, error",
     [
@@ -1,9 +1,13 @@
+import asyncio
 import re
+import threading
+import time
 import unittest
 from unittest import mock
 
 import pytest
 
+from truthbench.pipeline import AsyncLLM
 from truthbench.steps.noise import CreateNoiseExamplesStep
 
 
@@ -42,6 +46,174 @@ def test_creates_perturbed_variants():
     ])
 
 
+def test_creates_chained_variants_with_async_llm():
+    llm = mock.AsyncMock(spec=AsyncLLM)
+    llm.query.side_effect = [
+        "<thinking>...</thinking><output>A sentence with {{term1}} and termY.</output>",
+        "<thinking>...</thinking><output>A sentence with termX and {{termY}}.</output>",
+    ]
+    step = CreateNoiseExamplesStep(llm=llm, levels=3)
+    sample = {
+        "answers": {"A0": "A sentence with term1 and term2."},
+        "with_brackets": {"A0": "A sentence with [term1] and [term2]."},
+        "factual_data": ["term1", "term2"]
+    }
+
+    with mock.patch("truthbench.steps.noise.random.shuffle"):
+        asyncio.run(step.step_async(sample, {}))
+
+    assert llm.query.await_count == 2
+    # the second level receives the output of the first one
+    assert llm.query.await_args_list[1].args[0][1]["content"] == "```\nA sentence with [term1] and termY.\n```"
+    assert sample["answers"] == {
+        "A0": "A sentence with term1 and term2.",
+        "A1": "A sentence with term1 and termY.",
+        "A2": "A sentence with termX and termY.",
+    }
+
+
+INDEPENDENT_RESPONSES = {
+    "```\nA sentence with {{term1}} and [term2].\n```":
+        "<thinking>1</thinking><output>A sentence with {{term1}} and termY.</output>",
+    "```\nA sentence with [term1] and [term2].\n```":
+        "<thinking>2</thinking><output>A sentence with termX and termY.</output>",
+}
+
+
+def test_creates_independent_variants_concurrently():
+    in_flight, peak = [0], [0]
+    lock = threading.Lock()
+
+    def query(messages):
+        with lock:
+            in_flight[0] += 1
+            peak[0] = max(peak[0], in_flight[0])
+        time.sleep(.05)
+        with lock:
+            in_flight[0] -= 1
+        return INDEPENDENT_RESPONSES[messages[1]["content"]]
+
+    llm = mock.MagicMock()
+    llm.query.side_effect = query
+    step = CreateNoiseExamplesStep(llm=llm, levels=3, mode="independent")
+    sample = {
+        "answers": {"A0": "A sentence with term1 and term2."},
+        "with_brackets": {"A0": "A sentence with [term1] and [term2]."},
+        "factual_data": ["term1", "term2"]
+    }
+
+    with mock.patch("truthbench.steps.noise.random.shuffle"):
+        step.step(sample, {})
+
+    assert peak[0] == 2
+    assert sample["answers"] == {
+        "A0": "A sentence with term1 and term2.",
+        "A1": "A sentence with term1 and termY.",
+        "A2": "A sentence with termX and termY.",
+    }
+    assert sample["thinking"] == {"A1": "1", "A2": "2"}
+
+
+def test_creates_independent_variants_with_async_llm():
+    llm = mock.AsyncMock(spec=AsyncLLM)
+    llm.query.side_effect = lambda messages: INDEPENDENT_RESPONSES[messages[1]["content"]]
+    step = CreateNoiseExamplesStep(llm=llm, levels=3, mode="independent")
+    sample = {
+        "answers": {"A0": "A sentence with term1 and term2."},
+        "with_brackets": {"A0": "A sentence with [term1] and [term2]."},
+        "factual_data": ["term1", "term2"]
+    }
+
+    with mock.patch("truthbench.steps.noise.random.shuffle"):
+        asyncio.run(step.step_async(sample, {}))
+
+    assert llm.query.await_count == 2
+    assert sample["with_brackets"]["A2"] == "A sentence with termX and termY."
+
+
+def test_creates_all_variants_in_a_single_call():
+    llm = mock.MagicMock()
+    llm.query.side_effect = [
+        '<thinking>plan</thinking>\n'
+        '<output level="1">A sentence with {{term1}} and termY and {{term3}}.</output>\n'
+        '<output level="2">A sentence with termX and termY and term3.</output>',  # term3 must stay unchanged
+        "<thinking>again</thinking><output>A sentence with termZ and termY and {{term3}}.</output>",
+    ]
+    step = CreateNoiseExamplesStep(llm=llm, levels=3, mode="single_call")
+    sample = {
+        "answers": {"A0": "A sentence with term1 and term2 and term3."},
+        "with_brackets": {"A0": "A sentence with [term1] and [term2] and [term3]."},
+        "factual_data": ["term1", "term2"]
+    }
+    tracker = {"regenerated_noise_level": 0}
+
+    with mock.patch("truthbench.steps.noise.random.shuffle"):
+        step.step(sample, tracker)
+
+    messages = llm.query.call_args_list[0].args[0]
+    assert messages[0]["content"] == CreateNoiseExamplesStep.PROMPT
+    assert messages[1]["content"].startswith("```\nA sentence with [term1] and [term2] and {{term3}}.\n```")
+    assert "Level 1: [term2]\nLevel 2: [term1]\n" in messages[1]["content"]
+    # the invalid level is requested again on its own
+    assert llm.query.call_args_list[1].args[0][1]["content"] == (
+        "```\nA sentence with [term1] and [term2] and {{term3}}.\n```"
+    )
+    assert sample["answers"] == {
+        "A0": "A sentence with term1 and term2 and term3.",
+        "A1": "A sentence with term1 and termY and term3.",
+        "A2": "A sentence with termZ and termY and term3.",
+    }
+    assert sample["with_brackets"]["A1"] == "A sentence with [term1] and termY and [term3]."
+    assert sample["thinking"] == {"A1": "plan", "A2": "again"}
+    assert tracker == {"regenerated_noise_level": 1}
+
+
+def test_creates_all_variants_in_a_single_call_with_async_llm():
+    llm = mock.AsyncMock(spec=AsyncLLM)
+    llm.query.return_value = (
+        '<thinking>plan</thinking>\n'
+        '<output level="1">A sentence with {{term1}} and termY.</output>\n'
+        '<output level="2">A sentence with termX and termY.</output>'
+    )
+    step = CreateNoiseExamplesStep(llm=llm, levels=3, mode="single_call")
+    sample = {
+        "answers": {"A0": "A sentence with term1 and term2."},
+        "with_brackets": {"A0": "A sentence with [term1] and [term2]."},
+        "factual_data": ["term1", "term2"]
+    }
+    tracker = {"regenerated_noise_level": 0}
+
+    with mock.patch("truthbench.steps.noise.random.shuffle"):
+        asyncio.run(step.step_async(sample, tracker))
+
+    assert llm.query.await_count == 1
+    assert sample["answers"]["A2"] == "A sentence with termX and termY."
+    assert tracker == {"regenerated_noise_level": 0}
+
+
+def test_bad_mode():
+    with pytest.raises(ValueError):
+        CreateNoiseExamplesStep(llm=mock.MagicMock(), mode="parallel")
+
+
+def test_early_stop_at_output_end():
+    llm = mock.MagicMock()
+    llm.stream.return_value = (c for c in ["<thinking>termX</thinking>\n\n<output>A sentence ", "with termX."])
+    step = CreateNoiseExamplesStep(llm=llm, levels=2, early_stop=True)
+    sample = {
+        "answers": {"A0": "A sentence with term1."},
+        "with_brackets": {"A0": "A sentence with [term1]."},
+        "factual_data": ["term1"]
+    }
+
+    step.step(sample, {})
+
+    assert llm.stream.call_args.kwargs == {"stop": ["</output>"]}
+    llm.query.assert_not_called()
+    assert sample["answers"]["A1"] == "A sentence with termX."
+    assert sample["thinking"]["A1"] == "termX"
+
+
 def test_llm_failed_to_comply_with_thinking_formatting():
     llm = mock.MagicMock()
     llm.query.return_value = (
@@ -1,9 +1,11 @@
+import asyncio
 import re
 import unittest
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, AsyncMock
 
 import pytest
 
+from truthbench.pipeline import AsyncLLM
 from truthbench.steps.paraphrase import ParaphraseStep
 
 
@@ -26,6 +28,18 @@ def test_paraphrase_successful():
     assert sample["answers"]["A0"] == "Water reaches its boiling point at 100°C."
 
 
+def test_paraphrase_successful_with_async_llm():
+    llm = AsyncMock(spec=AsyncLLM)
+    sample = {"ground_truth": "Water boils at 100 degrees Celsius."}
+    llm.query.return_value = "Water reaches its boiling point at 100°C."
+
+    step = ParaphraseStep(llm)
+    asyncio.run(step.step_async(sample, {}))
+
+    llm.query.assert_awaited_once()
+    assert sample["answers"] == {"A0": "Water reaches its boiling point at 100°C."}
+
+
 def test_missing_ground_truth():
     sample = {"ground_truth": None}
     tracker = {}
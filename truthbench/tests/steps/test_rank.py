@@ -1,8 +1,10 @@
+import asyncio
 import unittest
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, AsyncMock
 
 import pytest
 
+from truthbench.pipeline import LLM, AsyncLLM, Completion, Pipeline, Reader
 from truthbench.steps.rank import RankFactualDataStep
 
 
@@ -87,6 +89,28 @@ def test_rank_factual_data_failure_due_to_broken_json():
     }
 
 
+def test_rank_factual_data_failure_sets_produced_field_to_none():
+    llm = MagicMock()
+    llm.query.return_value = "<thinking>...</thinking>\n\nOUTPUT: [1, 2, 0"  # broken json
+    step = RankFactualDataStep(llm=llm, max_retries=3)
+    sample = {
+        "question": "What does the ozone gas?",
+        "with_brackets": {"A0": "Ozone affects [climate] and [air quality] in [urban areas]."},
+        "raw_factual_data": ["climate", "air quality", "urban areas"]
+    }
+    tracker = {
+        "ranking_factual_data_error": 0,
+        "json_parse_ranking_error": 0,
+        "index_ranking_error": 0,
+    }
+
+    step.step(sample, tracker)
+
+    # The pipeline terminates samples whose produced fields are None, so the following steps skip them
+    assert step.produced_fields == frozenset({"ranked_factual_data"})
+    assert sample["ranked_factual_data"] is None
+
+
 def test_rank_factual_data_failure_due_incorrect_format():
     llm = MagicMock()
     llm.query.return_value = "<thinking>...</thinking>\n\noutput: [1, 2, 0]"  # lowercase
@@ -164,6 +188,214 @@ def test_rank_factual_data_failure_with_unexpected_items(output):
     }
 
 
+def test_rank_factual_data_retries_with_async_llm():
+    llm = AsyncMock(spec=AsyncLLM)
+    llm.query.side_effect = [
+        "<thinking>...</thinking>\n\nOUTPUT: [1, 2",
+        "<thinking>...</thinking>\n\nOUTPUT: [1, 2, 0]",
+    ]
+    step = RankFactualDataStep(llm=llm, max_retries=3)
+    sample = {
+        "question": "What does the ozone gas?",
+        "with_brackets": {"A0": "Ozone affects [climate] and [air quality] in [urban areas]."},
+        "raw_factual_data": ["climate", "air quality", "urban areas"]
+    }
+    tracker = {
+        "ranking_factual_data_error": 0,
+        "json_parse_ranking_error": 0,
+        "index_ranking_error": 0,
+    }
+
+    asyncio.run(step.step_async(sample, tracker))
+
+    assert llm.query.await_count == 2
+    assert sample["ranked_factual_data"] == ["air quality", "urban areas", "climate"]
+    assert tracker == {
+        "ranking_factual_data_error": 0,
+        "json_parse_ranking_error": 1,
+        "index_ranking_error": 0,
+    }
+
+
+class StreamingLLM(LLM):
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.sent = 0
+
+    def query(self, messages):
+        raise AssertionError("the response must be streamed")
+
+    def stream(self, messages, stop=None):
+        for chunk in self.chunks:
+            self.sent += 1
+            yield chunk
+
+
+def test_rank_factual_data_stops_early():
+    llm = StreamingLLM(["<thinking>[climate:0] is vague</thinking>\n", "OUTPUT: [1, ", "2, 0]\n\nNote", ": ..."])
+    step = RankFactualDataStep(llm, early_stop=True)
+    sample = {
+        "question": "What does the ozone gas?",
+        "with_brackets": {"A0": "Ozone affects [climate] and [air quality] in [urban areas]."},
+        "raw_factual_data": ["climate", "air quality", "urban areas"]
+    }
+    tracker = {"ranking_factual_data_error": 0, "json_parse_ranking_error": 0, "index_ranking_error": 0}
+
+    step.step(sample, tracker)
+
+    assert sample["ranked_factual_data"] == ["air quality", "urban areas", "climate"]
+    assert llm.sent == 3
+    assert tracker == {"ranking_factual_data_error": 0, "json_parse_ranking_error": 0, "index_ranking_error": 0}
+
+
+def test_rank_factual_data_keeps_first_valid_candidate():
+    llm = MagicMock()
+    llm.query_n.side_effect = [
+        ["OUTPUT: [0, 0, 1]", "OUTPUT: [0, 0]"],
+        ["OUTPUT: [1, 2", "OUTPUT: [1, 2, 0]"],
+    ]
+    step = RankFactualDataStep(llm, candidates=2)
+    sample = {
+        "question": "What does the ozone gas?",
+        "with_brackets": {"A0": "Ozone affects [climate] and [air quality] in [urban areas]."},
+        "raw_factual_data": ["climate", "air quality", "urban areas"]
+    }
+    tracker = {"ranking_factual_data_error": 0, "json_parse_ranking_error": 0, "index_ranking_error": 0}
+
+    step.step(sample, tracker)
+
+    assert sample["ranked_factual_data"] == ["air quality", "urban areas", "climate"]
+    assert [c.args[1] for c in llm.query_n.call_args_list] == [2, 2]
+    llm.query.assert_not_called()
+    assert tracker == {"ranking_factual_data_error": 0, "json_parse_ranking_error": 1, "index_ranking_error": 2}
+
+
+def test_rank_factual_data_candidates_async():
+    llm = AsyncMock(spec=AsyncLLM)
+    llm.query_n.return_value = ["OUTPUT: [5]", "OUTPUT: [1, 2, 0]"]
+    step = RankFactualDataStep(llm, candidates=2)
+    sample = {
+        "question": "What does the ozone gas?",
+        "with_brackets": {"A0": "Ozone affects [climate] and [air quality] in [urban areas]."},
+        "raw_factual_data": ["climate", "air quality", "urban areas"]
+    }
+    tracker = {"ranking_factual_data_error": 0, "json_parse_ranking_error": 0, "index_ranking_error": 0}
+
+    asyncio.run(step.step_async(sample, tracker))
+
+    assert sample["ranked_factual_data"] == ["air quality", "urban areas", "climate"]
+    assert llm.query_n.await_count == 1
+
+
+@pytest.mark.parametrize("kwargs", [{"candidates": 0}, {"candidates": 2, "early_stop": True}])
+def test_rank_factual_data_invalid_candidates(kwargs):
+    with pytest.raises(ValueError):
+        RankFactualDataStep(MagicMock(), **kwargs)
+
+
+@pytest.mark.parametrize(
+    "response, expected",
+    [
+        ("OUTPUT: [1, 2, 0, 3]\n\nI ranked the terms by relevance.", [1, 2, 0, 3]),
+        ("OUTPUT:\n```json\n[1, 2, 0, 3]\n```", [1, 2, 0, 3]),
+        ("OUTPUT: [1, 2, 1, 0, 3]", [1, 2, 0, 3]),
+        ("OUTPUT: [3, 1, 2]", [3, 1, 2, 0]),
+        ("OUTPUT: [3, 7, 1, 2, 0]", [3, 1, 2, 0]),
+        ("Draft OUTPUT: [0]\nOUTPUT: [2, 0, 1, 3]", [2, 0, 1, 3]),
+    ]
+)
+def test_repair_ranking(response, expected):
+    step = RankFactualDataStep(MagicMock(), repair=True)
+
+    assert step.repair_ranking(response, 4) == expected
+
+
+@pytest.mark.parametrize(
+    "response", ["[1, 2, 0, 3]", "OUTPUT: [3, 1]", "OUTPUT: [1, 2, 0", "OUTPUT: 1, 2, 0, 3", "OUTPUT: [7]"]
+)
+def test_repair_ranking_gives_up(response):
+    step = RankFactualDataStep(MagicMock(), repair=True)
+
+    assert step.repair_ranking(response, 4) is None
+
+
+def test_rank_factual_data_repairs_instead_of_retrying():
+    llm = MagicMock()
+    llm.query.return_value = "<thinking>...</thinking>\n\nOUTPUT: [1, 1, 2, 0]\nDone."
+    step = RankFactualDataStep(llm, repair=True)
+    sample = {
+        "question": "What does the ozone gas?",
+        "with_brackets": {"A0": "Ozone affects [climate] and [air quality] in [urban areas]."},
+        "raw_factual_data": ["climate", "air quality", "urban areas"]
+    }
+    tracker = {
+        "ranking_factual_data_error": 0, "json_parse_ranking_error": 0, "index_ranking_error": 0,
+        "repaired_ranking": 0,
+    }
+
+    step.step(sample, tracker)
+
+    assert llm.query.call_count == 1
+    assert sample["ranked_factual_data"] == ["air quality", "urban areas", "climate"]
+    assert tracker == {
+        "ranking_factual_data_error": 0, "json_parse_ranking_error": 0, "index_ranking_error": 0,
+        "repaired_ranking": 1,
+    }
+
+
+def test_rank_factual_data_invalid_max_missing():
+    with pytest.raises(ValueError):
+        RankFactualDataStep(MagicMock(), max_missing=1.5)
+
+
+def ozone_sample(terms):
+    return {
+        "question": "What does the ozone gas?",
+        "with_brackets": {"A0": " and ".join(f"[{t}]" for t in terms)},
+        "raw_factual_data": terms,
+    }
+
+
+def test_rank_factual_data_batches_samples_in_one_request():
+    llm = MagicMock()
+    llm.query.side_effect = [
+        "<thinking>...</thinking>\nOUTPUT 1: [1, 0]\n<thinking>...</thinking>\nOUTPUT 2: [0, 0]\n"
+        "<thinking>...</thinking>\nOUTPUT 3: [2, 0, 1]",
+        "OUTPUT: [0, 1]",
+    ]
+    step = RankFactualDataStep(llm, samples_per_request=4)
+    samples = [
+        ozone_sample(["climate", "air"]),
+        ozone_sample(["ozone", "sun"]),
+        ozone_sample(["rain", "snow", "hail"]),
+        {"question": None, "with_brackets": None, "raw_factual_data": None},
+    ]
+    tracker = {"ranking_factual_data_error": 0, "json_parse_ranking_error": 0, "index_ranking_error": 0}
+
+    step.step_batch(samples, tracker)
+
+    assert [s["ranked_factual_data"] for s in samples] == [
+        ["air", "climate"], ["ozone", "sun"], ["hail", "rain", "snow"], None
+    ]
+    batch_prompt = llm.query.call_args_list[0].kwargs["messages"][0]["content"]
+    assert batch_prompt.count(RankFactualDataStep.PROMPT) == 1
+    assert "Text 3:\nQuestion: What does the ozone gas?\n```\n[rain:0] and [snow:1] and [hail:2]\n```" in batch_prompt
+    assert llm.query.call_args_list[1].kwargs["messages"][0]["content"] == step.build_prompt(samples[1])
+    assert tracker["index_ranking_error"] == 1
+
+
+def test_rank_factual_data_batch_splits_usage():
+    llm = MagicMock()
+    llm.query.return_value = Completion("OUTPUT 1: [0]\nOUTPUT 2: [0]\nOUTPUT 3: [0]", prompt_tokens=10, cost=.3)
+    step = RankFactualDataStep(llm, samples_per_request=3)
+    samples = [ozone_sample([t]) for t in ["a", "b", "c"]]
+
+    step.step_batch(samples, {})
+
+    assert [s["usage"]["prompt_tokens"] for s in samples] == [4, 3, 3]
+    assert [s["usage"]["cost"] for s in samples] == pytest.approx([.1, .1, .1])
+
+
 def test_rank_factual_data_skips_when_missing_fields():
     llm_mock = MagicMock()
     step = RankFactualDataStep(llm=llm_mock)
@@ -176,5 +408,32 @@ def test_rank_factual_data_skips_when_missing_fields():
     llm_mock.query.assert_not_called()
 
 
+class ListReader(Reader):
+    def __init__(self, samples):
+        self._samples = samples
+
+    def samples(self):
+        return self._samples
+
+
+def test_rank_factual_data_failure_does_not_rerun_other_samples():
+    def query(messages):
+        if "[hail:0]" in messages[0]["content"]:
+            raise RuntimeError("malformed sample")
+        return "OUTPUT: [0]"
+
+    llm = MagicMock()
+    llm.query.side_effect = query
+    step = RankFactualDataStep(llm)
+    pipeline = Pipeline(with_progress=False, batch_size=4, isolate_failures=True).with_step(step)
+
+    samples, tracker = pipeline.run(ListReader([ozone_sample([term]) for term in ["rain", "snow", "hail", "sun"]]))
+
+    assert not step.batched and RankFactualDataStep(llm, samples_per_request=2).batched
+    assert llm.query.call_count == 4
+    assert [s.get("terminated_at") for s in samples] == [None, None, "RankFactualDataStep", None]
+    assert tracker["failed_samples"] == 1
+
+
 if __name__ == "__main__":
     unittest.main()
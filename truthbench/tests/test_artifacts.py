@@ -0,0 +1,124 @@
+import asyncio
+import unittest
+
+import pytest
+
+from truthbench.artifacts import ArtifactStore
+from truthbench.llms.cache import CachedLLM, ResponseCache
+from truthbench.llms.resilient import ResilientLLM
+from truthbench.pipeline import Step, Pipeline, Reader, LLM
+
+
+class ListReader(Reader):
+    def __init__(self, samples):
+        self._samples = samples
+
+    def samples(self):
+        return [dict(s) for s in self._samples]
+
+
+class SuffixStep(Step):
+    def __init__(self, source, target, suffix, counter):
+        super().__init__(
+            required_fields=frozenset({source}), counters=frozenset({counter}), produced_fields=frozenset({target})
+        )
+        self.source = source
+        self.target = target
+        self.suffix = suffix
+        self.counter = counter
+
+    def step(self, sample, tracker):
+        tracker[self.counter] += 1
+        sample[self.target] = None if sample[self.source] == "drop" else sample[self.source] + self.suffix
+
+
+class EchoLLM(LLM):
+    model = "echo-1"
+
+    def query(self, messages):
+        return messages[-1]["content"]
+
+
+class LLMStep(SuffixStep):
+    def __init__(self, llm):
+        super().__init__("a", "b", "!", "calls")
+        self._llm = llm
+
+
+def pipeline(store, second_suffix="!"):
+    return (
+        Pipeline(with_progress=False, input_fields={"question"}, artifacts=store)
+        .with_step(SuffixStep("question", "first", "?", "first_calls"))
+        .with_step(SuffixStep("first", "second", second_suffix, "second_calls"))
+    )
+
+
+def test_artifact_store_round_trip(tmp_path):
+    store = ArtifactStore(tmp_path / "artifacts.sqlite3")
+    key = ArtifactStore.key("fingerprint", {"a": 1, "b": 2}, ["a"])
+
+    assert store.get(key) is None
+    store.put(key, {"c": [1, 2]})
+
+    assert ArtifactStore(tmp_path / "artifacts.sqlite3").get(key) == {"c": [1, 2]}
+    assert key == ArtifactStore.key("fingerprint", {"a": 1, "b": 3}, ["a"])
+    assert key != ArtifactStore.key("fingerprint", {"a": 2, "b": 2}, ["a"])
+    assert len(store) == 1
+
+
+def test_step_fingerprint_depends_on_parameters_and_model():
+    step = SuffixStep("a", "b", "!", "calls")
+
+    assert step.fingerprint() == SuffixStep("a", "b", "!", "calls").fingerprint()
+    assert step.fingerprint() != SuffixStep("a", "b", "?", "calls").fingerprint()
+
+    # Wrappers do not change the responses of the model
+    assert LLMStep(EchoLLM()).fingerprint() == LLMStep(ResilientLLM(EchoLLM())).fingerprint()
+    assert LLMStep(EchoLLM()).config()["_llm"] == {"llm": "echo-1"}
+
+
+def test_step_fingerprint_sees_through_cache(tmp_path):
+    class OtherLLM(EchoLLM):
+        model = "echo-2"
+
+    cache = ResponseCache(tmp_path / "llm_cache.sqlite3")
+
+    assert LLMStep(CachedLLM(EchoLLM(), cache)).fingerprint() == LLMStep(EchoLLM()).fingerprint()
+    assert LLMStep(CachedLLM(EchoLLM(), cache)).fingerprint() != LLMStep(CachedLLM(OtherLLM(), cache)).fingerprint()
+
+
+def test_rerun_reuses_unchanged_steps(tmp_path):
+    store = ArtifactStore(tmp_path / "artifacts.sqlite3")
+    reader = ListReader([{"question": "q1"}, {"question": "q2"}])
+
+    first, tracker = pipeline(store).run(reader)
+    assert tracker == {"input_samples": 2, "reused_step_outputs": 0, "first_calls": 2, "second_calls": 2}
+
+    again, tracker = pipeline(store).run(reader)
+    assert again == first
+    assert tracker == {"input_samples": 2, "reused_step_outputs": 4, "first_calls": 0, "second_calls": 0}
+
+    # Only the changed step runs again
+    changed, tracker = pipeline(store, second_suffix="?!").run(reader)
+    assert [s["second"] for s in changed] == ["q1??!", "q2??!"]
+    assert tracker == {"input_samples": 2, "reused_step_outputs": 2, "first_calls": 0, "second_calls": 2}
+
+
+def test_terminated_samples_are_computed_again(tmp_path):
+    store = ArtifactStore(tmp_path / "artifacts.sqlite3")
+    reader = ListReader([{"question": "drop"}])
+
+    pipeline(store).run(reader)
+    processed, tracker = asyncio.run(pipeline(store).run_async(reader))
+
+    assert processed[0]["terminated_at"] == "SuffixStep_0"
+    assert tracker["first_calls"] == 1
+
+
+def test_artifacts_require_input_fields(tmp_path):
+    with pytest.raises(ValueError):
+        Pipeline(artifacts=ArtifactStore(tmp_path / "artifacts.sqlite3"))
+
+
+if __name__ == "__main__":
+    unittest.main()
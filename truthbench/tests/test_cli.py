@@ -0,0 +1,25 @@
+import sys
+import unittest
+
+import pytest
+
+from truthbench import cli
+
+
+def run_cli(monkeypatch, tmp_path, *args):
+    argv = ["truthbench", "--input-file", str(tmp_path / "input.json"), "--output-dir", str(tmp_path / "output")]
+    monkeypatch.setattr(sys, "argv", argv + list(args))
+    cli.main()
+
+
+@pytest.mark.parametrize("mode", [["--max-in-flight", "8"], ["--batch-api"]])
+def test_rank_samples_per_request_is_rejected_when_asynchronous(monkeypatch, tmp_path, capsys, mode):
+    with pytest.raises(SystemExit) as excinfo:
+        run_cli(monkeypatch, tmp_path, "--rank-samples-per-request", "4", *mode)
+
+    assert excinfo.value.code == 2
+    assert "--rank-samples-per-request" in capsys.readouterr().err
+
+
+if __name__ == "__main__":
+    unittest.main()
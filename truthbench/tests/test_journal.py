@@ -0,0 +1,71 @@
+import unittest
+
+import pytest
+
+from truthbench.journal import Journal
+from truthbench.pipeline import Pipeline
+from tests.test_pipeline import DummyStep, DummyReader
+
+
+def test_journal_append_and_entries(tmp_path):
+    journal = Journal(tmp_path / "out" / "journal.jsonl")
+
+    with journal:
+        journal.append({"foo": 1}, {"input_samples": 1})
+        journal.append({"foo": 2}, {"input_samples": 2})
+
+    assert list(journal.entries()) == [({"foo": 1}, {"input_samples": 1}), ({"foo": 2}, {"input_samples": 2})]
+
+
+def test_journal_append_requires_open(tmp_path):
+    with pytest.raises(RuntimeError):
+        Journal(tmp_path / "journal.jsonl").append({"foo": 1}, {})
+
+
+def test_journal_recover_drops_partial_line(tmp_path):
+    path = tmp_path / "journal.jsonl"
+    journal = Journal(path)
+    with journal:
+        journal.append({"foo": 1}, {"input_samples": 1})
+
+    with open(path, "a") as f:
+        f.write('{"sample": {"foo": 2}, "trac')  # killed while writing
+
+    assert journal.recover() == (1, {"input_samples": 1})
+
+    with journal:
+        journal.append({"foo": 2}, {"input_samples": 2})
+
+    assert [s for s, _ in journal.entries()] == [{"foo": 1}, {"foo": 2}]
+
+
+def test_journal_recover_missing_file(tmp_path):
+    assert Journal(tmp_path / "journal.jsonl").recover() == (0, {})
+
+
+def test_resume_interrupted_stream(tmp_path):
+    journal = Journal(tmp_path / "journal.jsonl")
+    step = DummyStep(required_fields=frozenset({"foo"}), counters=frozenset({"count"}))
+    pipeline = Pipeline(with_progress=False).with_step(step)
+    reader = DummyReader([{"foo": i} for i in range(5)])
+
+    with journal:
+        for sample, tracker in pipeline.stream(reader):
+            journal.append(sample, tracker)
+            if sample["foo"] == 2:
+                break  # interrupted
+
+    done, tracker = journal.recover()
+    resumed = []
+    with journal:
+        for sample, tracker in pipeline.stream(reader, skip=done, tracker=tracker):
+            journal.append(sample, tracker)
+            resumed.append(sample["foo"])
+
+    assert resumed == [3, 4]
+    assert tracker == {"input_samples": 5, "count": 5}
+    assert [s["foo"] for s, _ in journal.entries()] == list(range(5))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -17,6 +17,23 @@ def test_report_to_dataset():
     assert len(dataset.questions) == 1
 
 
+def test_sample_without_answers_is_invalid():
+    from truthbench.models import Sample
+    assert not Sample(question="q?", ground_truth="gt", answers=None).is_valid()
+
+
+def test_failed_sample_is_not_in_dataset():
+    from truthbench.models import Sample, SampleError
+    error = SampleError(step="NoiseStep_5", type="ValueError", message="", traceback="")
+    samples = [
+        Sample(question="q1?", ground_truth="gt1", answers={"A0": "a", "A1": "b"}, error=error),
+        Sample(question="q2?", ground_truth="gt2", answers={"A0": "a", "A1": "b"}, terminated_at="NoiseStep_5"),
+        Sample(question="q3?", ground_truth="gt3", answers={"A0": "a", "A1": "b"}),
+    ]
+    dataset = Report(report=Tracker(), questions=samples).to_dataset()
+    assert [item.question for item in dataset.questions] == ["q3?"]
+
+
 def test_report_backward_compatibility():
     REPORT_PATH = pathlib.Path(__file__).parent.parent.parent / "datasets" / "evaluation" / "report.json"
 
@@ -1,8 +1,17 @@
+import asyncio
+import collections
+import os
+import pickle
+import threading
+import time
 import unittest
 
 import pytest
 
-from truthbench.pipeline import StrictTracker, Step, Reader, Pipeline
+from truthbench.pipeline import (
+    StrictTracker, Step, Reader, Pipeline, Sweep, LLM, AsyncLLM, StepMetrics, Completion, price, query, aquery,
+    query_stream, aquery_stream, truncate, query_n, aquery_n, is_retry
+)
 
 
 def test_stricttracker_initialization_and_access():
@@ -107,5 +116,792 @@ def test_pipeline_run_multiple_steps_and_counters():
     assert tracker["tagged"] == 3
 
 
+def test_stricttracker_merge():
+    tracker = StrictTracker({"a", "b"})
+    tracker["a"] = 1
+
+    tracker.merge({"a": 2, "b": 3})
+
+    assert tracker == {"a": 3, "b": 3}
+
+    with pytest.raises(KeyError):
+        tracker.merge({"c": 1})
+
+
+def test_pipeline_run_concurrently_preserves_order_and_counters():
+    barrier = threading.Barrier(4, timeout=5)
+
+    class SlowStep(Step):
+        def __init__(self):
+            super().__init__(required_fields=frozenset({"foo"}), counters=frozenset({"slow"}))
+
+        def step(self, sample, tracker):
+            # Only passes if 4 samples are in flight at the same time
+            barrier.wait()
+            time.sleep(0.01 * (4 - sample["foo"] % 4))
+            sample["thread"] = threading.get_ident()
+            tracker["slow"] += 1
+
+    pipeline = Pipeline(with_progress=False, max_workers=4).with_step(SlowStep())
+    reader = DummyReader([{"foo": i} for i in range(8)])
+
+    processed_samples, tracker = pipeline.run(reader)
+
+    assert [s["foo"] for s in processed_samples] == list(range(8))
+    assert len({s["thread"] for s in processed_samples}) > 1
+    assert tracker == {"input_samples": 8, "slow": 8}
+
+
+def test_pipeline_run_concurrently_propagates_errors():
+    step = DummyStep(required_fields={"foo"})
+    pipeline = Pipeline(with_progress=False, max_workers=2).with_step(step)
+
+    with pytest.raises(ValueError):
+        pipeline.run(DummyReader([{"foo": 1}, {"bar": 1}, {"foo": 2}]))
+
+
+def test_pipeline_invalid_max_workers():
+    with pytest.raises(ValueError):
+        Pipeline(max_workers=0)
+
+
+def test_pipeline_stream_is_lazy():
+    pulled = []
+
+    class LazyReader(Reader):
+        def samples(self):
+            raise AssertionError("stream must not load all samples")
+
+        def stream(self):
+            for i in range(100):
+                pulled.append(i)
+                yield {"foo": i}
+
+    step = DummyStep(required_fields=frozenset({"foo"}), counters=frozenset({"count"}))
+    pipeline = Pipeline(with_progress=False, max_workers=2).with_step(step)
+
+    stream = pipeline.stream(LazyReader())
+    sample, tracker = next(stream)
+
+    assert sample == {"foo": 0, "processed": True}
+    assert tracker == {"input_samples": 1, "count": 1}
+    assert len(pulled) <= 4
+
+    remaining = [s["foo"] for s, _ in stream]
+
+    assert remaining == list(range(1, 100))
+    assert tracker == {"input_samples": 100, "count": 100}
+
+
+def test_reader_stream_defaults_to_samples():
+    reader = DummyReader([{"foo": 1}, {"foo": 2}])
+
+    assert list(reader.stream()) == [{"foo": 1}, {"foo": 2}]
+
+
+def test_pipeline_run_in_micro_batches():
+    class BatchStep(Step):
+        def __init__(self):
+            super().__init__(required_fields=frozenset({"foo"}), counters=frozenset({"batches"}))
+            self.sizes = []
+
+        def step(self, sample, tracker):
+            raise AssertionError("step_batch must be used")
+
+        def step_batch(self, samples, tracker):
+            self.sizes.append(len(samples))
+            tracker["batches"] += 1
+            for sample in samples:
+                sample["batched"] = True
+
+    batch_step = BatchStep()
+    pipeline = (
+        Pipeline(with_progress=False, max_workers=2, batch_size=3)
+        .with_step(batch_step)
+        .with_step(DummyStep(required_fields=frozenset({"batched"}), counters=frozenset({"count"})))
+    )
+
+    processed_samples, tracker = pipeline.run(DummyReader([{"foo": i} for i in range(8)]))
+
+    assert [s["foo"] for s in processed_samples] == list(range(8))
+    assert all(s["processed"] for s in processed_samples)
+    assert sorted(batch_step.sizes) == [2, 3, 3]
+    assert tracker == {"input_samples": 8, "batches": 3, "count": 8}
+
+
+def test_pipeline_invalid_batch_size():
+    with pytest.raises(ValueError):
+        Pipeline(batch_size=0)
+
+
+def test_pipeline_run_staged_overlaps_steps():
+    second_started = threading.Event()
+
+    class FirstStep(Step):
+        def __init__(self):
+            super().__init__(required_fields=frozenset({"foo"}), counters=frozenset({"first"}))
+
+        def step(self, sample, tracker):
+            if sample["foo"] == 1:
+                # Only passes if the second step is processing sample 0 at the same time
+                sample["overlapped"] = second_started.wait(timeout=5)
+            tracker["first"] += 1
+
+    class SecondStep(Step):
+        def __init__(self):
+            super().__init__(required_fields=frozenset({"foo"}), counters=frozenset({"second"}))
+
+        def step(self, sample, tracker):
+            second_started.set()
+            time.sleep(0.01)
+            tracker["second"] += 1
+
+    pipeline = Pipeline(with_progress=False, staged=True, queue_size=1).with_step(FirstStep()).with_step(SecondStep())
+
+    processed_samples, tracker = pipeline.run(DummyReader([{"foo": i} for i in range(6)]))
+
+    assert [s["foo"] for s in processed_samples] == list(range(6))
+    assert processed_samples[1]["overlapped"]
+    assert tracker == {"input_samples": 6, "first": 6, "second": 6}
+    assert set(pipeline.stage_stats) == {"FirstStep", "SecondStep"}
+    assert pipeline.stage_stats["SecondStep"]["processed"] == 6
+    assert 0 < pipeline.stage_stats["SecondStep"]["utilization"] <= 1
+    assert pipeline.stage_stats["SecondStep"]["max_queue_depth"] <= 1
+
+
+def test_pipeline_run_staged_propagates_errors():
+    pipeline = (
+        Pipeline(with_progress=False, staged=True)
+        .with_step(DummyStep())
+        .with_step(DummyStep(required_fields={"foo"}))
+    )
+
+    with pytest.raises(ValueError, match="requires"):
+        pipeline.run(DummyReader([{"foo": 1}] * 10 + [{"bar": 1}] + [{"foo": 1}] * 10))
+
+
+def test_pipeline_staged_requires_single_worker():
+    with pytest.raises(ValueError):
+        Pipeline(staged=True, max_workers=2)
+
+
+def test_pipeline_step_names():
+    pipeline = Pipeline().with_step(DummyStep()).with_step(DummyStep()).with_step(OtherStep())
+
+    assert pipeline.step_names() == ["DummyStep_0", "DummyStep_1", "OtherStep"]
+
+
+class OtherStep(DummyStep):
+    pass
+
+
+def test_pipeline_run_async():
+    in_flight = []
+    peak = []
+
+    class AsyncStep(Step):
+        def __init__(self):
+            super().__init__(required_fields=frozenset({"foo"}), counters=frozenset({"awaited"}))
+
+        def step(self, sample, tracker):
+            raise AssertionError("run_async must use step_async")
+
+        async def step_async(self, sample, tracker):
+            in_flight.append(sample["foo"])
+            peak.append(len(in_flight))
+            await asyncio.sleep(0.01 * (sample["foo"] % 3))
+            in_flight.remove(sample["foo"])
+            sample["awaited"] = True
+            tracker["awaited"] += 1
+
+    pipeline = (
+        Pipeline(with_progress=False)
+        .with_step(AsyncStep())
+        .with_step(DummyStep(required_fields=frozenset({"awaited"}), counters=frozenset({"count"})))
+    )
+    reader = DummyReader([{"foo": i} for i in range(10)])
+
+    processed_samples, tracker = asyncio.run(pipeline.run_async(reader, max_in_flight=3))
+
+    assert [s["foo"] for s in processed_samples] == list(range(10))
+    assert all(s["processed"] for s in processed_samples)
+    assert max(peak) == 3
+    assert tracker == {"input_samples": 10, "awaited": 10, "count": 10}
+
+
+def test_pipeline_run_async_propagates_errors():
+    pipeline = Pipeline(with_progress=False).with_step(DummyStep(required_fields={"foo"}))
+
+    with pytest.raises(ValueError):
+        asyncio.run(pipeline.run_async(DummyReader([{"foo": 1}, {"bar": 1}])))
+
+
+class ProcessStep(Step):
+    def __init__(self):
+        super().__init__(required_fields=frozenset({"foo"}), counters=frozenset({"cpu"}))
+        self.ready = False
+
+    def setup(self):
+        self.ready = True
+
+    def step(self, sample, tracker):
+        assert self.ready, "setup must run in the worker"
+        sample["pid"] = os.getpid()
+        sample["square"] = sample["foo"] ** 2
+        tracker["cpu"] += 1
+
+
+def test_pipeline_run_step_in_processes():
+    pipeline = (
+        Pipeline(with_progress=False, batch_size=4)
+        .with_step(ProcessStep(), processes=2)
+        .with_step(DummyStep(required_fields=frozenset({"square"}), counters=frozenset({"count"})))
+    )
+
+    processed_samples, tracker = pipeline.run(DummyReader([{"foo": i} for i in range(10)]))
+
+    assert [s["square"] for s in processed_samples] == [i ** 2 for i in range(10)]
+    assert all(s["processed"] for s in processed_samples)
+    assert os.getpid() not in {s["pid"] for s in processed_samples}
+    assert tracker == {"input_samples": 10, "cpu": 10, "count": 10}
+
+
+def test_pipeline_run_async_step_in_processes():
+    pipeline = Pipeline(with_progress=False).with_step(ProcessStep(), processes=1)
+
+    processed_samples, tracker = asyncio.run(pipeline.run_async(DummyReader([{"foo": i} for i in range(3)])))
+
+    assert [s["square"] for s in processed_samples] == [0, 1, 4]
+    assert tracker == {"input_samples": 3, "cpu": 3}
+
+
+def test_pipeline_invalid_processes():
+    with pytest.raises(ValueError):
+        Pipeline().with_step(DummyStep(), processes=-1)
+
+
+class EchoLLM(LLM):
+    def query(self, messages):
+        return messages[-1]["content"]
+
+
+class RetryingStep(Step):
+    def __init__(self, attempts):
+        super().__init__(required_fields=frozenset({"foo"}))
+        self._llm = EchoLLM()
+        self._attempts = attempts
+
+    def step(self, sample, tracker):
+        for attempt in range(self._attempts):
+            sample["echo"] = query(self._llm, [{"role": "user", "content": str(sample["foo"])}], retry=attempt > 0)
+
+    async def step_async(self, sample, tracker):
+        for attempt in range(self._attempts):
+            sample["echo"] = await aquery(self._llm, [{"role": "user", "content": str(sample["foo"])}], retry=attempt > 0)
+
+
+def test_pipeline_step_metrics():
+    pipeline = (
+        Pipeline(with_progress=False, max_workers=2, batch_size=2)
+        .with_step(RetryingStep(attempts=3))
+        .with_step(DummyStep())
+    )
+
+    processed_samples, _ = pipeline.run(DummyReader([{"foo": i} for i in range(5)]))
+
+    assert [s["echo"] for s in processed_samples] == [str(i) for i in range(5)]
+    metrics = pipeline.step_metrics
+    assert set(metrics) == {"RetryingStep", "DummyStep"}
+    assert metrics["RetryingStep"]["calls"] == 3
+    assert metrics["RetryingStep"]["samples"] == 5
+    assert metrics["RetryingStep"]["llm_calls"] == 15
+    assert metrics["RetryingStep"]["llm_retries"] == 10
+    assert metrics["DummyStep"]["llm_calls"] == 0
+    assert 0 < metrics["RetryingStep"]["p50_latency"] <= metrics["RetryingStep"]["p99_latency"]
+    assert metrics["RetryingStep"]["wall_time"] >= metrics["RetryingStep"]["p99_latency"]
+
+
+def test_pipeline_step_metrics_async():
+    pipeline = Pipeline(with_progress=False).with_step(RetryingStep(attempts=2))
+
+    asyncio.run(pipeline.run_async(DummyReader([{"foo": i} for i in range(4)]), max_in_flight=2))
+
+    metrics = pipeline.step_metrics["RetryingStep"]
+    assert metrics["calls"] == 4
+    assert metrics["llm_calls"] == 8
+    assert metrics["llm_retries"] == 4
+
+
+def test_pipeline_step_metrics_from_processes():
+    pipeline = Pipeline(with_progress=False, batch_size=4).with_step(RetryingStep(attempts=2), processes=2)
+
+    pipeline.run(DummyReader([{"foo": i} for i in range(4)]))
+
+    metrics = pipeline.step_metrics["RetryingStep"]
+    assert metrics["calls"] == 1
+    assert metrics["samples"] == 4
+    assert metrics["llm_calls"] == 8
+    assert metrics["llm_retries"] == 4
+
+
+def test_step_metrics_percentile():
+    values = [float(i) for i in range(1, 101)]
+
+    assert StepMetrics.percentile(values, 50) == 50.
+    assert StepMetrics.percentile(values, 95) == 95.
+    assert StepMetrics.percentile(values, 99) == 99.
+    assert StepMetrics.percentile([3.], 99) == 3.
+    assert StepMetrics.percentile([], 50) == 0.
+
+
+def test_completion_is_a_string_with_usage():
+    completion = Completion(" text", prompt_tokens=10, completion_tokens=5, cached_tokens=2, cost=.5)
+
+    assert completion == " text" and completion.strip() == "text"
+    assert completion.usage() == {"prompt_tokens": 10, "completion_tokens": 5, "cached_tokens": 2, "cost": .5}
+    assert pickle.loads(pickle.dumps(completion)).usage() == completion.usage()
+
+
+def test_price():
+    prices = {"prompt": 2., "completion": 10., "cached": 1.}
+
+    assert price(prices, 1_000_000, 100_000, 500_000) == pytest.approx(1. + .5 + 1.)
+    assert price({"prompt": 2., "completion": 10.}, 1_000_000, 0, 500_000) == pytest.approx(2.)
+    assert price(None, 1_000_000, 1_000_000, 0) == 0.
+
+
+class UsageLLM(LLM):
+    def query(self, messages):
+        content = messages[-1]["content"]
+        return Completion(content, prompt_tokens=len(content), completion_tokens=1, cost=.25)
+
+
+class UsageStep(RetryingStep):
+    def __init__(self, attempts):
+        super().__init__(attempts)
+        self._llm = UsageLLM()
+
+
+def test_pipeline_accounts_usage_per_step_and_sample():
+    pipeline = (
+        Pipeline(with_progress=False, max_workers=2, batch_size=2)
+        .with_step(UsageStep(attempts=2))
+        .with_step(RetryingStep(attempts=1))
+    )
+
+    processed_samples, _ = pipeline.run(DummyReader([{"foo": i * 10} for i in range(4)]))
+
+    assert [s["usage"] for s in processed_samples] == [
+        {"prompt_tokens": 2 * len(str(i * 10)), "completion_tokens": 2, "cached_tokens": 0, "cost": .5}
+        for i in range(4)
+    ]
+    metrics = pipeline.step_metrics
+    assert metrics["UsageStep"]["prompt_tokens"] == 2 * (1 + 2 + 2 + 2)
+    assert metrics["UsageStep"]["completion_tokens"] == 8
+    assert metrics["UsageStep"]["cost"] == pytest.approx(2.)
+    assert metrics["RetryingStep"]["prompt_tokens"] == 0
+
+
+def test_pipeline_accounts_usage_async_and_from_processes():
+    pipeline = Pipeline(with_progress=False).with_step(UsageStep(attempts=1))
+    processed_samples, _ = asyncio.run(pipeline.run_async(DummyReader([{"foo": i} for i in range(3)])))
+
+    assert [s["usage"]["completion_tokens"] for s in processed_samples] == [1, 1, 1]
+    assert pipeline.step_metrics["UsageStep"]["completion_tokens"] == 3
+
+    pipeline = Pipeline(with_progress=False, batch_size=2).with_step(UsageStep(attempts=1), processes=2)
+    processed_samples, _ = pipeline.run(DummyReader([{"foo": i} for i in range(4)]))
+
+    assert [s["usage"]["cost"] for s in processed_samples] == [.25] * 4
+    assert pipeline.step_metrics["UsageStep"]["cost"] == pytest.approx(1.)
+
+
+class ChunkLLM(LLM):
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.sent = 0
+        self.closed = False
+
+    def query(self, messages):
+        return "".join(self.chunks)
+
+    def stream(self, messages, stop=None):
+        try:
+            for chunk in self.chunks:
+                self.sent += 1
+                yield Completion(chunk, completion_tokens=1)
+        finally:
+            self.closed = True
+
+
+def test_query_stream_stops_once_parsed():
+    llm = ChunkLLM(["<a>", "x", "</a>", "chatter", "more chatter"])
+
+    response = query_stream(llm, [{"role": "user", "content": "q"}], until=lambda text: "</a>" in text)
+
+    assert response == "<a>x</a>"
+    assert response.completion_tokens == 3
+    assert llm.sent == 3 and llm.closed
+
+
+def test_query_stream_reads_whole_response_by_default():
+    llm = ChunkLLM(["a", "b"])
+
+    assert query_stream(llm, [{"role": "user", "content": "q"}]) == "ab"
+    assert llm.sent == 2
+
+
+def test_default_stream_truncates_at_stop_sequences():
+    llm = EchoLLM()
+
+    assert query_stream(llm, [{"role": "user", "content": "<o>x</o> chatter"}], stop=["</o>", "<x>"]) == "<o>x"
+    assert query_stream(llm, [{"role": "user", "content": "abc"}], stop=["</o>"]) == "abc"
+
+
+def test_truncate_keeps_usage():
+    response = truncate(Completion("ab.cd", completion_tokens=4), ["."])
+
+    assert response == "ab"
+    assert response.completion_tokens == 4
+
+
+def test_aquery_stream():
+    class AsyncChunkLLM(AsyncLLM):
+        async def query(self, messages):
+            return "unused"
+
+        async def stream(self, messages, stop=None):
+            for chunk in ["<a>", "x", "</a>", "chatter"]:
+                yield chunk
+
+    def done(text):
+        return "</a>" in text
+
+    messages = [{"role": "user", "content": "q"}]
+    assert asyncio.run(aquery_stream(AsyncChunkLLM(), messages, until=done)) == "<a>x</a>"
+    assert asyncio.run(aquery_stream(ChunkLLM(["<a>", "</a>", "chatter"]), messages, until=done)) == "<a></a>"
+
+
+class SlowLLM(LLM):
+    def __init__(self):
+        self.retries = []
+
+    def query(self, messages):
+        self.retries.append(is_retry())
+        time.sleep(.1)
+        return Completion("response", completion_tokens=2)
+
+
+class NBestStep(Step):
+    def __init__(self, llm):
+        super().__init__(required_fields=frozenset({"foo"}))
+        self._llm = llm
+
+    def step(self, sample, tracker):
+        sample["candidates"] = query_n(self._llm, [{"role": "user", "content": "q"}], 3, retry=True)
+
+
+def test_query_n_sends_concurrent_requests_by_default():
+    llm = SlowLLM()
+    pipeline = Pipeline(with_progress=False).with_step(NBestStep(llm))
+
+    start = time.perf_counter()
+    processed_samples, _ = pipeline.run(DummyReader([{"foo": 1}]))
+
+    assert time.perf_counter() - start < .25
+    assert processed_samples[0]["candidates"] == ["response"] * 3
+    assert processed_samples[0]["usage"]["completion_tokens"] == 6
+    assert llm.retries == [True] * 3
+    assert pipeline.step_metrics["NBestStep"]["llm_calls"] == 1
+
+
+def test_aquery_n():
+    class AsyncEchoLLM(AsyncLLM):
+        async def query(self, messages):
+            return messages[-1]["content"]
+
+    messages = [{"role": "user", "content": "q"}]
+    assert asyncio.run(aquery_n(AsyncEchoLLM(), messages, 2)) == ["q", "q"]
+    assert asyncio.run(aquery_n(EchoLLM(), messages, 2)) == ["q", "q"]
+
+
+class ProducingStep(Step):
+    def __init__(self, produced, fail=(), required_fields=frozenset()):
+        super().__init__(required_fields, counters=frozenset({"calls"}), produced_fields=frozenset({produced}))
+        self._produced = produced
+        self._fail = fail
+
+    def step(self, sample, tracker):
+        tracker["calls"] += 1
+        sample[self._produced] = None if sample["foo"] in self._fail else sample["foo"]
+
+
+def test_pipeline_checks_dependencies_when_steps_are_added():
+    pipeline = Pipeline(with_progress=False, input_fields={"foo"}).with_step(ProducingStep("bar"))
+    pipeline.with_step(ProducingStep("baz", required_fields=frozenset({"foo", "bar"})))
+
+    with pytest.raises(ValueError) as excinfo:
+        pipeline.with_step(ProducingStep("qux", required_fields=frozenset({"bar", "missing"})))
+    assert "['missing'] are neither input fields nor produced by a previous step" in str(excinfo.value)
+
+
+@pytest.mark.parametrize("asynchronous", [False, True])
+def test_pipeline_skips_terminated_samples(asynchronous):
+    pipeline = (
+        Pipeline(with_progress=False, batch_size=3, input_fields={"foo"})
+        .with_step(ProducingStep("bar", fail={2}))
+        .with_step(ProducingStep("baz", required_fields=frozenset({"bar"}), fail={3}))
+        .with_step(DummyStep(required_fields=frozenset({"baz"})))
+    )
+    reader = DummyReader([{"foo": 1}, {"foo": 2}, {"foo": 3}])
+
+    processed_samples, tracker = asyncio.run(pipeline.run_async(reader)) if asynchronous else pipeline.run(reader)
+
+    assert [s.get("terminated_at") for s in processed_samples] == [None, "ProducingStep_0", "ProducingStep_1"]
+    assert [s.get("processed") for s in processed_samples] == [True, None, None]
+    assert "baz" not in processed_samples[1]
+    assert tracker["calls"] == 5
+
+
+class FailingStep(Step):
+    def __init__(self):
+        super().__init__(required_fields=frozenset({"foo"}), counters=frozenset({"ok"}))
+
+    def step(self, sample, tracker):
+        tracker["ok"] += 1
+        assert sample["foo"] != 2, "malformed sample"
+        sample["done"] = True
+
+
+@pytest.mark.parametrize("processes", [0, 2])
+def test_pipeline_isolates_failed_samples(processes):
+    pipeline = (
+        Pipeline(with_progress=False, batch_size=4, isolate_failures=True)
+        .with_step(FailingStep(), processes=processes)
+        .with_step(DummyStep(counters=frozenset({"count"})))
+    )
+
+    processed_samples, tracker = pipeline.run(DummyReader([{"foo": i} for i in range(5)]))
+
+    failed = processed_samples[2]
+    assert failed["terminated_at"] == "FailingStep"
+    assert failed["error"]["step"] == "FailingStep"
+    assert failed["error"]["type"] == "AssertionError"
+    assert "malformed sample" in failed["error"]["traceback"]
+    assert "processed" not in failed
+    assert all(s["done"] and s["processed"] for i, s in enumerate(processed_samples) if i != 2)
+    # Counters of the failed micro-batch attempt are discarded
+    assert tracker == {"input_samples": 5, "failed_samples": 1, "ok": 4, "count": 4}
+
+
+class CountingFailingStep(FailingStep):
+    def __init__(self):
+        super().__init__()
+        self.calls = collections.Counter()
+
+    def step(self, sample, tracker):
+        self.calls[sample["foo"]] += 1
+        super().step(sample, tracker)
+
+
+def test_pipeline_isolated_failures_do_not_rerun_other_samples():
+    step = CountingFailingStep()
+    pipeline = Pipeline(with_progress=False, batch_size=4, isolate_failures=True).with_step(step)
+
+    pipeline.run(DummyReader([{"foo": i} for i in range(4)]))
+
+    assert step.calls == {0: 1, 1: 1, 2: 1, 3: 1}
+
+
+class BatchFailingStep(FailingStep):
+    def step_batch(self, samples, tracker):
+        for sample in samples:
+            sample["partial"] = sample.get("partial", 0) + 1
+            self.step(sample, tracker)
+
+
+def test_pipeline_failed_micro_batch_is_restored_before_rerun():
+    pipeline = Pipeline(with_progress=False, batch_size=4, isolate_failures=True).with_step(BatchFailingStep())
+
+    processed_samples, tracker = pipeline.run(DummyReader([{"foo": i} for i in range(4)]))
+
+    assert [s["partial"] for s in processed_samples] == [1, 1, 1, 1]
+    assert tracker == {"input_samples": 4, "failed_samples": 1, "ok": 3}
+
+
+def test_pipeline_run_async_isolates_failed_samples():
+    pipeline = Pipeline(with_progress=False, isolate_failures=True).with_step(FailingStep())
+
+    processed_samples, tracker = asyncio.run(pipeline.run_async(DummyReader([{"foo": i} for i in range(4)])))
+
+    assert [s.get("terminated_at") for s in processed_samples] == [None, None, "FailingStep", None]
+    assert tracker["failed_samples"] == 1
+
+
+def test_pipeline_failures_abort_run_unless_isolated():
+    pipeline = Pipeline(with_progress=False).with_step(FailingStep())
+
+    with pytest.raises(AssertionError, match="malformed sample"):
+        pipeline.run(DummyReader([{"foo": i} for i in range(4)]))
+
+
+class MeetingStep(Step):
+    def __init__(self, produced, barrier, required_fields=frozenset({"foo"})):
+        super().__init__(required_fields, counters=frozenset({"met"}), produced_fields=frozenset({produced}))
+        self._produced = produced
+        self._barrier = barrier
+
+    def step(self, sample, tracker):
+        # Both independent steps must be running at the same time to get past the barrier
+        self._barrier.wait()
+        tracker["met"] += 1
+        sample[self._produced] = sample["foo"]
+
+
+@pytest.mark.parametrize("asynchronous", [False, True])
+def test_pipeline_runs_independent_steps_concurrently(asynchronous):
+    barrier = threading.Barrier(2, timeout=5)
+    pipeline = (
+        Pipeline(with_progress=False, batch_size=2, input_fields={"foo"}, parallel_steps=True)
+        .with_step(MeetingStep("bar", barrier))
+        .with_step(MeetingStep("baz", barrier))
+        .with_step(ProducingStep("qux", required_fields=frozenset({"bar", "baz"})))
+    )
+    reader = DummyReader([{"foo": 1}, {"foo": 2}])
+
+    processed_samples, tracker = asyncio.run(pipeline.run_async(reader)) if asynchronous else pipeline.run(reader)
+
+    assert pipeline.step_dependencies() == {
+        "MeetingStep_0": [], "MeetingStep_1": [], "ProducingStep": ["MeetingStep_0", "MeetingStep_1"]
+    }
+    assert [s["qux"] for s in processed_samples] == [1, 2]
+    assert tracker == {"input_samples": 2, "met": 4, "calls": 2}
+
+
+def test_pipeline_parallel_steps_apply_outcomes_in_order():
+    pipeline = (
+        Pipeline(with_progress=False, input_fields={"foo"}, parallel_steps=True)
+        .with_step(ProducingStep("bar", fail={1}))
+        .with_step(ProducingStep("baz", fail={1}))
+    )
+
+    processed_samples, _ = pipeline.run(DummyReader([{"foo": 1}]))
+
+    assert processed_samples[0]["terminated_at"] == "ProducingStep_0"
+
+
+@pytest.mark.parametrize("asynchronous", [False, True])
+def test_pipeline_parallel_steps_withdraw_outcomes_of_terminated_samples(asynchronous):
+    def run(parallel_steps):
+        pipeline = (
+            Pipeline(with_progress=False, batch_size=3, input_fields={"foo"}, parallel_steps=parallel_steps)
+            .with_step(ProducingStep("bar", fail={2}))
+            .with_step(ProducingStep("baz"))
+        )
+        reader = DummyReader([{"foo": 1}, {"foo": 2}, {"foo": 3}])
+        return asyncio.run(pipeline.run_async(reader)) if asynchronous else pipeline.run(reader)
+
+    assert run(parallel_steps=True) == run(parallel_steps=False)
+    processed_samples, tracker = run(parallel_steps=True)
+    assert "baz" not in processed_samples[1]
+    assert tracker["calls"] == 5
+
+
+class BatchProducingStep(ProducingStep):
+    def step_batch(self, samples, tracker):
+        # Stands for a step preparing the whole micro-batch at once, e.g., parsing all the texts in one call
+        super().step_batch(samples, tracker)
+
+
+def test_pipeline_parallel_steps_withdraw_counters_of_batched_steps_with_isolated_failures():
+    def run(parallel_steps):
+        pipeline = (
+            Pipeline(
+                with_progress=False, batch_size=3, input_fields={"foo"}, isolate_failures=True,
+                parallel_steps=parallel_steps
+            )
+            .with_step(ProducingStep("bar", fail={2}))
+            .with_step(BatchProducingStep("baz"))
+        )
+        return pipeline.run(DummyReader([{"foo": 1}, {"foo": 2}, {"foo": 3}]))
+
+    assert BatchProducingStep("baz").batched
+    assert run(parallel_steps=True) == run(parallel_steps=False)
+    assert run(parallel_steps=True)[1]["calls"] == 5
+
+
+def test_truth_pipeline_steps_dependencies():
+    from truthbench.steps.blacklist import BlacklistItemsFromQuestionStep
+    from truthbench.steps.counter import CounterStep
+    from truthbench.steps.factual import FactualDataStep
+    from truthbench.steps.filter import FilterFactualDataStep
+    from truthbench.steps.noise import CreateNoiseExamplesStep
+    from truthbench.steps.paraphrase import ParaphraseStep
+    from truthbench.steps.rank import RankFactualDataStep
+
+    llm = EchoLLM()
+    pipeline = (
+        Pipeline(input_fields={"question", "ground_truth"}, parallel_steps=True)
+        .with_step(ParaphraseStep(llm))
+        .with_step(FactualDataStep(chunker=None))
+        .with_step(BlacklistItemsFromQuestionStep(set()))
+        .with_step(RankFactualDataStep(llm))
+        .with_step(FilterFactualDataStep())
+        .with_step(CreateNoiseExamplesStep(llm))
+        .with_step(CounterStep(5))
+    )
+
+    dependencies = pipeline.step_dependencies()
+
+    assert dependencies["BlacklistItemsFromQuestionStep"] == ["FactualDataStep"]
+    assert dependencies["RankFactualDataStep"] == ["FactualDataStep"]
+    assert "CreateNoiseExamplesStep" in dependencies["CounterStep"]
+
+
+def test_pipeline_parallel_steps_requires_input_fields():
+    with pytest.raises(ValueError):
+        Pipeline(parallel_steps=True)
+    with pytest.raises(ValueError):
+        Pipeline(input_fields={"foo"}, parallel_steps=True, staged=True)
+
+
+class ScaleStep(Step):
+    def __init__(self, factor):
+        super().__init__(
+            required_fields=frozenset({"bar"}), counters=frozenset({"scaled"}), produced_fields=frozenset({"scaled"})
+        )
+        self._factor = factor
+
+    def step(self, sample, tracker):
+        tracker["scaled"] += 1
+        sample["bar"] *= self._factor
+        sample["scaled"] = sample["bar"]
+
+
+@pytest.mark.parametrize("asynchronous", [False, True])
+def test_sweep_shares_prefix_between_branches(asynchronous):
+    prefix = Pipeline(with_progress=False, input_fields={"foo"}).with_step(ProducingStep("bar", fail={3}))
+    sweep = Sweep(prefix, {
+        f"x{factor}": Pipeline(with_progress=False, input_fields=prefix.output_fields).with_step(ScaleStep(factor))
+        for factor in (2, 10)
+    })
+    reader = DummyReader([{"foo": 1}, {"foo": 2}, {"foo": 3}])
+
+    results = asyncio.run(sweep.run_async(reader)) if asynchronous else sweep.run(reader)
+
+    assert prefix.output_fields == {"foo", "bar"}
+    assert [s.get("scaled") for s in results["x2"][0]] == [2, 4, None]
+    assert [s.get("scaled") for s in results["x10"][0]] == [10, 20, None]
+    # The prefix ran once per sample, and its counters are reported in every branch
+    assert results["x2"][1] == {"input_samples": 3, "calls": 3, "scaled": 2}
+    assert results["x10"][1] == {"input_samples": 3, "calls": 3, "scaled": 2}
+    assert list(sweep.step_metrics("x2")) == ["ProducingStep", "ScaleStep"]
+
+
+def test_sweep_requires_branches():
+    with pytest.raises(ValueError):
+        Sweep(Pipeline(), {})
+
+
 if __name__ == "__main__":
     unittest.main()
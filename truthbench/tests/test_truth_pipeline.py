@@ -0,0 +1,28 @@
+import unittest
+from unittest.mock import MagicMock
+
+import pytest
+import spacy
+
+from truthbench import truth_pipeline
+from truthbench.pipeline import LLM
+
+
+def test_model_is_not_loaded_in_parent_process_with_workers(monkeypatch):
+    monkeypatch.setattr(spacy.util, "is_package", lambda name: True)
+    monkeypatch.setattr(spacy, "load", MagicMock(side_effect=AssertionError("loaded in the parent process")))
+
+    pipeline = truth_pipeline(llm=MagicMock(spec=LLM), with_progress=False, processes=2)
+
+    assert "FactualDataStep" in pipeline.step_names()
+
+
+def test_missing_model_is_reported_with_workers(monkeypatch):
+    monkeypatch.setattr(spacy.util, "is_package", lambda name: False)
+
+    with pytest.raises(ImportError, match="en_core_web_sm"):
+        truth_pipeline(llm=MagicMock(spec=LLM), with_progress=False, processes=2)
+
+
+if __name__ == "__main__":
+    unittest.main()